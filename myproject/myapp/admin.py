@@ -1,4 +1,4 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 from myapp import models
 
 admin.site.register(models.User)
@@ -10,8 +10,55 @@ class UserAdmin(admin.ModelAdmin):
     list_filter = ("account",)
 
 
-admin.site.register(models.Product)
-admin.site.register(models.Account)
-admin.site.register(models.Order)
-admin.site.register(models.OrderItem)
+@admin.register(models.Product)
+class ProductAdmin(admin.ModelAdmin):
+    def formfield_for_dbfield(self, db_field, request, **kwargs):
+        formfield = super().formfield_for_dbfield(db_field, request, **kwargs)
+        if db_field.name == "quantity":
+            # the quantity the form was opened with comes back with it, so
+            # stock sold while it was open doesnt count as an edit
+            formfield.show_hidden_initial = True
+        return formfield
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and "quantity" in form.changed_data:
+            # Product.save leaves stock alone on an edit. the new quantity goes
+            # on as the difference from what the form showed, so sales made
+            # while it was open still count
+            field = form.fields["quantity"]
+            opened_with = field.to_python(
+                form.data.get(form.add_initial_prefix("quantity"))
+            )
+            change_by = obj.quantity - opened_with
+            if not models.Product.objects.move_stock({obj.pk: (change_by, 0)}):
+                self.message_user(
+                    request,
+                    f"Not enough stock left to take {-change_by} off {obj}.",
+                    messages.WARNING,
+                )
+            obj.refresh_from_db(fields=["quantity", "reserved"])
+
+
+@admin.register(models.Account)
+class AccountAdmin(admin.ModelAdmin):
+    # balances only change through AccountManager.change_balance, which writes
+    # the ledger row with it. an edit here would skip the ledger and show up
+    # as drift in reconcile_ledger
+    readonly_fields = ("balance",)
+
+
+@admin.register(models.Order)
+class OrderAdmin(admin.ModelAdmin):
+    # Order.__str__ shows the user's email
+    list_select_related = ("user",)
+
+
+@admin.register(models.OrderItem)
+class OrderItemAdmin(admin.ModelAdmin):
+    # OrderItem.__str__ shows the product name and order id, without this
+    # thats two more queries per row
+    list_select_related = ("order", "product")
+
+
 # these all show up on the admin site
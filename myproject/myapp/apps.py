@@ -5,5 +5,8 @@ class MyappConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "myapp"
 
+    def ready(self):
+        from myapp import signals  # noqa: F401 connects the receivers
+
 
 # followed a tutorial, not certain why this is here
@@ -0,0 +1,83 @@
+# myapp/authentication.py
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from rest_framework.authentication import TokenAuthentication
+
+
+class TokenCache:
+    # small LRU of token key -> Token (with its user loaded). its per process,
+    # so entries also expire after a ttl in case another process changed them
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[1] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key, token):
+        with self._lock:
+            self._entries[key] = (token, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def evict(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def evict_user(self, user_id):
+        with self._lock:
+            for key, (token, _) in list(self._entries.items()):
+                if token.user_id == user_id:
+                    del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "size": len(self._entries),
+            }
+
+
+token_cache = TokenCache(
+    max_size=getattr(settings, "TOKEN_CACHE_MAX_SIZE", 1024),
+    ttl=getattr(settings, "TOKEN_CACHE_TTL", 300),
+)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    # same as drf's TokenAuthentication but a cache hit doesnt touch the db
+    def authenticate_credentials(self, key):
+        token = token_cache.get(key)
+        if token is None:
+            user, token = super().authenticate_credentials(key)
+            token_cache.set(key, token)
+
+        # each request gets its own copy so nothing set on request.user leaks
+        # into the next request that uses the same token
+        return copy.copy(token.user), token
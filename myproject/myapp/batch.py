@@ -0,0 +1,206 @@
+# myapp/batch.py
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.handlers.wsgi import WSGIRequest
+from django.db import connection, transaction
+from django.urls import Resolver404, resolve
+
+from myapp.metrics import registry
+from myapp.middleware import QueryTimer
+
+logger = logging.getLogger(__name__)
+
+# POST /api/batch/ runs a list of api calls in this process and answers them
+# all in one response, so opening the app is one round trip instead of one
+# per call. each call reaches its view as a request of its own, with the
+# batch's headers and user, so throttles and permissions work as if it had
+# been sent on its own
+PREFIX = "/api/"
+MAX_CALLS = 20
+# streams cant be collected into one response, and batches dont nest. login
+# and register are left out so one request cant carry a pile of password
+# checks past the per request limits
+NOT_BATCHABLE = {
+    "batch",
+    "order-stream",
+    "order-export",
+    "student-bulk-create",
+    "login",
+    "register",
+}
+# headers that were about the batch request itself
+OWN_HEADERS = {"HTTP_IDEMPOTENCY_KEY", "HTTP_IF_NONE_MATCH", "HTTP_IF_MODIFIED_SINCE"}
+# sub responses leave out the headers that only matter to a real response
+LEFT_OUT_HEADERS = {"Content-Type", "Content-Length", "Vary", "Allow"}
+FAILED = {
+    "status": 500,
+    "headers": {},
+    "body": {"detail": "An internal error occurred."},
+}
+NOT_RUN = {
+    "status": 424,
+    "headers": {},
+    "body": {"detail": "Not run, an earlier request in the batch failed."},
+}
+
+
+def resolve_call(path):
+    path = urlsplit(path).path
+    if not path.startswith(PREFIX):
+        raise ValueError(f"Only {PREFIX} routes can be batched.")
+    try:
+        match = resolve(path)
+    except Resolver404:
+        raise ValueError(f"No route for {path}.")
+    if match.url_name in NOT_BATCHABLE:
+        raise ValueError(f"{path} can't be batched.")
+    return match
+
+
+def build_request(batch_request, call):
+    url = urlsplit(call["path"])
+    body = b""
+    if call.get("body") is not None:
+        body = json.dumps(call["body"]).encode()
+
+    environ = {
+        key: value
+        for key, value in batch_request.META.items()
+        if key.startswith("HTTP_") and key not in OWN_HEADERS
+    }
+    for name, value in call.get("headers", {}).items():
+        environ["HTTP_" + name.upper().replace("-", "_")] = value
+    environ.update(
+        {
+            "REQUEST_METHOD": call["method"],
+            "SCRIPT_NAME": batch_request.META.get("SCRIPT_NAME", ""),
+            "PATH_INFO": url.path,
+            "QUERY_STRING": url.query,
+            "REMOTE_ADDR": batch_request.META.get("REMOTE_ADDR", ""),
+            "SERVER_NAME": batch_request.META.get("SERVER_NAME", "localhost"),
+            "SERVER_PORT": batch_request.META.get("SERVER_PORT", "80"),
+            "CONTENT_TYPE": "application/json",
+            "CONTENT_LENGTH": str(len(body)),
+            "wsgi.input": io.BytesIO(body),
+            "wsgi.url_scheme": batch_request.scheme,
+        }
+    )
+    request = WSGIRequest(environ)
+    if batch_request.user.is_authenticated:
+        # the batch was authenticated once, drf's forced authentication hands
+        # every call the same user and token
+        request._force_auth_user = batch_request.user
+        request._force_auth_token = batch_request.auth
+    return request
+
+
+def run_call(batch_request, call):
+    # a call that blows up is a 500 for that call only, the client still
+    # needs to hear how the ones that already committed went
+    try:
+        return call_view(batch_request, call)
+    except Exception:
+        logger.exception("batched %s %s failed", call["method"], call["path"])
+        return FAILED
+
+
+def call_view(batch_request, call):
+    request = build_request(batch_request, call)
+    match = resolve_call(request.path_info)
+    request.resolver_match = match
+
+    # calls skip the middleware, so PerformanceMiddleware never sees them.
+    # they are counted here under their own route, the batch route counts
+    # the whole request on top
+    timer = QueryTimer()
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(timer):
+            response = match.func(request, *match.args, **match.kwargs)
+    finally:
+        registry.observe(
+            match.view_name,
+            time.perf_counter() - start,
+            timer.count,
+            timer.duration,
+        )
+
+    if hasattr(response, "data"):
+        # drf responses are left unrendered, the batch renders it all once
+        body = response.data
+    elif not response.content:
+        # a 304 for a page the app already has
+        body = None
+    elif response.get("Content-Type", "").startswith("application/json"):
+        body = json.loads(response.content)
+    else:
+        body = response.content.decode()
+    return {
+        "status": response.status_code,
+        "headers": {
+            name: value
+            for name, value in response.items()
+            if name not in LEFT_OUT_HEADERS
+        },
+        "body": body,
+    }
+
+
+def run(batch_request, calls, atomic=False):
+    # returns the results in the order the calls came in, and whether the
+    # batch was rolled back. outside atomic each call commits on its own
+    if atomic:
+        return run_atomic(batch_request, calls)
+
+    results = []
+    reads = []
+    for call in calls:
+        if call["method"] == "GET":
+            reads.append(call)
+            continue
+        # a write waits for the reads before it, and the reads after it wait
+        # for the write, so everything sees what came before it in the list
+        results += run_reads(batch_request, reads)
+        reads = []
+        results.append(run_call(batch_request, call))
+    results += run_reads(batch_request, reads)
+    return results, False
+
+
+def run_reads(batch_request, calls):
+    # other connections cant see what this one hasnt committed, so inside a
+    # transaction everything stays on this thread
+    workers = min(settings.BATCH_READ_WORKERS, len(calls))
+    if workers < 2 or connection.in_atomic_block:
+        return [run_call(batch_request, call) for call in calls]
+
+    def in_thread(call):
+        try:
+            return run_call(batch_request, call)
+        finally:
+            # the thread goes away with the pool, so does its connection
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(in_thread, calls))
+
+
+def run_atomic(batch_request, calls):
+    # all of it in one transaction, stopping at the first failure. everything
+    # before it is rolled back and everything after it isnt run
+    results = []
+    with transaction.atomic():
+        for call in calls:
+            result = run_call(batch_request, call)
+            results.append(result)
+            if result["status"] >= 400:
+                transaction.set_rollback(True)
+                break
+    rolled_back = results[-1]["status"] >= 400
+    return results + [NOT_RUN] * (len(calls) - len(results)), rolled_back
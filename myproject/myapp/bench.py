@@ -0,0 +1,50 @@
+# myapp/bench.py
+# helpers shared by the bench_* management commands. they all run against a
+# throwaway test database so the real db.sqlite3 never gets seeded
+import contextlib
+import statistics
+import time
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from myapp.metrics import percentile
+
+
+@contextlib.contextmanager
+def scratch_database(test_name=None):
+    # test_name puts the scratch database in a file, for sqlite that matters
+    # when the benchmark is about locking or journal modes
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    old_test_name = test_settings.get("NAME")
+    if test_name is not None:
+        test_settings["NAME"] = test_name
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+        test_settings["NAME"] = old_test_name
+
+
+def time_calls(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, timings
+
+
+def summarise(timings):
+    return {
+        "count": len(timings),
+        "mean_ms": round(statistics.fmean(timings), 3),
+        "p50_ms": round(percentile(timings, 50), 3),
+        "p95_ms": round(percentile(timings, 95), 3),
+        "p99_ms": round(percentile(timings, 99), 3),
+    }
@@ -0,0 +1,42 @@
+# myapp/catalogue.py
+import time
+
+from django.core.cache import cache
+
+# public lists (products, posts, profiles) only change when their rows do, so
+# the serialized pages are cached against a version number per namespace that
+# gets bumped whenever one of those rows changes
+PAGE_TIMEOUT = 60 * 60
+
+
+def get_version(namespace="catalogue"):
+    version = cache.get(f"{namespace}:version")
+    if version is None:
+        # nothing cached yet (or it got evicted), start a fresh version
+        version = bump_version(namespace)
+    return version
+
+
+def bump_version(namespace="catalogue"):
+    # microseconds since epoch, so it doubles as the last modified time
+    version = time.time_ns() // 1000
+    cache.set(f"{namespace}:version", version, None)
+    return version
+
+
+def last_modified(version):
+    return version // 1_000_000
+
+
+def page_key(namespace, version, url):
+    # the full url is part of the key because image links are absolute and
+    # the query string changes what comes back
+    return f"{namespace}:{version}:{url}"
+
+
+def get_page(namespace, version, url):
+    return cache.get(page_key(namespace, version, url))
+
+
+def set_page(namespace, version, url, data):
+    cache.set(page_key(namespace, version, url), data, PAGE_TIMEOUT)
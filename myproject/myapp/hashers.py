@@ -0,0 +1,14 @@
+# myapp/hashers.py
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher
+
+
+class TunedPBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    # same algorithm name as django's so existing hashes still check, but the
+    # cost comes from settings. when it changes, check_password rehashes the
+    # password on the next good login
+    @property
+    def iterations(self):
+        return getattr(
+            settings, "PASSWORD_HASH_ITERATIONS", PBKDF2PasswordHasher.iterations
+        )
@@ -0,0 +1,114 @@
+# myapp/idempotency.py
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+
+from myapp import models
+
+# phones on bad wifi retry POSTs they never got an answer for, so money moving
+# endpoints take an Idempotency-Key header and answer a retry with the stored
+# response instead of running it again
+HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+
+def fingerprint(request):
+    digest = hashlib.sha256()
+    digest.update(request.method.encode())
+    digest.update(request.path.encode())
+    digest.update(request.body)
+    return digest.hexdigest()
+
+
+def expired_before():
+    return timezone.now() - timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired():
+    deleted, _ = models.IdempotencyKey.objects.filter(
+        created_at__lt=expired_before()
+    ).delete()
+    return deleted
+
+
+def claim(user, key, request_fingerprint):
+    # inserting the row is what takes the key. a duplicate sent at the same
+    # time waits on the unique index (or on the write lock with sqlite) until
+    # the first one commits, then finds its finished response. returns
+    # (record, True) if this request got the key
+    for _ in range(2):
+        try:
+            with transaction.atomic():
+                record = models.IdempotencyKey.objects.create(
+                    user=user, key=key, fingerprint=request_fingerprint
+                )
+            return record, True
+        except IntegrityError:
+            record = models.IdempotencyKey.objects.get(user=user, key=key)
+
+        if record.created_at >= expired_before():
+            return record, False
+        # past its ttl and not purged yet, so the key is free again
+        models.IdempotencyKey.objects.filter(pk=record.pk).delete()
+    return record, False
+
+
+def replay(record, request_fingerprint):
+    if record.fingerprint != request_fingerprint:
+        return Response(
+            {"detail": f"This {HEADER} was used for a different request."},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    response = Response(record.response, status=record.status_code)
+    response["Idempotent-Replayed"] = "true"
+    return response
+
+
+def idempotent(handler):
+    # wraps a view's post/create. requests without the header run as normal
+    @functools.wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > MAX_KEY_LENGTH:
+            return Response(
+                {"detail": f"{HEADER} must be 1 to {MAX_KEY_LENGTH} characters."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        request_fingerprint = fingerprint(request)
+        # most retries come after the first one finished, one select answers them
+        record = models.IdempotencyKey.objects.filter(
+            user=request.user, key=key, created_at__gte=expired_before()
+        ).first()
+        if record is not None:
+            return replay(record, request_fingerprint)
+
+        with transaction.atomic():
+            record, claimed = claim(request.user, key, request_fingerprint)
+            if not claimed:
+                return replay(record, request_fingerprint)
+
+            response = handler(view, request, *args, **kwargs)
+            if not status.is_success(response.status_code):
+                # failures arent kept, the client can fix things and retry
+                # with the same key
+                transaction.set_rollback(True)
+                return response
+
+            # stored as the client will see it, decimals and all
+            record.status_code = response.status_code
+            record.response = json.loads(JSONRenderer().render(response.data))
+            record.save(update_fields=["status_code", "response"])
+        return response
+
+    return wrapper
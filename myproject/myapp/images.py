@@ -0,0 +1,102 @@
+# myapp/images.py
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, UnidentifiedImageError
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_DIR = "product_images/derivatives"
+
+
+def content_hash(field_file):
+    digest = hashlib.sha256()
+    field_file.open("rb")
+    field_file.seek(0)
+    for chunk in field_file.chunks():
+        digest.update(chunk)
+    field_file.seek(0)
+    return digest.hexdigest()
+
+
+def refresh_derivatives(product, force=False):
+    # makes the resized webp copies of product.image, only when the image is
+    # new or build_image_derivatives forces it. the names come from the
+    # content hash, so two products with the same picture share the files.
+    # returns whether any were made
+    if not product.image:
+        product.image_hash = ""
+        product.image_variants = {}
+        return False
+    if not force and not image_changed(product):
+        return False
+
+    made = False
+    try:
+        image_hash = content_hash(product.image)
+        variants = product.image_variants
+        if image_hash != product.image_hash or not variants_stored(variants):
+            variants = make_variants(product.image, image_hash)
+            made = True
+    except (UnidentifiedImageError, OSError):
+        # a file that is missing or pillow cant read just gets served as the
+        # original
+        logger.exception("Could not make image derivatives for %s", product)
+        image_hash, variants = "", {}
+    finally:
+        if product.image._committed:
+            # already in storage, nothing else needs the file open
+            product.image.close()
+        else:
+            product.image.seek(0)
+
+    product.image_hash = image_hash
+    product.image_variants = variants
+    return made
+
+
+def variants_stored(variants):
+    # the paths are only worth keeping if the files are still there
+    return bool(variants) and all(
+        default_storage.exists(name) for name in variants.values()
+    )
+
+
+def image_changed(product):
+    # a fresh upload, or a different stored file than the one it was loaded
+    # or last saved with, see Product.save
+    return not product.image._committed or product.image.name != getattr(
+        product, "_saved_image", None
+    )
+
+
+def make_variants(image, image_hash):
+    image.seek(0)
+    with Image.open(image) as source:
+        source.load()
+        variants = {}
+        for width in target_widths(source.width):
+            name = f"{DERIVATIVE_DIR}/{image_hash[:16]}-{width}.webp"
+            if not default_storage.exists(name):
+                default_storage.save(name, ContentFile(resize(source, width)))
+            variants[str(width)] = name
+    return variants
+
+
+def target_widths(source_width):
+    # never upscale, a small original just gets the one copy at its own size
+    widths = [width for width in settings.PRODUCT_IMAGE_WIDTHS if width < source_width]
+    return widths or [source_width]
+
+
+def resize(source, width):
+    height = max(1, round(source.height * width / source.width))
+    image = source.convert("RGBA").resize((width, height), Image.LANCZOS)
+
+    output = io.BytesIO()
+    image.save(output, "WEBP", quality=settings.PRODUCT_IMAGE_QUALITY)
+    return output.getvalue()
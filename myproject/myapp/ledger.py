@@ -0,0 +1,90 @@
+# myapp/ledger.py
+from decimal import Decimal
+
+from django.db.models import (
+    BigIntegerField,
+    DecimalField,
+    Max,
+    OuterRef,
+    Subquery,
+    Sum,
+    Value,
+)
+from django.db.models.functions import Coalesce
+
+from myapp import models
+
+MONEY = DecimalField(max_digits=10, decimal_places=2)
+CENT = Decimal("0.01")
+
+
+def take_snapshots():
+    # one snapshot per account that has had transactions since its last one,
+    # taken from the balance_after of its newest transaction
+    newest = (
+        models.WalletTransaction.objects.values("account")
+        .annotate(last_id=Max("id"))
+        .values("last_id")
+    )
+    already_snapshotted = models.BalanceSnapshot.objects.values("last_transaction")
+    transactions = (
+        models.WalletTransaction.objects.filter(id__in=newest)
+        .exclude(id__in=already_snapshotted)
+        .values_list("id", "account_id", "balance_after")
+    )
+    snapshots = [
+        models.BalanceSnapshot(
+            account_id=account_id, last_transaction_id=txn_id, balance=balance
+        )
+        for txn_id, account_id, balance in transactions.iterator(chunk_size=2000)
+    ]
+    models.BalanceSnapshot.objects.bulk_create(snapshots, batch_size=1000)
+    return len(snapshots)
+
+
+def with_rebuilt_balance(accounts):
+    # adds rebuilt_balance to each account: its last snapshot plus everything
+    # after it. with no snapshot that's just the whole ledger for the account
+    last_snapshot = models.BalanceSnapshot.objects.filter(
+        account=OuterRef("pk")
+    ).order_by("-id")
+    accounts = accounts.annotate(
+        snapshot_balance=Coalesce(
+            Subquery(last_snapshot.values("balance")[:1]), Value(0), output_field=MONEY
+        ),
+        snapshot_txn=Coalesce(
+            Subquery(last_snapshot.values("last_transaction_id")[:1]),
+            Value(0),
+            output_field=BigIntegerField(),
+        ),
+    )
+    tail = (
+        models.WalletTransaction.objects.filter(
+            account=OuterRef("pk"), id__gt=OuterRef("snapshot_txn")
+        )
+        .values("account")
+        .annotate(total=Sum("amount"))
+        .values("total")
+    )
+    return accounts.annotate(
+        tail_total=Coalesce(Subquery(tail), Value(0), output_field=MONEY)
+    )
+
+
+def rebuild_balance(account_id):
+    account = with_rebuilt_balance(models.Account.objects.filter(pk=account_id)).get()
+    return (account.snapshot_balance + account.tail_total).quantize(CENT)
+
+
+def reconcile(chunk_size=2000):
+    # one pass over every account, yields (account id, balance, rebuilt) for
+    # each one where Account.balance doesnt match the ledger
+    rows = (
+        with_rebuilt_balance(models.Account.objects.order_by("id"))
+        .values_list("id", "balance", "snapshot_balance", "tail_total")
+        .iterator(chunk_size=chunk_size)
+    )
+    for account_id, balance, snapshot_balance, tail_total in rows:
+        rebuilt = (snapshot_balance + tail_total).quantize(CENT)
+        if balance != rebuilt:
+            yield account_id, balance, rebuilt
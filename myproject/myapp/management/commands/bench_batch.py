@@ -0,0 +1,98 @@
+# myapp/management/commands/bench_batch.py
+import os
+import tempfile
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from myapp import bench, models
+
+
+class Command(BaseCommand):
+    help = "Times the app launch calls sent one by one against sending them as one /api/batch/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--orders", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=200)
+        parser.add_argument(
+            "--rtt-ms",
+            type=float,
+            default=150,
+            help="round trip added per request for the totals, school wifi",
+        )
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as tmp:
+            test_name = None
+            if connection.vendor == "sqlite":
+                # the batch's reader threads need a real file
+                test_name = os.path.join(tmp, "bench.sqlite3")
+            with bench.scratch_database(test_name):
+                self.seed(options["products"], options["orders"])
+                self.run(options["repeat"], options["rtt_ms"])
+
+    def seed(self, product_count, order_count):
+        products = models.Product.objects.bulk_create(
+            models.Product(name=f"Product {i}", type="food", price=Decimal("2.50"))
+            for i in range(product_count)
+        )
+        user = models.User.objects.create_user(
+            email="bench@example.com", username="bench", password="bench12345"
+        )
+        models.Account.objects.create(user=user, balance=100)
+        for i in range(order_count):
+            order = models.Order.objects.create(user=user, total_price=5)
+            models.OrderItem.objects.bulk_create(
+                models.OrderItem(order=order, product=product, price=product.price)
+                for product in products[i % 10 : i % 10 + 3]
+            )
+        self.headers = {
+            "HTTP_AUTHORIZATION": f"Token {Token.objects.create(user=user).key}"
+        }
+
+    def run(self, repeat, rtt_ms):
+        client = Client()
+        paths = [
+            reverse("accounts"),
+            reverse("product-list"),
+            reverse("order-list-create"),
+        ]
+        batch = {"requests": [{"method": "GET", "path": path} for path in paths]}
+
+        def one_by_one():
+            # the catalogue is cold each time, as it is for a phone that just
+            # opened the app after a menu change
+            cache.clear()
+            for path in paths:
+                client.get(path, **self.headers)
+
+        def batched():
+            cache.clear()
+            response = client.post(
+                reverse("batch"), batch, content_type="application/json", **self.headers
+            )
+            assert response.status_code == 200, response.content
+
+        scenarios = [
+            ("before: 3 requests", one_by_one, len(paths), None),
+            ("batch, one at a time", batched, 1, 1),
+            ("batch, reads side by side", batched, 1, 4),
+        ]
+        self.stdout.write(
+            f"{'scenario':<28}{'p50 ms':>9}{'p95 ms':>9}"
+            f"{'with ' + str(int(rtt_ms)) + 'ms rtt':>18}"
+        )
+        for name, call, round_trips, workers in scenarios:
+            with override_settings(BATCH_READ_WORKERS=workers or 1):
+                _, timings = bench.time_calls(call, repeat)
+            summary = bench.summarise(timings)
+            self.stdout.write(
+                f"{name:<28}{summary['p50_ms']:>9.2f}{summary['p95_ms']:>9.2f}"
+                f"{summary['p50_ms'] + round_trips * rtt_ms:>18.0f}"
+            )
@@ -0,0 +1,215 @@
+# myapp/management/commands/bench_load.py
+import json
+import os
+import random
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+
+from myapp import bench, models
+
+# lunch rush, weights are roughly how often the app makes each call
+TRAFFIC_MIX = {
+    "login": 5,
+    "product-list": 40,
+    "deposit": 10,
+    "withdrawel": 10,
+    "order-create": 15,
+    "order-history": 20,
+}
+PASSWORD = "lunchrush123"
+
+
+class Command(BaseCommand):
+    help = "Replays a lunch rush traffic mix against the app in process and reports per endpoint latency"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--clients", type=int, default=16)
+        parser.add_argument(
+            "--requests", type=int, default=100, help="per client, after its login"
+        )
+        parser.add_argument("--seed", type=int, default=1)
+        parser.add_argument("--output", default="bench_load.json")
+
+    def handle(self, *args, **options):
+        # every phone gets its own ip, and the point is to measure the api not
+        # the login throttle
+        limits = {
+            "email": {"capacity": 10**6, "per_seconds": 1},
+            "ip": {"capacity": 10**6, "per_seconds": 1},
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            test_name = None
+            if connection.vendor == "sqlite":
+                # threads need a real file, not the shared in-memory database
+                test_name = os.path.join(tmp, "bench.sqlite3")
+            with override_settings(LOGIN_RATE_LIMITS=limits):
+                with bench.scratch_database(test_name):
+                    self.seed(options["users"], options["products"])
+                    results = self.run(options)
+
+        with open(options["output"], "w") as output:
+            json.dump(results, output, indent=2)
+        self.report(results)
+        self.stdout.write(f"results written to {options['output']}")
+
+    def seed(self, user_count, product_count):
+        # one hash shared by everyone, hashing each password would take longer
+        # than the benchmark
+        password = make_password(PASSWORD)
+        users = models.User.objects.bulk_create(
+            [
+                models.User(
+                    email=f"student{i}@example.com",
+                    username=f"student{i}",
+                    password=password,
+                )
+                for i in range(user_count)
+            ],
+            batch_size=500,
+        )
+        models.Account.objects.bulk_create(
+            [models.Account(user=user, balance=Decimal("1000.00")) for user in users],
+            batch_size=500,
+        )
+        types = [choice for choice, _ in models.Product.TYPE_CHOICES]
+        models.Product.objects.bulk_create(
+            [
+                models.Product(
+                    name=f"Product {i}",
+                    type=types[i % len(types)],
+                    price=Decimal("12.50"),
+                    quantity=10**6,
+                )
+                for i in range(product_count)
+            ],
+            batch_size=500,
+        )
+        self.product_ids = list(models.Product.objects.values_list("id", flat=True))
+
+    def run(self, options):
+        user_count = options["users"]
+        names = list(TRAFFIC_MIX)
+        weights = list(TRAFFIC_MIX.values())
+
+        def client(number):
+            rng = random.Random(options["seed"] * 100_003 + number)
+            email = f"student{number % user_count}@example.com"
+            http = Client(REMOTE_ADDR=f"10.0.{number // 256}.{number % 256}")
+            timings = {name: [] for name in names}
+            errors = {name: 0 for name in names}
+
+            def call(name, method, path, data=None, token=None):
+                headers = {"HTTP_AUTHORIZATION": f"Token {token}"} if token else {}
+                start = time.perf_counter()
+                if method == "GET":
+                    response = http.get(path, **headers)
+                else:
+                    response = http.post(
+                        path, data, content_type="application/json", **headers
+                    )
+                timings[name].append((time.perf_counter() - start) * 1000)
+                if response.status_code >= 400:
+                    errors[name] += 1
+                    return None
+                return response
+
+            def login():
+                response = call(
+                    "login",
+                    "POST",
+                    "/api/login/",
+                    {"email": email, "password": PASSWORD},
+                )
+                return response.json()["token"] if response else None
+
+            try:
+                token = login()
+                for _ in range(options["requests"]):
+                    name = rng.choices(names, weights)[0]
+                    if name == "login":
+                        token = login()
+                    elif name == "product-list":
+                        call(name, "GET", "/api/products/?fields=id,name,price")
+                    elif name == "deposit":
+                        call(
+                            name,
+                            "POST",
+                            "/api/account/deposit/",
+                            {"depositAmount": "20.00"},
+                            token,
+                        )
+                    elif name == "withdrawel":
+                        call(
+                            name,
+                            "POST",
+                            "/api/account/withdrawel/",
+                            {"cart_Total": "5.00"},
+                            token,
+                        )
+                    elif name == "order-create":
+                        cart = [
+                            {"product_id": product_id, "quantity": rng.randint(1, 2)}
+                            for product_id in rng.sample(
+                                self.product_ids, rng.randint(1, 4)
+                            )
+                        ]
+                        call(name, "POST", "/api/orders/", {"items": cart}, token)
+                    elif name == "order-history":
+                        call(name, "GET", "/api/orders/", token=token)
+            finally:
+                connection.close()
+            return timings, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["clients"]) as pool:
+            results = list(pool.map(client, range(options["clients"])))
+        elapsed = time.perf_counter() - start
+
+        endpoints = {}
+        for name in names:
+            timings = [timing for result in results for timing in result[0][name]]
+            if not timings:
+                continue
+            endpoints[name] = {
+                **bench.summarise(timings),
+                "errors": sum(result[1][name] for result in results),
+                "requests_per_sec": round(len(timings) / elapsed, 2),
+            }
+
+        total = sum(endpoint["count"] for endpoint in endpoints.values())
+        return {
+            "options": {
+                key: options[key]
+                for key in ("users", "products", "clients", "requests", "seed")
+            },
+            "database": connection.vendor,
+            "elapsed_sec": round(elapsed, 3),
+            "requests": total,
+            "requests_per_sec": round(total / elapsed, 2),
+            "endpoints": endpoints,
+        }
+
+    def report(self, results):
+        self.stdout.write(
+            f"{'endpoint':<16}{'count':>7}{'err':>5}{'req/s':>9}"
+            f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+        )
+        for name, endpoint in results["endpoints"].items():
+            self.stdout.write(
+                f"{name:<16}{endpoint['count']:>7}{endpoint['errors']:>5}"
+                f"{endpoint['requests_per_sec']:>9.1f}{endpoint['p50_ms']:>9.2f}"
+                f"{endpoint['p95_ms']:>9.2f}{endpoint['p99_ms']:>9.2f}"
+            )
+        self.stdout.write(
+            f"{results['requests']} requests in {results['elapsed_sec']}s, "
+            f"{results['requests_per_sec']} req/s"
+        )
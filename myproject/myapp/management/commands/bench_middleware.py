@@ -0,0 +1,99 @@
+# myapp/management/commands/bench_middleware.py
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authtoken.models import Token
+
+from myapp import bench, models
+
+# what MIDDLEWARE was before the browser middleware learnt to skip /api/
+FULL_MIDDLEWARE = [
+    "myapp.middleware.PerformanceMiddleware",
+    "django.middleware.security.SecurityMiddleware",
+    "django.contrib.sessions.middleware.SessionMiddleware",
+    "corsheaders.middleware.CorsMiddleware",
+    "django.middleware.common.CommonMiddleware",
+    "django.middleware.csrf.CsrfViewMiddleware",
+    "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "django.contrib.messages.middleware.MessageMiddleware",
+    "django.middleware.clickjacking.XFrameOptionsMiddleware",
+]
+
+
+class Command(BaseCommand):
+    help = "Times /api/products/ through the full browser middleware stack and through the lean one"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=50)
+        parser.add_argument("--repeat", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        with bench.scratch_database():
+            self.seed(options["products"])
+            self.run(options["repeat"])
+
+    def seed(self, count):
+        models.Product.objects.bulk_create(
+            models.Product(name=f"Product {i}", type="food", price=Decimal("2.50"))
+            for i in range(count)
+        )
+        self.user = models.User.objects.create_user(
+            email="bench@example.com", username="bench", password="bench12345"
+        )
+        self.token = Token.objects.create(user=self.user).key
+
+    def run(self, repeat):
+        # the catalogue stays cached so the view costs next to nothing and
+        # what's left is mostly middleware
+        self.stdout.write(
+            f"{'scenario':<24}{'stack':>6}{'queries':>9}{'p50 ms':>9}{'mean ms':>9}"
+        )
+        for name, headers, with_session in [
+            ("token, no cookies", {"HTTP_AUTHORIZATION": f"Token {self.token}"}, False),
+            ("anonymous", {}, False),
+            ("admin session cookie", {}, True),
+        ]:
+            clients = {
+                "full": self.client(FULL_MIDDLEWARE, with_session, headers),
+                "lean": self.client(settings.MIDDLEWARE, with_session, headers),
+            }
+            # taking turns, so the machine getting busier or quieter part way
+            # through lands on both the same
+            timings = {stack: [] for stack in clients}
+            for _ in range(repeat):
+                for stack, client in clients.items():
+                    _, took = bench.time_calls(
+                        lambda: client.get("/api/products/", **headers), 1
+                    )
+                    timings[stack] += took
+
+            for stack, client in clients.items():
+                with CaptureQueriesContext(connection) as queries:
+                    client.get("/api/products/", **headers)
+                summary = bench.summarise(timings[stack])
+                self.stdout.write(
+                    f"{name:<24}{stack:>6}{len(queries):>9}"
+                    f"{summary['p50_ms']:>9.3f}{summary['mean_ms']:>9.3f}"
+                )
+            saved = (
+                bench.summarise(timings["full"])["p50_ms"]
+                - bench.summarise(timings["lean"])["p50_ms"]
+            )
+            self.stdout.write(f"{'':<24}saved {saved * 1000:.0f}us per request at p50")
+
+    def client(self, middleware, with_session, headers):
+        # the middleware chain is built on the first request and kept, so
+        # each client stays on the stack it started with
+        with override_settings(MIDDLEWARE=middleware):
+            client = Client()
+            if with_session:
+                client.force_login(self.user)
+            cache.clear()
+            response = client.get("/api/products/", **headers)
+        assert response.status_code == 200, response.content
+        return client
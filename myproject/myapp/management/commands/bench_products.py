@@ -0,0 +1,81 @@
+# myapp/management/commands/bench_products.py
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework import generics
+from rest_framework.permissions import AllowAny
+from rest_framework.test import APIRequestFactory
+
+from myapp import bench, models, serializers, views
+
+
+# what /api/products/ used to do, every product with every field
+class UnpaginatedProductsView(generics.ListAPIView):
+    queryset = models.Product.objects.all()
+    serializer_class = serializers.ProductSerializer
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+
+class Command(BaseCommand):
+    help = (
+        "Compares /api/products/ payload size and latency before and after pagination"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=10000)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        with bench.scratch_database():
+            self.seed(options["products"])
+            self.run(options["repeat"])
+
+    def seed(self, count):
+        types = [choice for choice, _ in models.Product.TYPE_CHOICES]
+        models.Product.objects.bulk_create(
+            [
+                models.Product(
+                    name=f"Product {i}",
+                    type=types[i % len(types)],
+                    image="product_images/coke.png",
+                    price=Decimal("12.50"),
+                    quantity=20,
+                )
+                for i in range(count)
+            ],
+            batch_size=500,
+        )
+        self.stdout.write(f"seeded {count} products")
+
+    def run(self, repeat):
+        factory = APIRequestFactory()
+        before = UnpaginatedProductsView.as_view()
+        after = views.ProductsListView.as_view()
+
+        def call(view, query="", keep_cache=False):
+            def request():
+                if not keep_cache:
+                    cache.clear()
+                response = view(factory.get("/api/products/" + query))
+                response.render()
+                return response
+
+            return request
+
+        scenarios = [
+            ("before: full list", call(before)),
+            ("after: first page", call(after)),
+            ("after: first page, id,name,price", call(after, "?fields=id,name,price")),
+            ("after: cached page", call(after, keep_cache=True)),
+        ]
+
+        self.stdout.write(f"{'scenario':<36}{'bytes':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, request in scenarios:
+            response, timings = bench.time_calls(request, repeat)
+            summary = bench.summarise(timings)
+            self.stdout.write(
+                f"{name:<36}{len(response.content):>10}"
+                f"{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+            )
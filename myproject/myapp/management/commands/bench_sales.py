@@ -0,0 +1,125 @@
+# myapp/management/commands/bench_sales.py
+import datetime
+import random
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db.models import DecimalField, F, Sum
+from django.utils import timezone
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp import bench, models, rollups, views
+
+
+class Command(BaseCommand):
+    help = "Times the sales analytics endpoints on years of orders, against adding up OrderItem directly"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=3 * 365)
+        parser.add_argument("--orders-per-day", type=int, default=100)
+        parser.add_argument("--products", type=int, default=200)
+        parser.add_argument("--repeat", type=int, default=30)
+
+    def handle(self, *args, **options):
+        with bench.scratch_database():
+            self.seed(options["days"], options["orders_per_day"], options["products"])
+
+            start = time.perf_counter()
+            added = rollups.catch_up()
+            self.stdout.write(
+                f"rolled up {added} orders in {time.perf_counter() - start:.2f}s"
+            )
+            self.run(options["days"], options["repeat"])
+
+    def seed(self, days, orders_per_day, product_count):
+        rng = random.Random(7)
+        types = [choice for choice, _ in models.Product.TYPE_CHOICES]
+        products = models.Product.objects.bulk_create(
+            models.Product(
+                name=f"Product {i}", type=types[i % len(types)], price=Decimal("2.50")
+            )
+            for i in range(product_count)
+        )
+        user = models.User.objects.create(email="bench@example.com", username="bench")
+
+        today = timezone.localdate()
+        for day_number in range(days):
+            day = today - datetime.timedelta(days=day_number)
+            noon = timezone.make_aware(
+                datetime.datetime.combine(day, datetime.time(12))
+            )
+            orders = models.Order.objects.bulk_create(
+                models.Order(user=user, total_price=5) for _ in range(orders_per_day)
+            )
+            # order_date is auto_now_add, so the day gets set afterwards
+            models.Order.objects.filter(id__in=[order.id for order in orders]).update(
+                order_date=noon
+            )
+            models.OrderItem.objects.bulk_create(
+                models.OrderItem(
+                    order=order,
+                    product=rng.choice(products),
+                    price=Decimal("2.50"),
+                    quantity=rng.randint(1, 3),
+                )
+                for order in orders
+                for _ in range(2)
+            )
+        self.stdout.write(
+            f"seeded {days * orders_per_day} orders over {days} days, "
+            f"{models.OrderItem.objects.count()} items"
+        )
+
+    def run(self, days, repeat):
+        factory = APIRequestFactory()
+        staff = models.User(is_staff=True)
+        summary_view = views.SalesSummaryView.as_view()
+        top_view = views.TopSellersView.as_view()
+        today = timezone.localdate()
+
+        def call(view, back):
+            query = {
+                "date_from": today - datetime.timedelta(days=back),
+                "date_to": today,
+            }
+
+            def request():
+                request = factory.get("/api/analytics/", query)
+                force_authenticate(request, staff)
+                return view(request).data
+
+            return request
+
+        def scan(back):
+            # what answering it from the orders themselves costs
+            date_from = today - datetime.timedelta(days=back)
+            return lambda: list(
+                models.OrderItem.objects.filter(order__order_date__date__gte=date_from)
+                .values("product__type")
+                .annotate(
+                    units=Sum("quantity"),
+                    revenue=Sum(
+                        F("price") * F("quantity"),
+                        output_field=DecimalField(max_digits=14, decimal_places=2),
+                    ),
+                )
+            )
+
+        scenarios = [
+            (f"before: scan items, {days} days", scan(days)),
+            ("summary, today", call(summary_view, 0)),
+            ("summary, 30 days", call(summary_view, 29)),
+            ("summary, 365 days", call(summary_view, 364)),
+            (f"summary, {days} days", call(summary_view, days - 1)),
+            ("top sellers, 30 days", call(top_view, 29)),
+            (f"top sellers, {days} days", call(top_view, days - 1)),
+        ]
+
+        self.stdout.write(f"{'scenario':<34}{'p50 ms':>10}{'p95 ms':>10}")
+        for name, request in scenarios:
+            _, timings = bench.time_calls(request, repeat)
+            summary = bench.summarise(timings)
+            self.stdout.write(
+                f"{name:<34}{summary['p50_ms']:>10.2f}{summary['p95_ms']:>10.2f}"
+            )
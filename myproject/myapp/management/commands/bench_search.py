@@ -0,0 +1,118 @@
+# myapp/management/commands/bench_search.py
+import itertools
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from rest_framework.test import APIRequestFactory
+
+from myapp import bench, models, views
+
+FLAVOURS = [
+    "Salt",
+    "Vinegar",
+    "Cheese",
+    "Chilli",
+    "Chocolate",
+    "Strawberry",
+    "Mint",
+    "Caramel",
+    "Lemon",
+    "Orange",
+    "Barbecue",
+    "Sour",
+]
+# item and the type it's sold under
+ITEMS = {
+    "Chips": "chips",
+    "Bar": "sweets",
+    "Juice": "drinks",
+    "Soda": "drinks",
+    "Pie": "food",
+    "Wrap": "food",
+    "Cookie": "sweets",
+    "Gummies": "sweets",
+}
+SIZES = ["Mini", "Regular", "Large", "Family"]
+TARGET_MS = 10
+
+
+class Command(BaseCommand):
+    help = "Times ?q= and ?type= on /api/products/ against a big catalogue"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=100000)
+        parser.add_argument("--repeat", type=int, default=50)
+
+    def handle(self, *args, **options):
+        with bench.scratch_database():
+            self.seed(options["products"])
+            self.run(options["repeat"])
+
+    def seed(self, count):
+        names = itertools.cycle(itertools.product(SIZES, FLAVOURS, ITEMS))
+        models.Product.objects.bulk_create(
+            (
+                models.Product(
+                    name=f"{size} {flavour} {item} {i}",
+                    type=ITEMS[item],
+                    price=Decimal("12.50"),
+                    quantity=20,
+                )
+                for i, (size, flavour, item) in zip(range(count), names)
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(f"seeded {count} products")
+
+    def run(self, repeat):
+        factory = APIRequestFactory()
+        view = views.ProductsListView.as_view()
+
+        def call(query):
+            def request():
+                # cold every time so it's the database doing the work
+                cache.clear()
+                response = view(factory.get("/api/products/", query))
+                response.render()
+                return len(response.data["results"])
+
+            return request
+
+        def scan(words):
+            # what searching looked like without the index
+            return lambda: len(
+                models.Product.objects.filter(name__icontains=words)
+                .order_by("id")
+                .values_list("id", "name", "price")[:50]
+            )
+
+        # the search box only needs these, the full page is there to show how
+        # much of the time is serializing rather than searching
+        box = {"fields": "id,name,price"}
+        scenarios = [
+            ("before: icontains scan", scan("sour gummies 77")),
+            ("type=sweets", call({**box, "type": "sweets"})),
+            ("q=choc", call({**box, "q": "choc"})),
+            ("q=choc, every field", call({"q": "choc"})),
+            ("q=choc bar", call({**box, "q": "choc bar"})),
+            (
+                "q=choc bar&type=sweets",
+                call({**box, "q": "choc bar", "type": "sweets"}),
+            ),
+            ("q=family sour gummies 77", call({**box, "q": "family sour gummies 77"})),
+            ("q=nothing", call({**box, "q": "nothing"})),
+        ]
+
+        self.stdout.write(
+            f"{'scenario':<30}{'rows':>6}{'p50 ms':>10}{'p95 ms':>10}"
+            f"{'under ' + str(TARGET_MS) + 'ms':>12}"
+        )
+        for name, request in scenarios:
+            rows, timings = bench.time_calls(request, repeat)
+            summary = bench.summarise(timings)
+            self.stdout.write(
+                f"{name:<30}{rows:>6}{summary['p50_ms']:>10.2f}"
+                f"{summary['p95_ms']:>10.2f}"
+                f"{'yes' if summary['p95_ms'] < TARGET_MS else 'no':>12}"
+            )
@@ -0,0 +1,101 @@
+# myapp/management/commands/bench_sqlite_writes.py
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from myapp import bench, models, views
+
+# what a plain sqlite3 database did before SQLITE_PRAGMAS existed
+BASELINE_PRAGMAS = {"journal_mode": "DELETE", "synchronous": "FULL"}
+# the scratch database is thrown away, so it can always have WAL
+WAL_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL"}
+
+
+class Command(BaseCommand):
+    help = "Parallel checkout writes against a file backed sqlite database, default vs tuned pragmas"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--orders", type=int, default=50, help="per thread")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            self.stderr.write("this benchmark is for the sqlite profile")
+            return
+
+        from django.conf import settings
+
+        profiles = [
+            ("baseline", BASELINE_PRAGMAS),
+            ("tuned", {**settings.SQLITE_PRAGMAS, **WAL_PRAGMAS}),
+        ]
+        for name, pragmas in profiles:
+            with tempfile.TemporaryDirectory() as tmp:
+                with override_settings(SQLITE_PRAGMAS=pragmas):
+                    with bench.scratch_database(os.path.join(tmp, "bench.sqlite3")):
+                        self.run(name, options["threads"], options["orders"])
+
+    def run(self, name, threads, orders):
+        users = []
+        for i in range(threads):
+            user = models.User.objects.create(
+                email=f"bench{i}@example.com", username=f"bench{i}"
+            )
+            models.Account.objects.create(user=user, balance=Decimal("100000.00"))
+            users.append(user)
+        products = models.Product.objects.bulk_create(
+            [
+                models.Product(
+                    name=f"Product {i}",
+                    type="food",
+                    price=Decimal("5.00"),
+                    quantity=10**6,
+                )
+                for i in range(5)
+            ]
+        )
+        cart = {
+            "items": [{"product_id": product.id, "quantity": 1} for product in products]
+        }
+        view = views.CheckoutView.as_view()
+        factory = APIRequestFactory()
+
+        def client(user):
+            timings = []
+            errors = 0
+            try:
+                for _ in range(orders):
+                    request = factory.post("/api/checkout/", cart, format="json")
+                    force_authenticate(request, user=user)
+                    start = time.perf_counter()
+                    try:
+                        response = view(request)
+                        if response.status_code != 201:
+                            errors += 1
+                    except Exception:
+                        errors += 1
+                    timings.append((time.perf_counter() - start) * 1000)
+            finally:
+                connection.close()
+            return timings, errors
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(client, users))
+        elapsed = time.perf_counter() - start
+
+        timings = [timing for result in results for timing in result[0]]
+        errors = sum(result[1] for result in results)
+        summary = bench.summarise(timings)
+        self.stdout.write(
+            f"{name:<10} {len(timings) / elapsed:8.1f} orders/s  "
+            f"p50 {summary['p50_ms']:7.2f} ms  p95 {summary['p95_ms']:7.2f} ms  "
+            f"p99 {summary['p99_ms']:7.2f} ms  errors {errors}"
+        )
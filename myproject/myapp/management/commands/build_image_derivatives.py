@@ -0,0 +1,30 @@
+# myapp/management/commands/build_image_derivatives.py
+from django.core.management.base import BaseCommand
+
+from myapp import images, models
+
+
+class Command(BaseCommand):
+    help = "Makes the resized webp copies for products saved before they existed"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="also recheck products that have derivatives, and remake any "
+            "whose files are missing from storage",
+        )
+
+    def handle(self, *args, **options):
+        products = models.Product.objects.exclude(image="")
+        if not options["force"]:
+            products = products.filter(image_variants={})
+
+        built = 0
+        for product in products.iterator():
+            old = product.image_hash, product.image_variants
+            made = images.refresh_derivatives(product, force=True)
+            if made or (product.image_hash, product.image_variants) != old:
+                product.save(update_fields=["image_hash", "image_variants"])
+            built += made
+        self.stdout.write(f"built image derivatives for {built} products")
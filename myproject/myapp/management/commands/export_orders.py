@@ -0,0 +1,52 @@
+# myapp/management/commands/export_orders.py
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import exports, serializers
+
+
+class Command(BaseCommand):
+    help = "Streams every order item with its order and product to CSV or JSON lines, same as /api/orders/export/"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--from", dest="date_from", help="YYYY-MM-DD")
+        parser.add_argument("--to", dest="date_to", help="YYYY-MM-DD, inclusive")
+        parser.add_argument(
+            "--status", action="append", default=[], help="can be given more than once"
+        )
+        parser.add_argument("--format", dest="output", choices=["csv", "jsonl"])
+        parser.add_argument(
+            "--output", dest="path", help="file to write, default stdout"
+        )
+        parser.add_argument("--chunk", type=int, default=exports.CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        data = {
+            key: options[key]
+            for key in ("date_from", "date_to", "status", "output")
+            if options[key]
+        }
+        serializer = serializers.OrderExportSerializer(data=data)
+        if not serializer.is_valid():
+            raise CommandError(serializer.errors)
+        validated = serializer.validated_data
+
+        rows = exports.export_rows(
+            date_from=validated.get("date_from"),
+            date_to=validated.get("date_to"),
+            statuses=validated.get("status"),
+            chunk_size=options["chunk"],
+        )
+        write_lines, _ = exports.FORMATS[validated["output"]]
+
+        # the csv header isnt an item
+        count = -1 if validated["output"] == "csv" else 0
+        if options["path"]:
+            with open(options["path"], "w", newline="", encoding="utf-8") as out:
+                for line in write_lines(rows):
+                    out.write(line)
+                    count += 1
+        else:
+            for line in write_lines(rows):
+                self.stdout.write(line, ending="")
+                count += 1
+        self.stderr.write(f"{count} order items exported")
@@ -0,0 +1,44 @@
+# myapp/management/commands/provision_students.py
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import provisioning
+
+
+class Command(BaseCommand):
+    help = "Creates students (with accounts and profiles) from a CSV of email,username,password"
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_file")
+        parser.add_argument(
+            "--workers", type=int, default=None, help="hashing processes"
+        )
+        parser.add_argument("--chunk", type=int, default=500)
+
+    def handle(self, *args, **options):
+        with open(options["csv_file"], newline="", encoding="utf-8-sig") as csv_file:
+            text = csv_file.read()
+
+        # a pool just for this run, it goes away with the command
+        pool = provisioning.new_pool(options["workers"] or os.cpu_count() or 1)
+        try:
+            rows = provisioning.read_csv(text)
+            created = errors = 0
+            for result in provisioning.provision(
+                rows, pool=pool, chunk_size=options["chunk"]
+            ):
+                # one json line per row, so the output can be piped or saved
+                self.stdout.write(json.dumps(result))
+                if result["status"] == "created":
+                    created += 1
+                else:
+                    errors += 1
+        except ValueError as e:
+            raise CommandError(str(e))
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        self.stderr.write(f"{created} created, {errors} errors")
@@ -0,0 +1,11 @@
+# myapp/management/commands/purge_idempotency_keys.py
+from django.core.management.base import BaseCommand
+
+from myapp import idempotency
+
+
+class Command(BaseCommand):
+    help = "Deletes stored Idempotency-Key responses older than IDEMPOTENCY_KEY_TTL, run it from cron"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{idempotency.purge_expired()} expired keys deleted")
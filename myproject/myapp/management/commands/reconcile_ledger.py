@@ -0,0 +1,25 @@
+# myapp/management/commands/reconcile_ledger.py
+from django.core.management.base import BaseCommand, CommandError
+
+from myapp import ledger, models
+
+
+class Command(BaseCommand):
+    help = "Checks every Account.balance against its snapshot plus wallet transactions"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        mismatches = 0
+        for account_id, balance, rebuilt in ledger.reconcile(options["chunk"]):
+            mismatches += 1
+            self.stdout.write(
+                f"account {account_id}: balance {balance}, ledger says {rebuilt}"
+            )
+
+        if mismatches:
+            raise CommandError(f"{mismatches} accounts dont match the ledger")
+        self.stdout.write(
+            f"all {models.Account.objects.count()} accounts match the ledger"
+        )
@@ -0,0 +1,15 @@
+# myapp/management/commands/release_reservations.py
+from django.core.management.base import BaseCommand
+
+from myapp import reservations
+
+
+class Command(BaseCommand):
+    help = "Puts stock held by expired cart reservations back on the shelf, run it from cron"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=reservations.SWEEP_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        released = reservations.release_expired(options["batch"])
+        self.stdout.write(f"{released} expired reservations released")
@@ -0,0 +1,28 @@
+# myapp/management/commands/rollup_sales.py
+from django.core.management.base import BaseCommand
+
+from myapp import models, rollups
+
+
+class Command(BaseCommand):
+    help = "Adds orders past the watermark to the sales rollups, run it from cron every minute or so"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch", type=int, default=rollups.BATCH_SIZE)
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="empty the rollups and add every order again",
+        )
+
+    def handle(self, *args, **options):
+        if options["rebuild"]:
+            added = rollups.rebuild(options["batch"])
+        else:
+            added = rollups.catch_up(options["batch"])
+
+        mark = models.RollupWatermark.objects.filter(name=rollups.WATERMARK).first()
+        last_order_id = mark.last_order_id if mark else 0
+        self.stdout.write(
+            f"{added} orders added, rollups are up to order {last_order_id}"
+        )
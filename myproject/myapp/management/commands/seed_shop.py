@@ -0,0 +1,190 @@
+# myapp/management/commands/seed_shop.py
+import contextlib
+import random
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from myapp import models
+
+
+@contextlib.contextmanager
+def without_auto_now_add(model, field_name):
+    # bulk_create would stamp every order with now(), the seed wants them
+    # spread out over the term
+    field = model._meta.get_field(field_name)
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Fills the database with lots of fake users, products and orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100_000)
+        parser.add_argument("--products", type=int, default=2_000)
+        parser.add_argument("--orders", type=int, default=300_000)
+        parser.add_argument(
+            "--max-items", type=int, default=6, help="most lines in one order"
+        )
+        parser.add_argument("--days", type=int, default=120, help="spread of orders")
+        parser.add_argument("--chunk", type=int, default=5_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--password", default="seedpass123")
+        parser.add_argument("--prefix", default="seed")
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options["seed"])
+        self.chunk = options["chunk"]
+        self.counts = {}
+        self.started = time.perf_counter()
+
+        prefix = options["prefix"]
+        if models.User.objects.filter(email__startswith=f"{prefix}0@").exists():
+            raise CommandError(
+                f"users with the prefix '{prefix}' already exist, pick another --prefix"
+            )
+
+        user_ids = self.seed_users(options["users"], prefix, options["password"])
+        products = self.seed_products(options["products"])
+        self.seed_orders(
+            options["orders"], user_ids, products, options["max_items"], options["days"]
+        )
+
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.counts.values())
+        for name, count in self.counts.items():
+            self.stdout.write(f"{name:<12}{count:>12,}")
+        self.stdout.write(
+            f"{total:,} rows in {elapsed:.1f}s, {total / elapsed:,.0f} rows/s"
+        )
+
+    def chunks(self, count):
+        for start in range(0, count, self.chunk):
+            yield range(start, min(count, start + self.chunk))
+
+    def progress(self, name, added):
+        self.counts[name] = self.counts.get(name, 0) + added
+        elapsed = time.perf_counter() - self.started
+        total = sum(self.counts.values())
+        self.stdout.write(
+            f"\r{name}: {self.counts[name]:,} ({total / elapsed:,.0f} rows/s)",
+            ending="",
+        )
+        self.stdout.flush()
+
+    def seed_users(self, count, prefix, password):
+        # hashing is the slow part of making a user, so everyone shares one
+        password_hash = make_password(password)
+        user_ids = []
+        for chunk in self.chunks(count):
+            with transaction.atomic():
+                users = models.User.objects.bulk_create(
+                    [
+                        models.User(
+                            email=f"{prefix}{i}@example.com",
+                            username=f"{prefix}{i}",
+                            password=password_hash,
+                        )
+                        for i in chunk
+                    ]
+                )
+                accounts = models.Account.objects.bulk_create(
+                    [
+                        models.Account(
+                            user=user,
+                            balance=Decimal(self.rng.randint(0, 50000)) / 100,
+                        )
+                        for user in users
+                    ]
+                )
+                # so the seeded balances reconcile against the ledger
+                models.WalletTransaction.objects.bulk_create(
+                    [
+                        models.WalletTransaction(
+                            account=account,
+                            kind="opening",
+                            amount=account.balance,
+                            balance_after=account.balance,
+                        )
+                        for account in accounts
+                    ]
+                )
+            user_ids += [user.id for user in users]
+            self.progress("users", len(users))
+            self.progress("accounts", len(users))
+            self.progress("ledger", len(users))
+        self.stdout.write("")
+        return user_ids
+
+    def seed_products(self, count):
+        types = [choice for choice, _ in models.Product.TYPE_CHOICES]
+        products = []
+        for chunk in self.chunks(count):
+            products += models.Product.objects.bulk_create(
+                [
+                    models.Product(
+                        name=f"{self.rng.choice(types).title()} {i}",
+                        type=self.rng.choice(types),
+                        price=Decimal(self.rng.randint(500, 6000)) / 100,
+                        quantity=self.rng.randint(0, 500),
+                    )
+                    for i in chunk
+                ]
+            )
+            self.progress("products", len(chunk))
+        self.stdout.write("")
+        return products
+
+    def seed_orders(self, count, user_ids, products, max_items, days):
+        statuses = [choice for choice, _ in models.Order.STATUS_CHOICES]
+        start = timezone.now() - timedelta(days=days)
+        span = days * 24 * 60 * 60
+
+        with without_auto_now_add(models.Order, "order_date"):
+            for chunk in self.chunks(count):
+                orders = []
+                lines = []
+                for _ in chunk:
+                    cart = self.rng.sample(products, self.rng.randint(1, max_items))
+                    quantities = [self.rng.randint(1, 3) for _ in cart]
+                    orders.append(
+                        models.Order(
+                            user_id=self.rng.choice(user_ids),
+                            status=self.rng.choice(statuses),
+                            order_date=start
+                            + timedelta(seconds=self.rng.randrange(span)),
+                            total_price=sum(
+                                product.price * quantity
+                                for product, quantity in zip(cart, quantities)
+                            ),
+                        )
+                    )
+                    lines.append(list(zip(cart, quantities)))
+
+                with transaction.atomic():
+                    models.Order.objects.bulk_create(orders)
+                    items = models.OrderItem.objects.bulk_create(
+                        [
+                            models.OrderItem(
+                                order=order,
+                                product=product,
+                                price=product.price,
+                                quantity=quantity,
+                            )
+                            for order, order_lines in zip(orders, lines)
+                            for product, quantity in order_lines
+                        ],
+                        batch_size=self.chunk,
+                    )
+                self.progress("orders", len(orders))
+                self.progress("order items", len(items))
+        self.stdout.write("")
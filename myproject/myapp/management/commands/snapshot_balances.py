@@ -0,0 +1,11 @@
+# myapp/management/commands/snapshot_balances.py
+from django.core.management.base import BaseCommand
+
+from myapp import ledger
+
+
+class Command(BaseCommand):
+    help = "Snapshots the balance of every account with new wallet transactions, run it from cron"
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{ledger.take_snapshots()} snapshots taken")
@@ -0,0 +1,116 @@
+# myapp/metrics.py
+import threading
+from collections import deque
+
+# upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# how many recent requests per route the percentiles are worked out from
+SAMPLE_SIZE = 1000
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))
+    return ordered[index]
+
+
+class RouteStats:
+    def __init__(self):
+        self.bucket_counts = [0] * len(BUCKETS)
+        self.count = 0
+        self.duration_sum = 0.0
+        self.queries = 0
+        self.db_duration_sum = 0.0
+        self.samples = deque(maxlen=SAMPLE_SIZE)
+
+    def observe(self, duration, queries, db_duration):
+        self.count += 1
+        self.duration_sum += duration
+        self.queries += queries
+        self.db_duration_sum += db_duration
+        self.samples.append(duration)
+        for i, bound in enumerate(BUCKETS):
+            if duration <= bound:
+                self.bucket_counts[i] += 1
+
+
+class Registry:
+    # per process, in memory. its reset when the server restarts
+    def __init__(self):
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def observe(self, route, duration, queries, db_duration):
+        with self._lock:
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = RouteStats()
+            stats.observe(duration, queries, db_duration)
+
+    def reset(self):
+        with self._lock:
+            self._routes.clear()
+
+    def percentiles(self, route):
+        with self._lock:
+            samples = list(self._routes[route].samples)
+        return {pct: percentile(samples, pct) for pct in (50, 95, 99)}
+
+    def render(self):
+        # prometheus text exposition format
+        duration = "tuckshop_request_duration_seconds"
+        latency = "tuckshop_request_latency_seconds"
+        lines = []
+
+        with self._lock:
+            routes = sorted(self._routes.items())
+
+            lines += header(duration, "histogram", "Request wall time.")
+            for route, stats in routes:
+                for bound, bucket_count in zip(BUCKETS, stats.bucket_counts):
+                    lines.append(
+                        sample(f"{duration}_bucket", bucket_count, route, le=bound)
+                    )
+                lines.append(
+                    sample(f"{duration}_bucket", stats.count, route, le="+Inf")
+                )
+                lines.append(sample(f"{duration}_sum", stats.duration_sum, route))
+                lines.append(sample(f"{duration}_count", stats.count, route))
+
+            lines += header(latency, "summary", "Percentiles of recent requests.")
+            for route, stats in routes:
+                samples = list(stats.samples)
+                for pct in (50, 95, 99):
+                    value = percentile(samples, pct)
+                    lines.append(sample(latency, value, route, quantile=pct / 100))
+                lines.append(sample(f"{latency}_sum", stats.duration_sum, route))
+                lines.append(sample(f"{latency}_count", stats.count, route))
+
+            name = "tuckshop_db_queries_total"
+            lines += header(name, "counter", "Database queries run.")
+            for route, stats in routes:
+                lines.append(sample(name, stats.queries, route))
+
+            name = "tuckshop_db_duration_seconds_total"
+            lines += header(name, "counter", "Time spent in database queries.")
+            for route, stats in routes:
+                lines.append(sample(name, stats.db_duration_sum, route))
+
+        return "\n".join(lines) + "\n"
+
+
+def header(name, kind, help_text):
+    return [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+
+
+def sample(name, value, route, **labels):
+    label_text = ",".join(
+        f'{label}="{label_value}"'
+        for label, label_value in {"route": route, **labels}.items()
+    )
+    if isinstance(value, float):
+        value = f"{value:.6f}"
+    return f"{name}{{{label_text}}} {value}"
+
+
+registry = Registry()
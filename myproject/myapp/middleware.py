@@ -0,0 +1,91 @@
+# myapp/middleware.py
+import time
+
+from django.conf import settings
+from django.contrib.auth import middleware as auth_middleware
+from django.contrib.messages import middleware as messages_middleware
+from django.contrib.sessions import middleware as sessions_middleware
+from django.db import connection
+from django.middleware import csrf
+
+from myapp.metrics import registry
+
+
+class QueryTimer:
+    # wraps every query the request runs on the default database
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - start
+
+
+class PerformanceMiddleware:
+    # times each request and its queries, sends them back in a Server-Timing
+    # header and adds them to the per route stats at /api/_metrics
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        start = time.perf_counter()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        duration = time.perf_counter() - start
+
+        match = getattr(request, "resolver_match", None)
+        route = match.view_name if match else "unmatched"
+        registry.observe(route, duration, timer.count, timer.duration)
+
+        response["Server-Timing"] = (
+            f'db;dur={timer.duration * 1000:.2f};desc="{timer.count} queries", '
+            f"total;dur={duration * 1000:.2f}"
+        )
+        return response
+
+
+def browserless(request):
+    # the api authenticates with tokens, so the session, csrf and messages
+    # middleware below have nothing to do there
+    path = request.path_info
+    if path.startswith(tuple(settings.SESSION_PATHS)):
+        return False
+    return path.startswith(tuple(settings.SESSIONLESS_PATHS))
+
+
+class BrowserOnlyMixin:
+    # for SESSIONLESS_PATHS the request goes straight past. they stay in
+    # MIDDLEWARE as subclasses of django's own so the admin's checks and
+    # everything else outside /api/ work as before
+    def __call__(self, request):
+        if browserless(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+
+class SessionMiddleware(BrowserOnlyMixin, sessions_middleware.SessionMiddleware):
+    pass
+
+
+class CsrfViewMiddleware(BrowserOnlyMixin, csrf.CsrfViewMiddleware):
+    # process_view is called by the handler itself, not from __call__
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if browserless(request):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class AuthenticationMiddleware(
+    BrowserOnlyMixin, auth_middleware.AuthenticationMiddleware
+):
+    pass
+
+
+class MessageMiddleware(BrowserOnlyMixin, messages_middleware.MessageMiddleware):
+    pass
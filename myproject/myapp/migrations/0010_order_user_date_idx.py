@@ -0,0 +1,37 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0009_remove_orderitem_order_date"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="product",
+            name="name",
+            field=models.CharField(max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="product",
+            name="type",
+            field=models.CharField(
+                choices=[
+                    ("drinks", "Drinks"),
+                    ("chips", "Chips"),
+                    ("sweets", "Sweets"),
+                    ("food", "Food"),
+                ],
+                max_length=50,
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="order",
+            index=models.Index(
+                fields=["user", "-order_date"], name="order_user_date_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0010_order_user_date_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="image_hash",
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name="product",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
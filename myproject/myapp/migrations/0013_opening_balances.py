@@ -0,0 +1,39 @@
+from django.db import migrations
+
+
+def add_opening_balances(apps, schema_editor):
+    # accounts from before the ledger get one opening transaction for their
+    # balance, so the ledger adds up from the start
+    Account = apps.get_model("myapp", "Account")
+    WalletTransaction = apps.get_model("myapp", "WalletTransaction")
+
+    WalletTransaction.objects.bulk_create(
+        [
+            WalletTransaction(
+                account_id=account_id,
+                kind="opening",
+                amount=balance,
+                balance_after=balance,
+            )
+            for account_id, balance in Account.objects.exclude(balance=0)
+            .values_list("id", "balance")
+            .iterator()
+        ],
+        batch_size=1000,
+    )
+
+
+def remove_opening_balances(apps, schema_editor):
+    WalletTransaction = apps.get_model("myapp", "WalletTransaction")
+    WalletTransaction.objects.filter(kind="opening").delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0012_wallet_ledger"),
+    ]
+
+    operations = [
+        migrations.RunPython(add_opening_balances, remove_opening_balances),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:12
+
+import django.db.models.deletion
+import myapp.models
+from django.db import migrations, models
+
+from myapp import search
+
+
+def install_index(apps, schema_editor):
+    search.install_index(schema_editor.connection)
+
+
+def uninstall_index(apps, schema_editor):
+    search.uninstall_index(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myapp", "0014_idempotency_keys"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSearch",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        db_column="rowid",
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        primary_key=True,
+                        related_name="search",
+                        serialize=False,
+                        to="myapp.product",
+                    ),
+                ),
+                ("name", myapp.models.SearchField()),
+            ],
+            options={
+                "db_table": "myapp_product_fts",
+                "managed": False,
+            },
+        ),
+        migrations.AddIndex(
+            model_name="product",
+            index=models.Index(fields=["type", "id"], name="product_type_idx"),
+        ),
+        migrations.RunPython(install_index, uninstall_index),
+    ]
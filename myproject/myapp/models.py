@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import (
     AbstractBaseUser,
     PermissionsMixin,
@@ -6,6 +6,7 @@ from django.contrib.auth.models import (
     Permission,
 )
 from django.contrib.auth.models import BaseUserManager
+from myapp import catalogue, images
 
 
 class CustomUserManager(
@@ -96,6 +97,47 @@ class Post(models.Model):
         return self.title
 
 
+class ProductManager(models.Manager):
+    def stock_case(self, quantities):
+        return models.Case(
+            *[
+                models.When(id=product_id, then=models.Value(amount))
+                for product_id, amount in quantities.items()
+            ],
+            output_field=models.IntegerField(),
+        )
+
+    # changes is {product_id: (quantity_change, reserved_change)}, its all one
+    # UPDATE with a CASE each so the number of queries doesnt grow with the
+    # cart. if any product would go below 0 in stock nothing moves
+    def move_stock(self, changes):
+        if not changes:
+            return True
+        to_quantity = {
+            product_id: change for product_id, (change, _) in changes.items()
+        }
+        to_reserved = {
+            product_id: change for product_id, (_, change) in changes.items()
+        }
+        floor = {product_id: -change for product_id, change in to_quantity.items()}
+        with transaction.atomic():
+            updated = self.filter(
+                id__in=changes, quantity__gte=self.stock_case(floor)
+            ).update(
+                quantity=models.F("quantity") + self.stock_case(to_quantity),
+                reserved=models.F("reserved") + self.stock_case(to_reserved),
+            )
+            if updated != len(changes):
+                transaction.set_rollback(True)
+                return False
+        # update() doesnt send post_save so the catalogue has to be told here
+        transaction.on_commit(catalogue.bump_version)
+        return True
+
+    def short_of(self, quantities):
+        return self.filter(id__in=quantities, quantity__lt=self.stock_case(quantities))
+
+
 class Product(models.Model):
     TYPE_CHOICES = [
         ("drinks", "Drinks"),
@@ -108,15 +150,175 @@ class Product(models.Model):
     image = models.ImageField(upload_to="product_images/", blank=True)
     price = models.DecimalField(max_digits=6, decimal_places=2)
     quantity = models.IntegerField(default=1)
+    # held for carts by StockReservation, already taken off quantity
+    reserved = models.PositiveIntegerField(default=0, editable=False)
+    # resized webp copies of image, {width: path}, only rebuilt when the hash
+    # of the original changes
+    image_hash = models.CharField(max_length=64, blank=True, editable=False)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            # ?type= filter, and the id after it keeps the cursor order
+            models.Index(fields=["type", "id"], name="product_type_idx"),
+        ]
+
+    # stock only moves through ProductManager.move_stock's F() updates. a
+    # plain save would write back the quantity and reserved it loaded, undoing
+    # whatever was sold or reserved since, so an edit only writes them when
+    # update_fields names them
+    STOCK_FIELDS = {"quantity", "reserved"}
+
+    def save(self, *args, **kwargs):
+        update_fields = kwargs.get("update_fields")
+        if (
+            update_fields is None
+            and not self._state.adding
+            and not kwargs.get("force_insert")
+        ):
+            deferred = self.get_deferred_fields()
+            update_fields = kwargs["update_fields"] = [
+                field.name
+                for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.STOCK_FIELDS
+                and field.attname not in deferred
+            ]
+        if update_fields is None or "image" in update_fields:
+            images.refresh_derivatives(self)
+            if update_fields is not None:
+                kwargs["update_fields"] = {
+                    *update_fields,
+                    "image_hash",
+                    "image_variants",
+                }
+        super().save(*args, **kwargs)
+        self._saved_image = self.image.name
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        product = super().from_db(db, field_names, values)
+        # the image the derivatives were made from, so save can tell when it
+        # gets replaced without reading the file
+        product._saved_image = product.__dict__.get("image")
+        return product
 
     def __str__(self):
         return self.name
 
 
+class SearchField(models.TextField):
+    # a column of an fts5 table, only good for __match
+    pass
+
+
+@SearchField.register_lookup
+class Match(models.Lookup):
+    lookup_name = "match"
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} MATCH {rhs}", lhs_params + rhs_params
+
+
+class ProductSearch(models.Model):
+    # the sqlite fts5 index over Product.name, see myapp/search.py. the table
+    # and the triggers that fill it are made by migration 0015
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        db_column="rowid",
+        related_name="search",
+        on_delete=models.DO_NOTHING,
+    )
+    name = SearchField()
+
+    class Meta:
+        managed = False
+        db_table = "myapp_product_fts"
+
+
+class StockReservation(models.Model):
+    # stock a user is holding for their cart, see myapp/reservations.py. it
+    # comes off Product.quantity when reserved and either becomes the sale or
+    # goes back on the shelf once expires_at passes
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "product"], name="stock_reservation_unique"
+            ),
+        ]
+        indexes = [
+            # the sweep is a range scan on this
+            models.Index(fields=["expires_at"], name="stock_reservation_expiry_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} of product {self.product_id} for user {self.user_id}"
+
+
+class AccountManager(models.Manager):
+    # balance changes lock the account row first so two taps at the same time
+    # cant read the same balance and overwrite each other. every change is also
+    # written to the ledger (WalletTransaction) in the same transaction, and
+    # they return the new balance, or None if nothing was changed
+    def deposit(self, user, amount, kind="deposit", order=None):
+        return self.change_balance(user, amount, kind, order)
+
+    def withdraw(self, user, amount, kind="withdrawel", order=None):
+        return self.change_balance(user, -amount, kind, order)
+
+    def change_balance(self, user, amount, kind, order=None):
+        with transaction.atomic():
+            # a user can have more than one account, the first one is the
+            # wallet, same as get_balance. only that row is locked and changed
+            account = (
+                self.select_for_update()
+                .filter(user=user)
+                .order_by("id")
+                .values_list("id", "balance")
+                .first()
+            )
+            if account is None:
+                return None
+            account_id, balance = account
+            if amount < 0 and balance < -amount:
+                return None
+
+            self.filter(pk=account_id).update(balance=models.F("balance") + amount)
+            balance += amount
+            WalletTransaction.objects.create(
+                account_id=account_id,
+                kind=kind,
+                amount=amount,
+                balance_after=balance,
+                order=order,
+            )
+            return balance
+
+    def get_balance(self, user):
+        return (
+            self.filter(user=user)
+            .order_by("id")
+            .values_list("balance", flat=True)
+            .first()
+        )
+
+
 class Account(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
+    objects = AccountManager()
+
     def __str__(self):
         return f"Account of {self.user.username} with balance {self.balance}"
 
@@ -135,6 +337,12 @@ class Order(models.Model):
     order_date = models.DateTimeField(auto_now_add=True)
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
 
+    class Meta:
+        indexes = [
+            # order history is always one user's orders newest first
+            models.Index(fields=["user", "-order_date"], name="order_user_date_idx"),
+        ]
+
     def __str__(self):
         return f"Order {self.id} by {self.user.email}"
 
@@ -149,3 +357,151 @@ class OrderItem(models.Model):
 
     def __str__(self):
         return f"{self.quantity} x {self.product.name} for Order {self.order.id}"
+
+
+class WalletTransaction(models.Model):
+    # append only, Account.balance is just the running total of these
+    KIND_CHOICES = [
+        ("opening", "Opening balance"),
+        ("deposit", "Deposit"),
+        ("withdrawel", "Withdrawel"),
+        ("order", "Order"),
+    ]
+    account = models.ForeignKey(
+        Account, related_name="transactions", on_delete=models.CASCADE
+    )
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # positive money in, negative money out
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2)
+    order = models.ForeignKey(Order, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # rebuilding a balance reads one account's rows after a snapshot
+            models.Index(fields=["account", "id"], name="wallet_txn_account_idx"),
+        ]
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Wallet transactions cant be changed once written.")
+        super().save(*args, **kwargs)
+
+    def delete(self, *args, **kwargs):
+        raise ValueError("Wallet transactions cant be deleted.")
+
+    def __str__(self):
+        return (
+            f"{self.get_kind_display()} of {self.amount} on account {self.account_id}"
+        )
+
+
+class BalanceSnapshot(models.Model):
+    # balance of an account up to and including last_transaction, so a
+    # rebuild only has to add up the transactions after it
+    account = models.ForeignKey(
+        Account, related_name="snapshots", on_delete=models.CASCADE
+    )
+    last_transaction = models.ForeignKey(
+        WalletTransaction, related_name="+", on_delete=models.CASCADE
+    )
+    balance = models.DecimalField(max_digits=10, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["account", "-id"], name="snapshot_account_idx"),
+        ]
+
+    def __str__(self):
+        return f"Account {self.account_id} at {self.balance}"
+
+
+class IdempotencyKey(models.Model):
+    # the response a client got for a POST it sent with an Idempotency-Key
+    # header, so a retry of the same request gets the same answer back
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    key = models.CharField(max_length=255)
+    # hash of the method, path and body the key was first used with
+    fingerprint = models.CharField(max_length=64)
+    # filled in before the claiming transaction commits, so nobody else ever
+    # sees them empty
+    status_code = models.PositiveSmallIntegerField(null=True)
+    response = models.JSONField(null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "key"], name="idempotency_user_key_unique"
+            ),
+        ]
+        indexes = [
+            # purging expired keys is a range scan on this
+            models.Index(fields=["created_at"], name="idempotency_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.key} for user {self.user_id}"
+
+
+class SalesRollup(models.Model):
+    # running totals of OrderItem rows, filled in by myapp/rollups.py so the
+    # analytics endpoints never have to read the orders themselves. each
+    # total is kept per day and per month, a long range reads whole months
+    PERIOD_CHOICES = [("day", "Day"), ("month", "Month")]
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    # the day, or the first of the month
+    start = models.DateField()
+    units = models.PositiveIntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductSalesRollup(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "start", "product"],
+                name="product_sales_rollup_unique",
+            ),
+        ]
+        indexes = [
+            # top sellers adds these up straight out of the index
+            models.Index(
+                fields=["period", "start", "product", "units", "revenue"],
+                name="product_rollup_totals_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.product_id} {self.period} of {self.start}"
+
+
+class TypeSalesRollup(SalesRollup):
+    type = models.CharField(choices=Product.TYPE_CHOICES, max_length=50)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["period", "start", "type"], name="type_sales_rollup_unique"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.type} {self.period} of {self.start}"
+
+
+class RollupWatermark(models.Model):
+    # the newest order id already added to the rollups
+    name = models.CharField(max_length=50, unique=True)
+    last_order_id = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} up to order {self.last_order_id}"
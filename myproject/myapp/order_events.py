@@ -0,0 +1,105 @@
+# myapp/order_events.py
+import asyncio
+import threading
+
+from rest_framework.renderers import JSONRenderer
+
+# counter screens keep one server sent events stream open instead of polling
+# the admin. new and updated orders get pushed to every open stream through
+# this broker. it lives in the process, so a screen only hears about orders
+# saved by the same worker, run the counter on one asgi worker
+HEARTBEAT_SECONDS = 15
+MAX_QUEUED = 100
+
+
+def format_event(event_id, event, data):
+    # data is already json so it has no raw newlines to split across lines
+    return f"id: {event_id}\nevent: {event}\ndata: {data}\n\n"
+
+
+class OrderBroker:
+    def __init__(self, max_queued=MAX_QUEUED):
+        self.max_queued = max_queued
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.last_id = 0
+
+    def listening(self):
+        # lets callers skip serializing orders nobody is waiting for
+        return bool(self.subscribers)
+
+    def subscribe(self):
+        # must be called on the event loop the stream runs on
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue(self.max_queued))
+        with self.lock:
+            self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers.discard(subscriber)
+
+    def publish(self, event, data):
+        # safe to call from any thread, usually a request thread in on_commit
+        payload = JSONRenderer().render(data).decode()
+        with self.lock:
+            self.last_id += 1
+            message = format_event(self.last_id, event, payload)
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            self.send(subscriber, message)
+
+    def close(self):
+        # ends every open stream, used when the server shuts down
+        with self.lock:
+            subscribers = list(self.subscribers)
+        for subscriber in subscribers:
+            self.send(subscriber, None)
+
+    def send(self, subscriber, message):
+        loop, queue = subscriber
+        try:
+            loop.call_soon_threadsafe(self.deliver, queue, message)
+        except RuntimeError:
+            # its loop has gone away without unsubscribing
+            self.unsubscribe(subscriber)
+
+    @staticmethod
+    def deliver(queue, message):
+        if queue.full():
+            # a screen this far behind has missed too much anyway, keep the
+            # newest events
+            queue.get_nowait()
+        queue.put_nowait(message)
+
+
+broker = OrderBroker()
+
+
+def snapshot_event(data):
+    return format_event(
+        broker.last_id, "snapshot", JSONRenderer().render(data).decode()
+    )
+
+
+async def stream(load_snapshot):
+    # load_snapshot returns the open orders as a snapshot_event. it runs after
+    # subscribing so nothing saved in between gets missed, and goes out first
+    # so the screen starts out complete
+    subscriber = broker.subscribe()
+    loop, queue = subscriber
+    try:
+        yield await load_snapshot()
+        while True:
+            try:
+                message = await asyncio.wait_for(queue.get(), HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                # a comment line keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            if message is None:
+                return
+            yield message
+    finally:
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,38 @@
+# myapp/pagination.py
+from rest_framework.pagination import CursorPagination
+
+
+# cursor pages stay fast however far back you go since they filter on the key
+# instead of using an OFFSET
+class ProductCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class ProductSearchCursorPagination(ProductCursorPagination):
+    # ?q= results, best match first. rank is added by myapp.search and is
+    # unique, so it can be the whole cursor
+    ordering = "rank"
+
+
+class OrderCursorPagination(CursorPagination):
+    ordering = ("-order_date", "-id")
+    page_size = 20
+    page_size_query_param = "page_size"
+    max_page_size = 100
+
+
+class PostCursorPagination(CursorPagination):
+    ordering = ("-created_at", "-id")
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
+
+
+class ProfileCursorPagination(CursorPagination):
+    ordering = "id"
+    page_size = 50
+    page_size_query_param = "page_size"
+    max_page_size = 500
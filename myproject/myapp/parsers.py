@@ -0,0 +1,10 @@
+# myapp/parsers.py
+from rest_framework.parsers import BaseParser
+
+
+class CSVTextParser(BaseParser):
+    # hands the raw csv text to the view, it does its own row parsing
+    media_type = "text/csv"
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        return stream.read().decode("utf-8-sig")
@@ -0,0 +1,191 @@
+# myapp/provisioning.py
+import csv
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import django
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import DatabaseError, transaction
+
+from myapp import catalogue, models
+
+logger = logging.getLogger(__name__)
+
+CSV_FIELDS = ["email", "username", "password"]
+
+# the hashing processes uploads share, started on the first upload and kept
+# for the life of the web process, see shared_pool()
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def read_csv(text):
+    # the header is checked straight away, the rows are read lazily and come
+    # back numbered from 1 (the header being row 0)
+    reader = csv.DictReader(io.StringIO(text))
+    missing = set(CSV_FIELDS) - set(reader.fieldnames or [])
+    if missing:
+        raise ValueError(f"CSV is missing columns: {', '.join(sorted(missing))}")
+    return enumerate(reader, start=1)
+
+
+def setup_worker():
+    # spawned workers (mac/windows) start without django set up, forked ones
+    # already have it
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
+    django.setup()
+
+
+def hash_password(password):
+    return make_password(password)
+
+
+def new_pool(workers):
+    # None when hashing should just happen in this process
+    if workers <= 1:
+        return None
+    return ProcessPoolExecutor(max_workers=workers, initializer=setup_worker)
+
+
+def shared_pool():
+    # one pool of PROVISIONING_HASH_WORKERS per web process, so uploads at the
+    # same time queue for the same workers instead of each starting its own
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = new_pool(settings.PROVISIONING_HASH_WORKERS)
+        return _pool
+
+
+def discard_pool(pool):
+    # a worker died, the pool cant be used again and the next upload gets a
+    # new one
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False)
+
+
+def provision(rows, pool=None, chunk_size=500):
+    # rows is an iterable of (row number, {email, username, password}).
+    # yields one result per row as each chunk is saved, a bad row is reported
+    # and skipped instead of stopping the whole batch. passwords are hashed
+    # on pool if there is one, the caller owns it
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield from provision_chunk(chunk, pool)
+            chunk = []
+    if chunk:
+        yield from provision_chunk(chunk, pool)
+
+
+def provision_chunk(chunk, pool):
+    valid = []
+    results = {}
+    seen = set()
+
+    for number, row in chunk:
+        errors = []
+        email = models.User.objects.normalize_email((row.get("email") or "").strip())
+        username = (row.get("username") or "").strip()
+        password = row.get("password") or ""
+
+        try:
+            validate_email(email)
+        except ValidationError:
+            errors.append("Enter a valid email address.")
+        if not username:
+            errors.append("Username is required.")
+        # checked here, a value the column cant hold fails the whole chunk
+        for field_name, value in (("email", email), ("username", username)):
+            max_length = models.User._meta.get_field(field_name).max_length
+            if len(value) > max_length:
+                errors.append(
+                    f"{field_name.capitalize()} can be at most {max_length} "
+                    "characters."
+                )
+        if not password:
+            errors.append("Password is required.")
+        if email in seen:
+            errors.append("Email appears more than once in this upload.")
+        seen.add(email)
+
+        if errors:
+            results[number] = error_result(number, email, errors)
+        else:
+            valid.append((number, email, username, password))
+
+    # one query for every email in the chunk that already has an account
+    existing = set(
+        models.User.objects.filter(
+            email__in=[email for _, email, _, _ in valid]
+        ).values_list("email", flat=True)
+    )
+    for number, email, _, _ in valid:
+        if email in existing:
+            results[number] = error_result(
+                number, email, ["A user with this email already exists."]
+            )
+    valid = [entry for entry in valid if entry[1] not in existing]
+
+    # hashing is nearly all the cost, so it gets spread over processes
+    passwords = [password for _, _, _, password in valid]
+    hashes = None
+    if pool is not None and len(passwords) > 1:
+        try:
+            hashes = list(pool.map(hash_password, passwords, chunksize=16))
+        except BrokenProcessPool:
+            discard_pool(pool)
+    if hashes is None:
+        hashes = [hash_password(password) for password in passwords]
+
+    users = [
+        models.User(email=email, username=username, password=password_hash)
+        for (_, email, username, _), password_hash in zip(valid, hashes)
+    ]
+    try:
+        with transaction.atomic():
+            models.User.objects.bulk_create(users)
+            models.Account.objects.bulk_create(
+                [models.Account(user=user, balance=0) for user in users]
+            )
+            models.UserProfile.objects.bulk_create(
+                [models.UserProfile(user=user) for user in users]
+            )
+            # bulk_create sends no post_save, so the cached profile list has to
+            # be told here
+            transaction.on_commit(lambda: catalogue.bump_version("profiles"))
+    except DatabaseError:
+        # most likely someone registered one of these emails since the check
+        # above. the rows are still answered so the stream carries on, and the
+        # database's own message only goes to the log
+        logger.exception("provisioning chunk from row %s failed", chunk[0][0])
+        for number, email, _, _ in valid:
+            results[number] = error_result(
+                number, email, ["Could not save this row, upload it again."]
+            )
+    else:
+        for (number, email, _, _), user in zip(valid, users):
+            results[number] = {
+                "row": number,
+                "email": email,
+                "status": "created",
+                "id": user.id,
+            }
+
+    for number, _ in chunk:
+        yield results[number]
+
+
+def error_result(number, email, errors):
+    return {"row": number, "email": email, "status": "error", "errors": errors}
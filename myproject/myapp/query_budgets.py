@@ -0,0 +1,34 @@
+# myapp/query_budgets.py
+# the most queries each route in myapp/urls.py is allowed per request, by url
+# name and method. QueryBudgetTests calls every route against seeded data and
+# fails if a route goes over, if its query count grows with the amount of data,
+# or if a route in urls.py has no budget here
+QUERY_BUDGETS = {
+    "api-root": {"GET": 0},
+    "post-list": {"GET": 1},
+    "post-detail": {"GET": 1},
+    "register": {"POST": 3},
+    "login": {"POST": 2},
+    "userprofile-list-create": {"GET": 1},
+    "userprofile-detail": {"GET": 1},
+    "product-list": {"GET": 1},
+    "accounts": {"GET": 1},
+    "account-deposit": {"POST": 5},
+    "account-widthdrawel": {"POST": 5},
+    "order-list-create": {"GET": 2, "POST": 12},
+    # session + user, then the open orders and their items
+    "order-stream": {"GET": 4},
+    # lock the orders that will move, then the update
+    "order-status-update": {"POST": 2},
+    # one joined query, read a chunk at a time as it streams
+    "order-export": {"GET": 1},
+    "checkout": {"POST": 16},
+    "stock-reservations": {"GET": 1, "POST": 10},
+    # rollups only, one grouped query each however long the range
+    "sales-summary": {"GET": 1},
+    "top-sellers": {"GET": 2},
+    # whatever its requests add up to, the test batches accounts, products and orders
+    "batch": {"POST": 4},
+    "metrics": {"GET": 0},
+    "student-bulk-create": {"POST": 6},
+}
@@ -0,0 +1,150 @@
+# myapp/reservations.py
+import datetime
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from myapp import models
+
+# stock held for carts. reserving moves it from Product.quantity to
+# Product.reserved straight away, so a cart that got its reservation can
+# always be ordered. holds nobody orders against go back on the shelf once
+# STOCK_RESERVATION_TTL runs out, swept up by release_expired() from cron
+# (`manage.py release_reservations`). when stock runs short the products that
+# came up short get one small sweep of their own first
+SWEEP_BATCH_SIZE = 500
+
+
+def expiry():
+    return timezone.now() + datetime.timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+
+def held_by(user, product_ids):
+    # the user's row always exists, so locking it queues up two tabs that both
+    # reserve for the first time, instead of both finding nothing held and the
+    # upsert keeping only one of them. the holds are locked too so a sweep
+    # skips them. expired holds that havent been swept still count, their
+    # stock is still set aside
+    list(models.User.objects.select_for_update().filter(pk=user.pk).values("pk"))
+    return dict(
+        models.StockReservation.objects.select_for_update()
+        .filter(user=user, product_id__in=product_ids)
+        .values_list("product_id", "quantity")
+    )
+
+
+def reserve(user, quantities):
+    # quantities is {product_id: amount} and replaces whatever the user held
+    # for those products, 0 lets the hold go. every hold gets a fresh ttl.
+    # returns the products there isnt enough of, if any nothing changed
+    return after_sweep(lambda: hold(user, quantities))
+
+
+def hold(user, quantities):
+    with transaction.atomic():
+        held = held_by(user, quantities)
+        changes, short = {}, {}
+        for product_id, amount in quantities.items():
+            difference = amount - held.get(product_id, 0)
+            if difference:
+                changes[product_id] = (-difference, difference)
+            if difference > 0:
+                short[product_id] = difference
+        if not models.Product.objects.move_stock(changes):
+            return list(models.Product.objects.short_of(short))
+
+        expires_at = expiry()
+        models.StockReservation.objects.bulk_create(
+            [
+                models.StockReservation(
+                    user=user,
+                    product_id=product_id,
+                    quantity=amount,
+                    expires_at=expires_at,
+                )
+                for product_id, amount in quantities.items()
+                if amount
+            ],
+            update_conflicts=True,
+            unique_fields=["user", "product"],
+            update_fields=["quantity", "expires_at"],
+        )
+        let_go = [
+            product_id
+            for product_id, amount in quantities.items()
+            if not amount and product_id in held
+        ]
+        if let_go:
+            models.StockReservation.objects.filter(
+                user=user, product_id__in=let_go
+            ).delete()
+    return []
+
+
+def take_for_order(user, quantities):
+    # call inside the order's transaction. what the user holds for these
+    # products becomes the sale and the rest comes off the shelf, a hold for
+    # more than was ordered gives the extra back. returns the products there
+    # isnt enough of
+    return after_sweep(lambda: take(user, quantities))
+
+
+def take(user, quantities):
+    held = held_by(user, quantities)
+    changes, short = {}, {}
+    for product_id, amount in quantities.items():
+        from_hold = held.get(product_id, 0)
+        changes[product_id] = (from_hold - amount, -from_hold)
+        if amount > from_hold:
+            short[product_id] = amount - from_hold
+    if not models.Product.objects.move_stock(changes):
+        return list(models.Product.objects.short_of(short))
+
+    if held:
+        models.StockReservation.objects.filter(user=user, product_id__in=held).delete()
+    return []
+
+
+def after_sweep(attempt):
+    # expired holds can be what's keeping the stock off the shelf, so one
+    # more go after releasing them. this runs inside the caller's transaction,
+    # so only one batch and only for the products that came up short, the
+    # rest waits for the cron sweep
+    short = attempt()
+    if short and release_batch(product_ids=[product.id for product in short]):
+        short = attempt()
+    return short
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE):
+    # a batch per transaction until none are left, returns how many holds
+    # were released
+    released = 0
+    while True:
+        swept = release_batch(batch_size)
+        released += swept
+        if swept < batch_size:
+            return released
+
+
+def release_batch(batch_size=SWEEP_BATCH_SIZE, product_ids=None):
+    with transaction.atomic():
+        # on postgres two sweeps split the work instead of queueing
+        expired = models.StockReservation.objects.select_for_update(
+            skip_locked=True
+        ).filter(expires_at__lte=timezone.now())
+        if product_ids is not None:
+            expired = expired.filter(product_id__in=product_ids)
+        expired = list(expired.values_list("id", "product_id", "quantity")[:batch_size])
+        back = defaultdict(int)
+        for _, product_id, quantity in expired:
+            back[product_id] += quantity
+        models.StockReservation.objects.filter(
+            id__in=[reservation_id for reservation_id, _, _ in expired]
+        ).delete()
+        models.Product.objects.move_stock(
+            {product_id: (amount, -amount) for product_id, amount in back.items()}
+        )
+    return len(expired)
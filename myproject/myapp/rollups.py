@@ -0,0 +1,178 @@
+# myapp/rollups.py
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, Q, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from myapp import models
+
+# sales totals per product and per type, per day and per month. orders are
+# added in id order past a watermark, so each one is only ever counted once,
+# by `manage.py rollup_sales` run from cron (or --rebuild to start over).
+# it isnt run per order, every catch up queues on the one watermark row
+WATERMARK = "sales"
+BATCH_SIZE = 5000
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+
+def catch_up(batch_size=BATCH_SIZE):
+    # returns how many orders were added
+    added = 0
+    while True:
+        batch = catch_up_batch(batch_size)
+        added += batch
+        if batch < batch_size:
+            return added
+
+
+def catch_up_batch(batch_size):
+    with transaction.atomic():
+        # the lock keeps two catch ups from adding the same orders
+        mark, _ = models.RollupWatermark.objects.select_for_update().get_or_create(
+            name=WATERMARK
+        )
+
+        orders = models.Order.objects.filter(id__gt=mark.last_order_id)
+        settle = settings.SALES_ROLLUP_SETTLE_SECONDS
+        if settle:
+            # on postgres a lower id can commit after a higher one, so orders
+            # get a moment to settle before the watermark passes them
+            cutoff = timezone.now() - datetime.timedelta(seconds=settle)
+            orders = orders.filter(order_date__lt=cutoff)
+        order_ids = list(
+            orders.order_by("id").values_list("id", flat=True)[:batch_size]
+        )
+        if not order_ids:
+            return 0
+
+        items = (
+            models.OrderItem.objects.filter(
+                order_id__gt=mark.last_order_id, order_id__lte=order_ids[-1]
+            )
+            .values("product_id", "product__type", day=TruncDate("order__order_date"))
+            .annotate(
+                units=Sum("quantity"),
+                revenue=Sum(F("price") * F("quantity"), output_field=MONEY),
+            )
+        )
+
+        by_product = defaultdict(lambda: [0, Decimal("0")])
+        by_type = defaultdict(lambda: [0, Decimal("0")])
+        for item in items:
+            for period, start in (
+                ("day", item["day"]),
+                ("month", month_start(item["day"])),
+            ):
+                for totals, key in (
+                    (by_product, (period, start, item["product_id"])),
+                    (by_type, (period, start, item["product__type"])),
+                ):
+                    totals[key][0] += item["units"]
+                    totals[key][1] += item["revenue"]
+
+        add_totals(models.ProductSalesRollup, "product_id", by_product)
+        add_totals(models.TypeSalesRollup, "type", by_type)
+
+        mark.last_order_id = order_ids[-1]
+        mark.save(update_fields=["last_order_id", "updated_at"])
+        return len(order_ids)
+
+
+def add_totals(model, key_field, totals):
+    # adds onto the rows that are already there and creates the rest, three
+    # queries whatever the batch size
+    if not totals:
+        return
+    periods, starts, keys = (set(parts) for parts in zip(*totals))
+    existing = {
+        (row.period, row.start, getattr(row, key_field)): row
+        for row in model.objects.filter(
+            period__in=periods, start__in=starts, **{f"{key_field}__in": keys}
+        )
+    }
+
+    changed, created = [], []
+    for (period, start, key), (units, revenue) in totals.items():
+        row = existing.get((period, start, key))
+        if row is None:
+            created.append(
+                model(
+                    period=period,
+                    start=start,
+                    units=units,
+                    revenue=revenue,
+                    **{key_field: key},
+                )
+            )
+        else:
+            row.units += units
+            row.revenue += revenue
+            changed.append(row)
+
+    model.objects.bulk_update(changed, ["units", "revenue"], batch_size=500)
+    model.objects.bulk_create(created, batch_size=500)
+
+
+def rebuild(batch_size=BATCH_SIZE):
+    with transaction.atomic():
+        models.ProductSalesRollup.objects.all().delete()
+        models.TypeSalesRollup.objects.all().delete()
+        models.RollupWatermark.objects.filter(name=WATERMARK).delete()
+    return catch_up(batch_size)
+
+
+def covering(date_from, date_to):
+    # the fewest rollup rows that add up to date_from..date_to (inclusive):
+    # whole months in the middle, days at the ragged ends
+    first_full = month_start(date_from)
+    if first_full != date_from:
+        first_full = next_month(date_from)
+    after_last_full = month_start(date_to + datetime.timedelta(days=1))
+
+    if first_full >= after_last_full:
+        return Q(period="day", start__range=(date_from, date_to))
+    return (
+        Q(period="day", start__gte=date_from, start__lt=first_full)
+        | Q(period="month", start__gte=first_full, start__lt=after_last_full)
+        | Q(period="day", start__gte=after_last_full, start__lte=date_to)
+    )
+
+
+def sales_by_type(date_from, date_to):
+    return (
+        models.TypeSalesRollup.objects.filter(covering(date_from, date_to))
+        .values("type")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("-revenue", "type")
+    )
+
+
+def top_sellers(date_from, date_to, limit):
+    # grouped on product_id alone, with the product joined on for just the
+    # ones that made it, not for every rollup row in the range
+    top = list(
+        models.ProductSalesRollup.objects.filter(covering(date_from, date_to))
+        .values("product_id")
+        .annotate(units=Sum("units"), revenue=Sum("revenue"))
+        .order_by("-units", "-revenue", "product_id")[:limit]
+    )
+    products = models.Product.objects.only("name", "type").in_bulk(
+        [row["product_id"] for row in top]
+    )
+    for row in top:
+        row["name"] = products[row["product_id"]].name
+        row["type"] = products[row["product_id"]].type
+    return top
@@ -1,14 +1,48 @@
 # myapp/serializers.py
+from django.core.files.storage import default_storage
 from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from rest_framework import serializers
-from myapp import models
+from rest_framework.exceptions import NotFound
+from myapp import batch, models, order_events, reservations
 from django.contrib.auth import authenticate
+from django.contrib.auth.hashers import make_password
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from .models import UserProfile, Post
 
 User = models.User
 
 
+class FieldsMixin:
+    # ?fields=id,name,price only serializes those fields, so the menu screen
+    # can skip the rest (and skip building image urls). a name the serializer
+    # doesnt have is a 400, so a typo doesnt quietly come back without it
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        request = self.context.get("request")
+        if request is None or request.method != "GET":
+            return
+
+        wanted = requested_fields(request)
+        unknown = wanted - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError(
+                {"fields": [f"Unknown fields: {', '.join(sorted(unknown))}."]}
+            )
+        if wanted:
+            for field_name in set(self.fields) - wanted:
+                self.fields.pop(field_name)
+
+
+def requested_fields(request):
+    fields = request.query_params.get("fields")
+    if not fields:
+        return set()
+    return {field.strip() for field in fields.split(",") if field.strip()}
+
+
 class LoginSerializer(serializers.Serializer):  # needed ai for this one
     email = serializers.CharField(label="Email", write_only=True)
     password = serializers.CharField(
@@ -28,6 +62,9 @@ class LoginSerializer(serializers.Serializer):  # needed ai for this one
                 user = User.objects.get(email__exact=email)
             except User.DoesNotExist:
                 user = None
+                # hash anyway so an unknown email takes as long as a wrong
+                # password and cant be told apart by timing
+                make_password(password)
 
             # 2. Check if the user was found AND if the password is correct
             if user is None or not user.check_password(password):
@@ -82,10 +119,35 @@ class PostSerializer(serializers.ModelSerializer):
         fields = "__all__"
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(FieldsMixin, serializers.ModelSerializer):
+    srcset = serializers.SerializerMethodField()
+    # quantity already has reservations taken off, both are plain columns so
+    # theres no counting per product
+    available = serializers.IntegerField(source="quantity", read_only=True)
+    reserved = serializers.IntegerField(read_only=True)
+
     class Meta:
         model = models.Product
-        fields = ["name", "type", "price", "image", "quantity", "id"]
+        fields = [
+            "name",
+            "type",
+            "price",
+            "image",
+            "srcset",
+            "quantity",
+            "available",
+            "reserved",
+            "id",
+        ]
+
+    def get_srcset(self, product):
+        # {width: url} of the resized copies, for picking the smallest that fits
+        request = self.context.get("request")
+        srcset = {}
+        for width, name in product.image_variants.items():
+            url = default_storage.url(name)
+            srcset[width] = request.build_absolute_uri(url) if request else url
+        return srcset
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
@@ -100,7 +162,9 @@ class AccountSerializer(serializers.ModelSerializer):
     class Meta:
         model = models.Account
         fields = ("id", "balance", "user")
-        read_only_fields = ["user"]
+        # balance only changes through deposits, withdrawels and orders so the
+        # ledger always adds up
+        read_only_fields = ["user", "balance"]
 
 
 class DepositSerializer(serializers.Serializer):
@@ -108,7 +172,7 @@ class DepositSerializer(serializers.Serializer):
         max_digits=10, decimal_places=2, required=True
     )
 
-    def validate_amount(self, value):
+    def validate_depositAmount(self, value):
         if value <= 0:
             raise serializers.ValidationError("Deposit amount must be positive.")
         return value
@@ -126,17 +190,26 @@ class WithdrawelSerializer(serializers.Serializer):
 
 
 class OrderItemSerializer(serializers.ModelSerializer):
-    product_id = serializers.IntegerField(write_only=True)
+    product_id = serializers.IntegerField()
+    product_name = serializers.CharField(source="product.name", read_only=True)
+    quantity = serializers.IntegerField(min_value=1)
 
     # id = serializers.IntegerField(write_only=True)  holding for later use
 
     class Meta:
         model = models.OrderItem
-        fields = ["product_id", "quantity"]
+        fields = ["id", "product_id", "product_name", "price", "quantity"]
+        read_only_fields = ["price"]
 
 
-class OrdersSerializer(serializers.ModelSerializer):
-    items = OrderItemSerializer(many=True, write_only=True)
+def order_items_prefetch():
+    return Prefetch(
+        "items", queryset=models.OrderItem.objects.select_related("product")
+    )
+
+
+class OrdersSerializer(FieldsMixin, serializers.ModelSerializer):
+    items = OrderItemSerializer(many=True)
 
     id = serializers.IntegerField(read_only=True)
     user = serializers.StringRelatedField(read_only=True)
@@ -146,36 +219,231 @@ class OrdersSerializer(serializers.ModelSerializer):
         fields = ["id", "user", "status", "order_date", "total_price", "items"]
         read_only_fields = ["status", "total_price", "order_date"]
 
+    def build_order_items(self, order_items_data):
+        # one lookup for the whole cart instead of a get() per line
+        product_ids = {item_data["product_id"] for item_data in order_items_data}
+        products = models.Product.objects.in_bulk(product_ids)
+
+        missing_ids = sorted(product_ids - products.keys())
+        if missing_ids:
+            raise serializers.ValidationError(
+                {
+                    "items": [
+                        f"Product with ID {product_id} does not exist."
+                        for product_id in missing_ids
+                    ]
+                }
+            )
+
+        order_items = []
+        total_price = 0
+        for item_data in order_items_data:
+            product = products[item_data["product_id"]]
+            quantity = item_data["quantity"]
+
+            order_items.append(
+                models.OrderItem(
+                    product=product, quantity=quantity, price=product.price
+                )
+            )
+            total_price += product.price * quantity
+
+        return order_items, total_price
+
+    def take_stock(self, user, order_items):
+        # whatever the user has reserved is used first, see myapp/reservations.py
+        stock_needed = {}
+        for order_item in order_items:
+            stock_needed[order_item.product_id] = (
+                stock_needed.get(order_item.product_id, 0) + order_item.quantity
+            )
+
+        short = reservations.take_for_order(user, stock_needed)
+        if short:
+            raise serializers.ValidationError(
+                {
+                    "items": [
+                        f"Not enough stock for {product.name}." for product in short
+                    ]
+                }
+            )
+
+    def save_order(self, user, order_items, total_price, **fields):
+        # total is already known so the order only needs the one insert
+        order = models.Order.objects.create(
+            user=user, total_price=total_price, **fields
+        )
+
+        for order_item in order_items:
+            order_item.order = order
+        models.OrderItem.objects.bulk_create(order_items)
+
+        # so the response can show the items without a query per item
+        prefetch_related_objects([order], order_items_prefetch())
+
+        # counter screens only hear about it once its committed
+        transaction.on_commit(lambda: announce_orders("order_created", [order]))
+
+        return order
+
     def create(self, validated_data):
         order_items_data = validated_data.pop("items")
 
         user = self.context["request"].user
-        total_price = 0
+        order_items, total_price = self.build_order_items(order_items_data)
 
         with transaction.atomic():
-            order = models.Order.objects.create(user=user, **validated_data)
+            self.take_stock(user, order_items)
+            return self.save_order(user, order_items, total_price, **validated_data)
 
-            for item_data in order_items_data:
-                product_id = item_data["product_id"]
-                quantity = item_data["quantity"]
 
-                try:
-                    product = models.Product.objects.get(id=product_id)
-                except models.Product.DoesNotExist:
-                    raise serializers.ValidationError(
-                        f"Product with ID {product_id} does not exist."
-                    )
+def announce_orders(event, orders):
+    # orders can be a queryset, it only gets run if a counter screen is open
+    if order_events.broker.listening():
+        order_events.broker.publish(event, OrdersSerializer(orders, many=True).data)
 
-                models.OrderItem.objects.create(
-                    order=order,
-                    product=product,
-                    quantity=quantity,
-                    price=product.price,
-                )
 
-                total_price += product.price * quantity
+class OrderStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(), allow_empty=False, max_length=500
+    )
+    status = serializers.ChoiceField(choices=models.Order.STATUS_CHOICES)
+
+
+class DateRangeSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+
+    def validate(self, data):
+        date_from, date_to = data.get("date_from"), data.get("date_to")
+        if date_from and date_to and date_from > date_to:
+            raise serializers.ValidationError(
+                {"date_to": "date_to can't be before date_from."}
+            )
+        return data
 
-            order.total_price = total_price
-            order.save()
+
+class OrderExportSerializer(DateRangeSerializer):
+    # the query string of /api/orders/export/, status can be given more than once
+    status = serializers.MultipleChoiceField(
+        choices=models.Order.STATUS_CHOICES, required=False
+    )
+    output = serializers.ChoiceField(choices=["csv", "jsonl"], default="csv")
+
+
+class SalesRangeSerializer(DateRangeSerializer):
+    # the query string of /api/analytics/..., both dates default to today
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, data):
+        today = timezone.localdate()
+        data.setdefault("date_to", max(today, data.get("date_from", today)))
+        data.setdefault("date_from", min(today, data["date_to"]))
+        return super().validate(data)
+
+
+class CheckoutSerializer(OrdersSerializer):
+    # pays for the order, takes the stock and saves the order all in one go,
+    # so the app doesnt need a separate withdrawel request first
+    def create(self, validated_data):
+        order_items_data = validated_data.pop("items")
+
+        user = self.context["request"].user
+        order_items, total_price = self.build_order_items(order_items_data)
+
+        # raising anywhere in here rolls back the debit and the stock together
+        with transaction.atomic():
+            self.take_stock(user, order_items)
+
+            # the order goes in before the debit so the ledger row can point at it
+            order = self.save_order(user, order_items, total_price, **validated_data)
+
+            self.new_balance = models.Account.objects.withdraw(
+                user, total_price, kind="order", order=order
+            )
+            if self.new_balance is None:
+                if not models.Account.objects.filter(user=user).exists():
+                    raise NotFound("Account not found for user.")
+                raise serializers.ValidationError({"detail": "Insufficient balance."})
 
             return order
+
+
+class ReservationItemSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    # 0 lets the hold go
+    quantity = serializers.IntegerField(min_value=0)
+
+
+class StockReservationSerializer(serializers.ModelSerializer):
+    product_name = serializers.CharField(source="product.name", read_only=True)
+
+    class Meta:
+        model = models.StockReservation
+        fields = ["product_id", "product_name", "quantity", "expires_at"]
+
+
+class CartReservationSerializer(serializers.Serializer):
+    # sets how much of each product the cart holds rather than adding to it,
+    # so sending the same cart twice changes nothing
+    items = ReservationItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        quantities = {}
+        for item in items:
+            quantities[item["product_id"]] = (
+                quantities.get(item["product_id"], 0) + item["quantity"]
+            )
+
+        found = set(
+            models.Product.objects.filter(id__in=quantities).values_list(
+                "id", flat=True
+            )
+        )
+        missing_ids = sorted(quantities.keys() - found)
+        if missing_ids:
+            raise serializers.ValidationError(
+                [
+                    f"Product with ID {product_id} does not exist."
+                    for product_id in missing_ids
+                ]
+            )
+        return quantities
+
+    def save(self):
+        short = reservations.reserve(
+            self.context["request"].user, self.validated_data["items"]
+        )
+        if short:
+            raise serializers.ValidationError(
+                {
+                    "items": [
+                        f"Not enough stock for {product.name}." for product in short
+                    ]
+                }
+            )
+
+
+class BatchCallSerializer(serializers.Serializer):
+    method = serializers.ChoiceField(choices=["GET", "POST", "PUT", "PATCH", "DELETE"])
+    # with its query string, /api/products/?type=drinks
+    path = serializers.CharField()
+    body = serializers.JSONField(required=False, default=None)
+    headers = serializers.DictField(
+        child=serializers.CharField(), required=False, default=dict
+    )
+
+    def validate_path(self, path):
+        try:
+            batch.resolve_call(path)
+        except ValueError as e:
+            raise serializers.ValidationError(str(e))
+        return path
+
+
+class BatchSerializer(serializers.Serializer):
+    requests = BatchCallSerializer(
+        many=True, allow_empty=False, max_length=batch.MAX_CALLS
+    )
+    # run them all in one transaction, any failure rolls back the lot
+    atomic = serializers.BooleanField(default=False)
@@ -0,0 +1,72 @@
+# myapp/signals.py
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+
+from rest_framework.authtoken.models import Token
+
+from myapp import catalogue, search
+from myapp.authentication import token_cache
+from myapp.models import Post, Product, User, UserProfile
+
+
+# versions are bumped once the change commits. bumped any earlier, a request
+# in between could cache the old rows under the new version, and a rollback
+# would leave it bumped for nothing
+def bump_on_commit(using, *namespaces):
+    def bump():
+        for namespace in namespaces:
+            catalogue.bump_version(namespace)
+
+    transaction.on_commit(bump, using=using)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_changed(sender, using, **kwargs):
+    bump_on_commit(using, "catalogue")
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+def post_changed(sender, using, **kwargs):
+    bump_on_commit(using, "posts")
+
+
+# posts show their author's username, so profile and user changes show up in
+# both lists
+@receiver(post_save, sender=UserProfile)
+@receiver(post_delete, sender=UserProfile)
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def profile_changed(sender, using, **kwargs):
+    bump_on_commit(using, "profiles", "posts")
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    token_cache.evict(instance.key)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, **kwargs):
+    if not instance.is_active:
+        token_cache.evict_user(instance.pk)
+
+
+@receiver(connection_created)
+def tune_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {pragma} = {value}")
+
+
+@receiver(post_migrate)
+def repair_search_index(sender, using, **kwargs):
+    if sender.name == "myapp":
+        search.repair_index(connections[using])
@@ -1,3 +1,2388 @@
-from django.test import TestCase
+import asyncio
+import csv
+import datetime
+import io
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from unittest import mock
+
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import DataError, connection, transaction
+from django.test import (
+    AsyncClient,
+    Client,
+    RequestFactory,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, resolve, reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from myapp import (
+    catalogue,
+    ledger,
+    models,
+    order_events,
+    provisioning,
+    reservations,
+    rollups,
+    search,
+    throttling,
+)
+from myapp import urls as myapp_urls
+from myapp.query_budgets import QUERY_BUDGETS
+from myapp.metrics import registry
+from myapp.middleware import browserless
+from myapp.authentication import CachedTokenAuthentication, TokenCache, token_cache
 
 # Create your tests here.
+
+
+def make_products(count, price="10.00", quantity=1):
+    return models.Product.objects.bulk_create(
+        [
+            models.Product(
+                name=f"Product {i}",
+                type="food",
+                price=Decimal(price),
+                quantity=quantity,
+            )
+            for i in range(count)
+        ]
+    )
+
+
+class OrderCreateTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("order-list-create")
+
+    def post_cart(self, products, quantity=2):
+        return self.client.post(
+            self.url,
+            {
+                "items": [
+                    {"product_id": product.id, "quantity": quantity}
+                    for product in products
+                ]
+            },
+            format="json",
+        )
+
+    def test_order_total_and_items(self):
+        products = make_products(3, quantity=5)
+        response = self.post_cart(products)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = models.Order.objects.get(id=response.data["id"])
+        self.assertEqual(order.total_price, Decimal("60.00"))
+        self.assertEqual(order.items.count(), 3)
+
+    def test_missing_products_reported_together(self):
+        products = make_products(1)
+        response = self.client.post(
+            self.url,
+            {
+                "items": [
+                    {"product_id": products[0].id, "quantity": 1},
+                    {"product_id": 9998, "quantity": 1},
+                    {"product_id": 9999, "quantity": 1},
+                ]
+            },
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(len(response.data["items"]), 2)
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_query_count_does_not_grow_with_basket(self):
+        with CaptureQueriesContext(connection) as small:
+            self.post_cart(make_products(1, quantity=5))
+        with CaptureQueriesContext(connection) as large:
+            self.post_cart(make_products(15, quantity=5))
+
+        self.assertEqual(len(small), len(large))
+
+
+class BalanceUpdateTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.account = models.Account.objects.create(user=self.user, balance=50)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_deposit(self):
+        response = self.client.post(
+            reverse("account-deposit"), {"depositAmount": "20.00"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data["new_balance"], Decimal("70.00"))
+
+    def test_negative_deposit_rejected(self):
+        response = self.client.post(
+            reverse("account-deposit"), {"depositAmount": "-20.00"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("50.00"))
+
+    def test_withdrawel_insufficient_balance(self):
+        response = self.client.post(
+            reverse("account-widthdrawel"), {"cart_Total": "50.01"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("50.00"))
+
+    def test_withdrawel_without_account(self):
+        self.account.delete()
+        response = self.client.post(
+            reverse("account-widthdrawel"), {"cart_Total": "1.00"}, format="json"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_admin_cant_edit_the_balance(self):
+        staff = models.User.objects.create_superuser(
+            email="staff@example.com", username="staff", password="pass12345"
+        )
+        client = Client()
+        client.force_login(staff)
+
+        client.post(
+            reverse("admin:myapp_account_change", args=[self.account.id]),
+            {"user": self.user.id, "balance": "1000.00"},
+        )
+
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("50.00"))
+
+    def test_second_account_left_alone(self):
+        other = models.Account.objects.create(user=self.user, balance=5)
+
+        models.Account.objects.withdraw(self.user, Decimal("10.00"))
+
+        self.account.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("40.00"))
+        self.assertEqual(other.balance, Decimal("5.00"))
+        entry = models.WalletTransaction.objects.get()
+        self.assertEqual(entry.account_id, self.account.id)
+        self.assertEqual(entry.balance_after, Decimal("40.00"))
+
+
+class ConcurrentBalanceTests(TransactionTestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.account = models.Account.objects.create(user=self.user, balance=0)
+
+    def run_in_threads(self, operations):
+        def run(operation):
+            try:
+                return operation()
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            return list(pool.map(run, operations))
+
+    def test_concurrent_deposits_and_withdrawels_are_exact(self):
+        # enough up front that no withdrawel can fail whatever order they run in
+        models.Account.objects.deposit(self.user, Decimal("200.00"))
+        deposit = lambda: models.Account.objects.deposit(self.user, Decimal("2.00"))
+        withdraw = lambda: models.Account.objects.withdraw(self.user, Decimal("1.00"))
+
+        results = self.run_in_threads([deposit, withdraw] * 200)
+
+        self.assertNotIn(None, results)
+        self.assertEqual(
+            models.Account.objects.get_balance(self.user), Decimal("400.00")
+        )
+        self.assertEqual(models.WalletTransaction.objects.count(), 401)
+        self.assertEqual(ledger.rebuild_balance(self.account.id), Decimal("400.00"))
+
+    def test_concurrent_withdrawels_never_overdraw(self):
+        models.Account.objects.deposit(self.user, Decimal("100.00"))
+        withdraw = lambda: models.Account.objects.withdraw(self.user, Decimal("1.00"))
+
+        results = self.run_in_threads([withdraw] * 300)
+
+        self.assertEqual(len(results) - results.count(None), 100)
+        self.assertEqual(models.Account.objects.get_balance(self.user), Decimal("0"))
+
+    def test_concurrent_retries_with_one_key_charge_once(self):
+        models.Account.objects.deposit(self.user, Decimal("100.00"))
+
+        def withdraw():
+            client = APIClient()
+            client.force_authenticate(self.user)
+            response = client.post(
+                reverse("account-widthdrawel"),
+                {"cart_Total": "10.00"},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="retry-1",
+            )
+            return response.status_code, response.json()
+
+        results = self.run_in_threads([withdraw] * 8)
+
+        self.assertEqual(
+            results,
+            [(200, {"detail": "withdrawel successful", "new_balance": 90.0})] * 8,
+        )
+        self.assertEqual(
+            models.Account.objects.get_balance(self.user), Decimal("90.00")
+        )
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.account = models.Account.objects.create(user=self.user, balance=100)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.url = reverse("checkout")
+
+    def checkout(self, products, quantity=1):
+        return self.client.post(
+            self.url,
+            {
+                "items": [
+                    {"product_id": product.id, "quantity": quantity}
+                    for product in products
+                ]
+            },
+            format="json",
+        )
+
+    def stock_of(self, products):
+        return list(
+            models.Product.objects.filter(
+                id__in=[product.id for product in products]
+            ).values_list("quantity", flat=True)
+        )
+
+    def test_checkout_debits_wallet_and_takes_stock(self):
+        products = make_products(2)
+        models.Product.objects.update(quantity=5)
+
+        response = self.checkout(products, quantity=2)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["new_balance"], 60.0)
+        self.assertEqual(Decimal(response.data["order"]["total_price"]), 40)
+        self.assertEqual(self.stock_of(products), [3, 3])
+        self.assertEqual(models.OrderItem.objects.count(), 2)
+
+    def test_insufficient_balance_rolls_back(self):
+        products = make_products(1, price="150.00")
+        models.Product.objects.update(quantity=5)
+
+        response = self.checkout(products)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.stock_of(products), [5])
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_out_of_stock_rolls_back(self):
+        products = make_products(2)
+        models.Product.objects.filter(id=products[0].id).update(quantity=0)
+
+        response = self.checkout(products)
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["items"], ["Not enough stock for Product 0."])
+        self.account.refresh_from_db()
+        self.assertEqual(self.account.balance, Decimal("100.00"))
+        self.assertEqual(self.stock_of(products[1:]), [1])
+        self.assertFalse(models.Order.objects.exists())
+
+    def test_query_count_does_not_grow_with_basket(self):
+        small_cart = make_products(1, price="1.00")
+        large_cart = make_products(15, price="1.00")
+
+        with CaptureQueriesContext(connection) as small:
+            self.checkout(small_cart)
+        with CaptureQueriesContext(connection) as large:
+            self.checkout(large_cart)
+
+        self.assertEqual(models.Order.objects.count(), 2)
+        self.assertEqual(len(small), len(large))
+
+
+class ProductCatalogueCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        make_products(3)
+        self.client = APIClient()
+        self.url = reverse("product-list")
+
+    def test_response_has_validators(self):
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 3)
+        self.assertIn("ETag", response)
+        self.assertIn("Last-Modified", response)
+
+    def test_current_etag_gets_304_without_queries(self):
+        etag = self.client.get(self.url)["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_repeat_request_served_from_cache(self):
+        self.client.get(self.url)
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url)
+
+        self.assertEqual(len(response.data["results"]), 3)
+
+    def test_product_change_invalidates(self):
+        etag = self.client.get(self.url)["ETag"]
+        with self.captureOnCommitCallbacks(execute=True):
+            make_products(1)[0].save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response["ETag"], etag)
+        self.assertEqual(len(response.data["results"]), 4)
+
+    def test_product_delete_invalidates(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            models.Product.objects.first().delete()
+
+        self.assertEqual(len(self.client.get(self.url).data["results"]), 2)
+
+    def test_rolled_back_change_keeps_the_version(self):
+        version = catalogue.get_version()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                make_products(1)
+                transaction.set_rollback(True)
+
+        self.assertEqual(catalogue.get_version(), version)
+
+
+class PaginationAndFieldsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_products_paginate_by_cursor(self):
+        make_products(5)
+        url = reverse("product-list")
+
+        first = self.client.get(url, {"page_size": 3}).data
+        second = self.client.get(first["next"]).data
+
+        ids = [product["id"] for product in first["results"] + second["results"]]
+        self.assertEqual(ids, sorted(ids))
+        self.assertEqual(len(set(ids)), 5)
+        self.assertIsNone(second["next"])
+
+    def test_products_field_projection(self):
+        make_products(2)
+
+        response = self.client.get(reverse("product-list"), {"fields": "id,name,price"})
+
+        for product in response.data["results"]:
+            self.assertEqual(set(product), {"id", "name", "price"})
+
+    def test_unknown_fields_rejected(self):
+        make_products(1)
+
+        response = self.client.get(reverse("product-list"), {"fields": "id,nmae,prize"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data, {"fields": ["Unknown fields: nmae, prize."]})
+
+    def test_orders_paginate_newest_first_with_fields(self):
+        user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        for _ in range(3):
+            models.Order.objects.create(user=user)
+        self.client.force_authenticate(user)
+
+        response = self.client.get(
+            reverse("order-list-create"), {"page_size": 2, "fields": "id,status"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), 2)
+        self.assertIsNotNone(response.data["next"])
+        self.assertEqual(set(response.data["results"][0]), {"id", "status"})
+        ids = [order["id"] for order in response.data["results"]]
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+    def test_fields_ignored_when_creating_orders(self):
+        user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.client.force_authenticate(user)
+        product = make_products(1)[0]
+
+        response = self.client.post(
+            reverse("order-list-create") + "?fields=id",
+            {"items": [{"product_id": product.id, "quantity": 1}]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+
+class OrderHistoryTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.products = make_products(2)
+
+    def make_user_with_orders(self, email, count):
+        user = models.User.objects.create_user(
+            email=email, username="student", password="pass12345"
+        )
+        orders = models.Order.objects.bulk_create(
+            [models.Order(user=user, total_price=20) for _ in range(count)]
+        )
+        models.OrderItem.objects.bulk_create(
+            [
+                models.OrderItem(order=order, product=product, price=10, quantity=1)
+                for order in orders
+                for product in self.products
+            ]
+        )
+        return user
+
+    def history(self, user):
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("order-list-create"), {"page_size": 100})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response, len(queries)
+
+    def test_history_has_nested_items(self):
+        user = self.make_user_with_orders("student@example.com", 1)
+
+        response, _ = self.history(user)
+
+        items = response.data["results"][0]["items"]
+        self.assertEqual(
+            {item["product_name"] for item in items}, {"Product 0", "Product 1"}
+        )
+
+    def test_query_count_constant_for_large_history(self):
+        small_user = self.make_user_with_orders("small@example.com", 10)
+        large_user = self.make_user_with_orders("large@example.com", 1000)
+
+        _, small_queries = self.history(small_user)
+        response, large_queries = self.history(large_user)
+
+        self.assertEqual(len(response.data["results"]), 100)
+        self.assertEqual(small_queries, large_queries)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        token_cache.clear()
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        models.Account.objects.create(user=self.user, balance=5)
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f"Token {self.token.key}")
+        self.url = reverse("accounts")
+
+    def test_hit_skips_token_lookup(self):
+        with CaptureQueriesContext(connection) as miss:
+            self.client.get(self.url)
+        with CaptureQueriesContext(connection) as hit:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(miss) - len(hit), 1)
+        self.assertEqual(token_cache.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+        with self.assertNumQueries(0):
+            user, _ = CachedTokenAuthentication().authenticate_credentials(
+                self.token.key
+            )
+        self.assertEqual(user, self.user)
+
+    def test_deleted_token_is_evicted(self):
+        self.client.get(self.url)
+        self.token.delete()
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_deactivated_user_is_evicted(self):
+        self.client.get(self.url)
+        self.user.is_active = False
+        self.user.save()
+
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_cache_is_bounded(self):
+        cache = TokenCache(max_size=2, ttl=60)
+        for key in ["a", "b", "c"]:
+            cache.set(key, self.token)
+
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.stats()["size"], 2)
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000)
+class LoginThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.client = APIClient()
+        self.url = reverse("login")
+
+    def login(self, email="student@example.com", password="pass12345", ip=None):
+        extra = {"REMOTE_ADDR": ip} if ip else {}
+        return self.client.post(
+            self.url, {"email": email, "password": password}, format="json", **extra
+        )
+
+    def test_login(self):
+        response = self.login()
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn("token", response.data)
+
+    @override_settings(
+        LOGIN_RATE_LIMITS={
+            "email": {"capacity": 3, "per_seconds": 300},
+            "ip": {"capacity": 100, "per_seconds": 60},
+        }
+    )
+    def test_email_bucket_throttles_without_hashing(self):
+        for _ in range(3):
+            self.login(password="wrong")
+
+        with mock.patch("myapp.models.User.check_password") as check_password:
+            response = self.login(ip="10.0.0.2")
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        check_password.assert_not_called()
+        self.assertEqual(self.login(email="other@example.com").status_code, 400)
+
+    @override_settings(
+        LOGIN_RATE_LIMITS={
+            "email": {"capacity": 100, "per_seconds": 300},
+            "ip": {"capacity": 2, "per_seconds": 60},
+        }
+    )
+    def test_ip_bucket_throttles(self):
+        self.login(email="a@example.com")
+        self.login(email="b@example.com")
+
+        response = self.login()
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+        self.assertEqual(self.login(ip="10.0.0.3").status_code, 200)
+
+    @override_settings(
+        LOGIN_RATE_LIMITS={
+            "email": {"capacity": 100, "per_seconds": 300},
+            "ip": {"capacity": 2, "per_seconds": 60},
+        }
+    )
+    def test_forwarded_for_doesnt_get_a_fresh_ip_bucket(self):
+        for n in range(2):
+            self.login(email=f"{n}@example.com")
+
+        response = self.client.post(
+            self.url,
+            {"email": "student@example.com", "password": "pass12345"},
+            format="json",
+            HTTP_X_FORWARDED_FOR="10.9.9.9",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+
+    def test_concurrent_attempts_share_the_tokens(self):
+        take = lambda _: throttling.take_token("login:test:race", 5, 300)[0]
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            allowed = list(pool.map(take, range(40)))
+
+        self.assertEqual(allowed.count(True), 5)
+
+    def test_unknown_email_still_hashes(self):
+        with mock.patch(
+            "myapp.serializers.make_password", wraps=make_password
+        ) as hasher:
+            response = self.login(email="nobody@example.com")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        hasher.assert_called_once()
+
+    def test_hash_upgraded_to_current_cost(self):
+        with override_settings(PASSWORD_HASH_ITERATIONS=2000):
+            self.assertEqual(self.login().status_code, status.HTTP_200_OK)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith("pbkdf2_sha256$2000$"))
+
+
+def make_png(width, height, colour="red"):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), colour).save(output, "PNG")
+    return SimpleUploadedFile("snack.png", output.getvalue(), "image/png")
+
+
+class ProductImageDerivativeTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(
+            MEDIA_ROOT=media_root, PRODUCT_IMAGE_WIDTHS=[160, 320, 640]
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def make_product(self, image):
+        return models.Product.objects.create(
+            name="Toastie", type="food", price=Decimal("25.00"), image=image
+        )
+
+    def test_derivatives_made_on_save(self):
+        product = self.make_product(make_png(400, 200))
+
+        self.assertEqual(set(product.image_variants), {"160", "320"})
+        for name in product.image_variants.values():
+            with default_storage.open(name) as derivative:
+                self.assertEqual(Image.open(derivative).format, "WEBP")
+
+    def test_small_image_not_upscaled(self):
+        product = self.make_product(make_png(100, 100))
+
+        self.assertEqual(list(product.image_variants), ["100"])
+
+    def test_unchanged_image_not_regenerated(self):
+        product = self.make_product(make_png(400, 200))
+
+        with mock.patch("myapp.images.resize") as resize:
+            product.price = Decimal("30.00")
+            product.save()
+
+        resize.assert_not_called()
+
+    def test_unchanged_image_not_read(self):
+        self.make_product(make_png(400, 200))
+        product = models.Product.objects.get()
+
+        with mock.patch("myapp.images.content_hash") as content_hash:
+            product.price = Decimal("30.00")
+            product.save()
+
+        content_hash.assert_not_called()
+
+    def test_missing_file_still_saves(self):
+        self.make_product(make_png(400, 200))
+        product = models.Product.objects.get()
+        default_storage.delete(product.image.name)
+        product.image = "product_images/gone.png"
+
+        with self.assertLogs("myapp.images", "ERROR"):
+            product.save()
+
+        self.assertEqual(product.image_variants, {})
+
+    def test_new_image_regenerated(self):
+        product = self.make_product(make_png(400, 200))
+        old_variants = product.image_variants
+
+        product.image = make_png(400, 200, colour="blue")
+        product.save()
+
+        self.assertNotEqual(product.image_variants, old_variants)
+
+    def test_force_remakes_missing_files(self):
+        product = self.make_product(make_png(400, 200))
+        missing = product.image_variants["160"]
+        default_storage.delete(missing)
+
+        out = io.StringIO()
+        call_command("build_image_derivatives", stdout=out)
+        self.assertFalse(default_storage.exists(missing))
+
+        call_command("build_image_derivatives", "--force", stdout=out)
+        self.assertTrue(default_storage.exists(missing))
+        self.assertIn("built image derivatives for 1 products", out.getvalue())
+
+    def test_srcset_in_product_list(self):
+        self.make_product(make_png(400, 200))
+
+        response = APIClient().get(reverse("product-list"), {"fields": "id,srcset"})
+
+        srcset = response.data["results"][0]["srcset"]
+        self.assertEqual(set(srcset), {"160", "320"})
+        self.assertTrue(srcset["160"].startswith("http://testserver/"))
+
+
+class PostFeedTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.url = reverse("post-list")
+
+    def make_posts(self, count):
+        profiles = []
+        for i in range(count):
+            user = models.User.objects.create(
+                email=f"author{i}@example.com", username=f"author{i}"
+            )
+            profiles.append(models.UserProfile(user=user))
+        profiles = models.UserProfile.objects.bulk_create(profiles)
+        models.Post.objects.bulk_create(
+            [
+                models.Post(author=profile, title=f"Post {i}", content="...")
+                for i, profile in enumerate(profiles)
+            ]
+        )
+
+    def page_queries(self, url, page_size):
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, {"page_size": page_size})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["results"]), page_size)
+        return response, len(queries)
+
+    def test_post_page_query_count_is_constant(self):
+        self.make_posts(500)
+
+        _, small = self.page_queries(self.url, 5)
+        response, large = self.page_queries(self.url, 500)
+
+        self.assertEqual(small, large)
+        self.assertTrue(response.data["results"][0]["author"].startswith("author"))
+
+    def test_profile_page_query_count_is_constant(self):
+        self.make_posts(50)
+        url = reverse("userprofile-list-create")
+
+        _, small = self.page_queries(url, 5)
+        _, large = self.page_queries(url, 50)
+
+        self.assertEqual(small, large)
+
+    def test_posts_newest_first(self):
+        self.make_posts(3)
+
+        titles = [post["title"] for post in self.client.get(self.url).data["results"]]
+
+        self.assertEqual(titles, ["Post 2", "Post 1", "Post 0"])
+
+    def test_saving_a_post_invalidates_cached_page(self):
+        self.make_posts(2)
+        self.client.get(self.url)
+
+        post = models.Post.objects.get(title="Post 0")
+        post.title = "Edited"
+        with self.captureOnCommitCallbacks(execute=True):
+            post.save()
+
+        titles = [post["title"] for post in self.client.get(self.url).data["results"]]
+        self.assertIn("Edited", titles)
+
+
+class PerformanceMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        registry.reset()
+        self.client = APIClient()
+
+    def test_server_timing_header(self):
+        make_products(2)
+
+        response = self.client.get(reverse("product-list"))
+
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+$',
+        )
+
+    def test_metrics_are_staff_only(self):
+        user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.client.force_authenticate(user)
+
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_metrics_in_prometheus_format(self):
+        staff = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        self.client.force_authenticate(staff)
+        for _ in range(3):
+            self.client.get(reverse("product-list"))
+
+        body = self.client.get(reverse("metrics")).content.decode()
+
+        self.assertIn("# TYPE tuckshop_request_duration_seconds histogram", body)
+        self.assertIn(
+            'tuckshop_request_duration_seconds_count{route="product-list"} 3', body
+        )
+        self.assertIn(
+            'tuckshop_request_latency_seconds{route="product-list",quantile="0.99"}',
+            body,
+        )
+        self.assertEqual(set(registry.percentiles("product-list")), {50, 95, 99})
+
+
+def url_names(patterns):
+    for pattern in patterns:
+        if isinstance(pattern, URLResolver):
+            yield from url_names(pattern.url_patterns)
+        elif pattern.name:
+            yield pattern.name
+
+
+async def first_chunk(response):
+    return await anext(aiter(response.streaming_content))
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PROVISIONING_HASH_WORKERS=1)
+class QueryBudgetTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        models.Account.objects.create(user=self.user, balance=10**6)
+        self.profile = models.UserProfile.objects.create(user=self.user)
+        Token.objects.create(user=self.user)
+        self.products = []
+        self.seeded = 0
+
+    def seed(self, count):
+        # count more of every kind of row, owned by a mix of users
+        start = self.seeded
+        self.seeded += count
+        for i in range(start, self.seeded):
+            user = models.User.objects.create(
+                email=f"student{i}@example.com", username=f"student{i}"
+            )
+            profile = models.UserProfile.objects.create(user=user)
+            models.Post.objects.create(author=profile, title=f"Post {i}", content="")
+            models.Post.objects.create(
+                author=self.profile, title=f"Staff post {i}", content=""
+            )
+        self.products += make_products(count)
+        models.Product.objects.update(quantity=10**6)
+        for product in self.products[start:]:
+            order = models.Order.objects.create(user=self.user, total_price=10)
+            models.OrderItem.objects.bulk_create(
+                [
+                    models.OrderItem(order=order, product=item, price=10)
+                    for item in self.products[: start + 3]
+                ]
+            )
+
+    def calls(self):
+        cart = {
+            "items": [
+                {"product_id": product.id, "quantity": 1}
+                for product in self.products[:5]
+            ]
+        }
+        post = models.Post.objects.first()
+        order_ids = list(models.Order.objects.values_list("id", flat=True)[:5])
+        return [
+            ("api-root", "GET", {}, None),
+            ("post-list", "GET", {}, None),
+            ("post-detail", "GET", {"pk": post.pk}, None),
+            (
+                "register",
+                "POST",
+                {},
+                {
+                    "username": "new",
+                    "email": f"new{self.seeded}@example.com",
+                    "password": "pass12345",
+                },
+            ),
+            (
+                "login",
+                "POST",
+                {},
+                {"email": "staff@example.com", "password": "pass12345"},
+            ),
+            ("userprofile-list-create", "GET", {}, None),
+            ("userprofile-detail", "GET", {"pk": self.profile.pk}, None),
+            ("product-list", "GET", {}, None),
+            ("accounts", "GET", {}, None),
+            ("account-deposit", "POST", {}, {"depositAmount": "10.00"}),
+            ("account-widthdrawel", "POST", {}, {"cart_Total": "10.00"}),
+            # the order then uses up the reservation
+            ("stock-reservations", "POST", {}, cart),
+            ("stock-reservations", "GET", {}, None),
+            ("order-list-create", "GET", {}, None),
+            ("order-list-create", "POST", {}, cart),
+            ("order-stream", "GET", {}, None),
+            ("order-export", "GET", {}, None),
+            (
+                "order-status-update",
+                "POST",
+                {},
+                {"ids": order_ids, "status": "Processing"},
+            ),
+            ("checkout", "POST", {}, cart),
+            (
+                "sales-summary",
+                "GET",
+                {},
+                {"date_from": "2020-01-15", "date_to": "2030-06-15"},
+            ),
+            ("top-sellers", "GET", {}, {"date_from": "2020-01-15"}),
+            (
+                "batch",
+                "POST",
+                {},
+                {
+                    "requests": [
+                        {"method": "GET", "path": reverse("accounts")},
+                        {"method": "GET", "path": reverse("product-list")},
+                        {"method": "GET", "path": reverse("order-list-create")},
+                    ]
+                },
+            ),
+            ("metrics", "GET", {}, None),
+            (
+                "student-bulk-create",
+                "POST",
+                {},
+                "email,username,password\n"
+                f"bulk{self.seeded}a@example.com,a,pass12345\n"
+                f"bulk{self.seeded}b@example.com,b,pass12345\n"
+                "not-an-email,c,pass12345\n",
+            ),
+        ]
+
+    def measure(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        # for the plain django views, force_authenticate only reaches drf ones
+        client.force_login(self.user)
+        async_client = AsyncClient()
+        async_client.force_login(self.user)
+        counts = {}
+        for name, method, kwargs, data in self.calls():
+            # start cold so cached pages and login buckets dont hide queries
+            cache.clear()
+            url = reverse(name, kwargs=kwargs)
+            # on commit hooks run in the request too, so they count against it
+            with (
+                CaptureQueriesContext(connection) as queries,
+                self.captureOnCommitCallbacks(execute=True),
+            ):
+                if asyncio.iscoroutinefunction(resolve(url).func):
+                    # async views only stream under asgi
+                    response = async_to_sync(async_client.get)(url, data)
+                elif method == "GET":
+                    response = client.get(url, data)
+                elif isinstance(data, str):
+                    response = client.post(url, data, content_type="text/csv")
+                else:
+                    response = client.post(url, data, format="json")
+                if response.streaming and response.is_async:
+                    # live streams never finish, the snapshot is all they query
+                    body = async_to_sync(first_chunk)(response)
+                elif response.streaming:
+                    # streamed responses do their queries as they are read
+                    body = b"".join(response.streaming_content)
+                else:
+                    body = response.content
+            self.assertLess(response.status_code, 400, f"{method} {url}: {body!r}")
+            counts[name, method] = queries.captured_queries
+        return counts
+
+    def test_every_route_has_a_budget(self):
+        names = set(url_names(myapp_urls.urlpatterns))
+
+        self.assertEqual(names - set(QUERY_BUDGETS), set())
+        self.seed(1)
+        called = {name for name, _, _, _ in self.calls()}
+        self.assertEqual(names - called, set())
+
+    def test_routes_stay_within_budget_and_do_not_grow(self):
+        self.seed(2)
+        small = self.measure()
+        self.seed(18)
+        large = self.measure()
+
+        for (name, method), queries in large.items():
+            budget = QUERY_BUDGETS[name][method]
+            sql = "\n".join(query["sql"] for query in queries)
+            with self.subTest(route=name, method=method):
+                self.assertLessEqual(
+                    len(queries),
+                    budget,
+                    f"{method} {name} ran {len(queries)} queries, budget is "
+                    f"{budget}:\n{sql}",
+                )
+                self.assertEqual(
+                    len(queries),
+                    len(small[name, method]),
+                    f"{method} {name} went from {len(small[name, method])} to "
+                    f"{len(queries)} queries with more data:\n{sql}",
+                )
+
+
+class SeedShopTests(TestCase):
+    def seed(self, prefix):
+        call_command(
+            "seed_shop",
+            users=20,
+            products=10,
+            orders=50,
+            chunk=7,
+            prefix=prefix,
+            stdout=io.StringIO(),
+        )
+        return list(
+            models.Order.objects.filter(user__email__startswith=prefix)
+            .order_by("id")
+            .values_list("total_price", "order_date__date", "items__quantity")
+        )
+
+    def test_seeds_every_table(self):
+        self.seed("a")
+
+        self.assertEqual(models.User.objects.count(), 20)
+        self.assertEqual(models.Account.objects.count(), 20)
+        self.assertEqual(models.Product.objects.count(), 10)
+        self.assertEqual(models.Order.objects.count(), 50)
+        for order in models.Order.objects.prefetch_related("items"):
+            self.assertEqual(
+                order.total_price,
+                sum(item.price * item.quantity for item in order.items.all()),
+            )
+
+    def test_same_seed_same_data(self):
+        self.assertEqual(self.seed("a"), self.seed("b"))
+
+    def test_refuses_to_reuse_prefix(self):
+        self.seed("a")
+
+        with self.assertRaises(CommandError):
+            self.seed("a")
+
+
+@override_settings(PASSWORD_HASH_ITERATIONS=1000, PROVISIONING_HASH_WORKERS=1)
+class BulkStudentProvisioningTests(TestCase):
+    csv = (
+        "email,username,password\n"
+        "one@example.com,one,pass12345\n"
+        "not-an-email,two,pass12345\n"
+        "taken@example.com,three,pass12345\n"
+        "one@example.com,four,pass12345\n"
+        "five@example.com,,pass12345\n"
+        "six@example.com,six,pass12345\n"
+    )
+
+    def setUp(self):
+        self.staff = models.User.objects.create_user(
+            email="taken@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.url = reverse("student-bulk-create")
+
+    def results(self, response):
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        body = b"".join(response.streaming_content).decode()
+        return [json.loads(line) for line in body.splitlines()]
+
+    def test_per_row_errors_streamed_back(self):
+        results = self.results(
+            self.client.post(self.url, self.csv, content_type="text/csv")
+        )
+
+        self.assertEqual(
+            [result["status"] for result in results],
+            ["created", "error", "error", "error", "error", "created"],
+        )
+        self.assertEqual(
+            results[2]["errors"], ["A user with this email already exists."]
+        )
+        one = models.User.objects.get(email="one@example.com")
+        self.assertTrue(one.check_password("pass12345"))
+        self.assertTrue(models.Account.objects.filter(user=one).exists())
+        self.assertTrue(models.UserProfile.objects.filter(user=one).exists())
+
+    def test_values_too_long_for_the_columns(self):
+        long_email = "a" * 64 + "@" + ".".join(["b" * 63] * 3) + ".com"
+        csv = (
+            "email,username,password\n"
+            f"{long_email},long,pass12345\n"
+            f"long@example.com,{'x' * 151},pass12345\n"
+            "fine@example.com,fine,pass12345\n"
+        )
+
+        results = self.results(self.client.post(self.url, csv, content_type="text/csv"))
+
+        self.assertEqual(
+            [result.get("errors") for result in results],
+            [
+                ["Email can be at most 254 characters."],
+                ["Username can be at most 150 characters."],
+                None,
+            ],
+        )
+
+    def test_database_error_reported_per_row(self):
+        with (
+            mock.patch.object(
+                models.User.objects,
+                "bulk_create",
+                side_effect=DataError("value too long for type character varying"),
+            ),
+            self.assertLogs("myapp.provisioning", "ERROR"),
+        ):
+            results = self.results(
+                self.client.post(self.url, self.csv, content_type="text/csv")
+            )
+
+        self.assertEqual(len(results), 6)
+        self.assertEqual(
+            results[0]["errors"], ["Could not save this row, upload it again."]
+        )
+
+    @override_settings(PROVISIONING_HASH_WORKERS=2)
+    def test_uploads_share_one_pool(self):
+        self.addCleanup(setattr, provisioning, "_pool", None)
+        csv = "email,username,password\na@example.com,a,pass12345\nb@example.com,b,pass12345\n"
+
+        # threads stand in for processes, the test database isnt shared
+        with mock.patch(
+            "myapp.provisioning.ProcessPoolExecutor", wraps=ThreadPoolExecutor
+        ) as pool:
+            first = self.results(
+                self.client.post(self.url, csv, content_type="text/csv")
+            )
+            second = self.results(
+                self.client.post(
+                    self.url, csv.replace("@", "2@"), content_type="text/csv"
+                )
+            )
+
+        pool.assert_called_once()
+        self.assertEqual(
+            [result["status"] for result in first + second], ["created"] * 4
+        )
+
+    def test_file_upload(self):
+        upload = SimpleUploadedFile("students.csv", self.csv.encode(), "text/csv")
+
+        results = self.results(
+            self.client.post(self.url, {"file": upload}, format="multipart")
+        )
+
+        self.assertEqual(len(results), 6)
+
+    def test_missing_columns(self):
+        response = self.client.post(
+            self.url, "email,password\na@example.com,x\n", content_type="text/csv"
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_only(self):
+        student = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.client.force_authenticate(student)
+
+        response = self.client.post(self.url, self.csv, content_type="text/csv")
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_command_hashes_in_process_pool(self):
+        path = os.path.join(tempfile.mkdtemp(), "students.csv")
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, "w") as csv_file:
+            csv_file.write("email,username,password\n")
+            for i in range(10):
+                csv_file.write(f"pool{i}@example.com,pool{i},pass{i}word\n")
+
+        output = io.StringIO()
+        call_command(
+            "provision_students", path, workers=2, chunk=4, stdout=output, stderr=output
+        )
+
+        self.assertIn("10 created, 0 errors", output.getvalue())
+        user = models.User.objects.get(email="pool7@example.com")
+        self.assertTrue(user.check_password("pass7word"))
+
+
+class WalletLedgerTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.account = models.Account.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_every_balance_change_is_recorded(self):
+        product = make_products(1, price="4.00")[0]
+        models.Product.objects.update(quantity=5)
+
+        self.client.post(
+            reverse("account-deposit"), {"depositAmount": "20.00"}, format="json"
+        )
+        self.client.post(
+            reverse("account-widthdrawel"), {"cart_Total": "5.00"}, format="json"
+        )
+        response = self.client.post(
+            reverse("checkout"),
+            {"items": [{"product_id": product.id, "quantity": 2}]},
+            format="json",
+        )
+
+        self.assertEqual(
+            list(
+                self.account.transactions.order_by("id").values_list(
+                    "kind", "amount", "balance_after", "order_id"
+                )
+            ),
+            [
+                ("deposit", Decimal("20.00"), Decimal("20.00"), None),
+                ("withdrawel", Decimal("-5.00"), Decimal("15.00"), None),
+                (
+                    "order",
+                    Decimal("-8.00"),
+                    Decimal("7.00"),
+                    response.data["order"]["id"],
+                ),
+            ],
+        )
+
+    def test_failed_withdrawel_not_recorded(self):
+        self.client.post(
+            reverse("account-widthdrawel"), {"cart_Total": "5.00"}, format="json"
+        )
+
+        self.assertFalse(models.WalletTransaction.objects.exists())
+
+    def test_transactions_are_append_only(self):
+        models.Account.objects.deposit(self.user, Decimal("1.00"))
+        txn = models.WalletTransaction.objects.get()
+
+        with self.assertRaises(ValueError):
+            txn.save()
+        with self.assertRaises(ValueError):
+            txn.delete()
+
+    def test_rebuild_from_snapshot_and_tail(self):
+        for _ in range(3):
+            models.Account.objects.deposit(self.user, Decimal("10.00"))
+        self.assertEqual(ledger.take_snapshots(), 1)
+        self.assertEqual(ledger.take_snapshots(), 0)
+        models.Account.objects.withdraw(self.user, Decimal("4.00"))
+
+        self.assertEqual(ledger.rebuild_balance(self.account.id), Decimal("26.00"))
+        snapshot = models.BalanceSnapshot.objects.get()
+        self.assertEqual(snapshot.balance, Decimal("30.00"))
+
+    def test_reconcile_command(self):
+        other = models.User.objects.create_user(
+            email="other@example.com", username="other", password="pass12345"
+        )
+        models.Account.objects.create(user=other)
+        models.Account.objects.deposit(self.user, Decimal("10.00"))
+        models.Account.objects.deposit(other, Decimal("3.00"))
+        ledger.take_snapshots()
+        models.Account.objects.deposit(self.user, Decimal("2.50"))
+
+        call_command("reconcile_ledger", stdout=io.StringIO())
+
+        # a balance changed behind the ledger's back
+        models.Account.objects.filter(user=other).update(balance=99)
+        output = io.StringIO()
+        with self.assertRaises(CommandError):
+            call_command("reconcile_ledger", stdout=output)
+        self.assertIn("balance 99.00, ledger says 3.00", output.getvalue())
+
+
+class IdempotencyKeyTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.account = models.Account.objects.create(user=self.user, balance=50)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = make_products(1, quantity=10)[0]
+
+    def post(self, name, data, key):
+        return self.client.post(
+            reverse(name), data, format="json", HTTP_IDEMPOTENCY_KEY=key
+        )
+
+    def test_retried_order_is_created_once(self):
+        cart = {"items": [{"product_id": self.product.id, "quantity": 2}]}
+        first = self.post("order-list-create", cart, "order-1")
+
+        with (
+            mock.patch("myapp.serializers.OrdersSerializer.create") as create,
+            self.assertNumQueries(1),
+        ):
+            retry = self.post("order-list-create", cart, "order-1")
+
+        create.assert_not_called()
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry["Idempotent-Replayed"], "true")
+        self.assertEqual(models.Order.objects.count(), 1)
+
+    def test_retried_withdrawel_charges_once(self):
+        for _ in range(3):
+            response = self.post("account-widthdrawel", {"cart_Total": "5.00"}, "w-1")
+
+        self.assertEqual(response.json()["new_balance"], 45.0)
+        self.assertEqual(models.Account.objects.get_balance(self.user), Decimal("45"))
+        self.assertEqual(self.account.transactions.count(), 1)
+
+    def test_keys_are_per_user(self):
+        other = models.User.objects.create_user(
+            email="other@example.com", username="other", password="pass12345"
+        )
+        models.Account.objects.create(user=other, balance=0)
+        self.post("account-deposit", {"depositAmount": "5.00"}, "same")
+        self.client.force_authenticate(other)
+        self.post("account-deposit", {"depositAmount": "5.00"}, "same")
+
+        self.assertEqual(models.Account.objects.get_balance(other), Decimal("5"))
+
+    def test_reused_key_with_different_body_rejected(self):
+        self.post("account-deposit", {"depositAmount": "5.00"}, "d-1")
+        response = self.post("account-deposit", {"depositAmount": "500.00"}, "d-1")
+
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(models.Account.objects.get_balance(self.user), Decimal("55"))
+
+    def test_failures_are_not_kept(self):
+        too_much = self.post("account-widthdrawel", {"cart_Total": "80.00"}, "w-2")
+        models.Account.objects.deposit(self.user, Decimal("50.00"))
+        retry = self.post("account-widthdrawel", {"cart_Total": "80.00"}, "w-2")
+
+        self.assertEqual(too_much.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(retry.status_code, status.HTTP_200_OK)
+        self.assertEqual(models.Account.objects.get_balance(self.user), Decimal("20"))
+
+    def test_expired_keys_run_again_and_get_purged(self):
+        self.post("account-deposit", {"depositAmount": "5.00"}, "d-2")
+        with override_settings(IDEMPOTENCY_KEY_TTL=0):
+            self.post("account-deposit", {"depositAmount": "5.00"}, "d-2")
+            out = io.StringIO()
+            call_command("purge_idempotency_keys", stdout=out)
+
+        self.assertEqual(models.Account.objects.get_balance(self.user), Decimal("60"))
+        self.assertIn("1 expired keys deleted", out.getvalue())
+        self.assertFalse(models.IdempotencyKey.objects.exists())
+
+
+class OrderQueueTests(TestCase):
+    def setUp(self):
+        self.staff = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        self.student = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.product = make_products(1, quantity=10)[0]
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def place_order(self):
+        client = APIClient()
+        client.force_authenticate(self.student)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.post(
+                reverse("order-list-create"),
+                {"items": [{"product_id": self.product.id, "quantity": 2}]},
+                format="json",
+            )
+        return response.data["id"]
+
+    def read_event(self, chunk):
+        fields = dict(
+            line.split(": ", 1) for line in chunk.decode().splitlines() if line
+        )
+        return fields["event"], json.loads(fields["data"])
+
+    async def test_stream_sends_open_orders_then_new_ones(self):
+        waiting = await sync_to_async(self.place_order)()
+        await self.async_client.aforce_login(self.staff)
+
+        response = await self.async_client.get(reverse("order-stream"))
+        events = aiter(response.streaming_content)
+        snapshot = self.read_event(await anext(events))
+        placed = await sync_to_async(self.place_order)()
+        created = self.read_event(await asyncio.wait_for(anext(events), 5))
+        await events.aclose()
+
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        self.assertEqual(snapshot[0], "snapshot")
+        self.assertEqual([order["id"] for order in snapshot[1]], [waiting])
+        self.assertEqual(created[0], "order_created")
+        self.assertEqual(created[1][0]["id"], placed)
+        self.assertEqual(created[1][0]["items"][0]["quantity"], 2)
+
+    async def test_stream_is_staff_only(self):
+        await self.async_client.aforce_login(self.student)
+
+        response = await self.async_client.get(reverse("order-stream"))
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_bulk_status_moves_orders_forwards_in_one_update(self):
+        pending = [self.place_order() for _ in range(3)]
+        delivered = self.place_order()
+        models.Order.objects.filter(id=delivered).update(status="Delivered")
+
+        with self.assertNumQueries(2):
+            response = self.client.post(
+                reverse("order-status-update"),
+                {"ids": pending + [delivered], "status": "Shipped"},
+                format="json",
+            )
+
+        self.assertEqual(response.data, {"updated": 3, "status": "Shipped"})
+        self.assertEqual(
+            dict(models.Order.objects.values_list("id", "status")),
+            {**{order_id: "Shipped" for order_id in pending}, delivered: "Delivered"},
+        )
+
+    def test_bulk_status_is_announced(self):
+        order_id = self.place_order()
+
+        with (
+            mock.patch.object(order_events.broker, "listening", return_value=True),
+            mock.patch.object(order_events.broker, "publish") as publish,
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse("order-status-update"),
+                    {"ids": [order_id], "status": "Processing"},
+                    format="json",
+                )
+
+        event, data = publish.call_args.args
+        self.assertEqual(event, "order_updated")
+        self.assertEqual([order["status"] for order in data], ["Processing"])
+
+    def test_bulk_status_announces_only_what_moved(self):
+        waiting, already = self.place_order(), self.place_order()
+        models.Order.objects.filter(id=already).update(status="Processing")
+
+        with (
+            mock.patch.object(order_events.broker, "listening", return_value=True),
+            mock.patch.object(order_events.broker, "publish") as publish,
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(
+                    reverse("order-status-update"),
+                    {"ids": [waiting, already], "status": "Processing"},
+                    format="json",
+                )
+
+        _, data = publish.call_args.args
+        self.assertEqual([order["id"] for order in data], [waiting])
+
+    def test_stream_refused_under_wsgi(self):
+        self.client.force_login(self.staff)
+
+        response = self.client.get(reverse("order-stream"))
+
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+    def test_bulk_status_is_staff_only(self):
+        self.client.force_authenticate(self.student)
+        response = self.client.post(
+            reverse("order-status-update"),
+            {"ids": [1], "status": "Shipped"},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for name, product_type in [
+            ("Coke", "drinks"),
+            ("Coke Zero", "drinks"),
+            ("Cola Bottles", "sweets"),
+            ("Chocolate Coke Float", "drinks"),
+            ("Salt and Vinegar", "chips"),
+        ]:
+            models.Product.objects.create(name=name, type=product_type, price=1)
+        self.client = APIClient()
+        self.url = reverse("product-list")
+
+    def names(self, response):
+        return [product["name"] for product in response.data["results"]]
+
+    def test_type_filter(self):
+        response = self.client.get(self.url, {"type": "drinks"})
+
+        self.assertEqual(
+            self.names(response), ["Coke", "Coke Zero", "Chocolate Coke Float"]
+        )
+
+    def test_unknown_type_rejected(self):
+        response = self.client.get(self.url, {"type": "hats"})
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_prefix_search_is_ranked(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, {"q": "cok"})
+
+        self.assertEqual(
+            self.names(response), ["Coke", "Coke Zero", "Chocolate Coke Float"]
+        )
+
+    def test_every_word_has_to_match(self):
+        response = self.client.get(self.url, {"q": "co ze", "type": "drinks"})
+
+        self.assertEqual(self.names(response), ["Coke Zero"])
+
+    def test_search_pages_follow_the_ranking(self):
+        first = self.client.get(self.url, {"q": "co", "page_size": 2})
+        second = self.client.get(first.data["next"])
+
+        self.assertEqual(
+            self.names(first) + self.names(second),
+            self.names(self.client.get(self.url, {"q": "co"})),
+        )
+        self.assertEqual(len(self.names(second)), 2)
+
+    def test_search_pages_through_more_than_1000_ties(self):
+        # same length names all rank the same but for their id
+        models.Product.objects.bulk_create(
+            [
+                models.Product(name=f"Coke {i:05}", type="drinks", price=1)
+                for i in range(1500)
+            ]
+        )
+        expected = set(
+            models.Product.objects.filter(name__contains="Coke").values_list(
+                "id", flat=True
+            )
+        )
+
+        ids = []
+        url = f"{self.url}?q=coke&page_size=100&fields=id"
+        while url and len(ids) <= len(expected):
+            response = self.client.get(url)
+            ids += [product["id"] for product in response.data["results"]]
+            url = response.data["next"]
+
+        self.assertIsNone(url)
+        self.assertEqual(len(ids), len(expected))
+        self.assertEqual(set(ids), expected)
+
+    def test_search_syntax_in_q_is_just_text(self):
+        for q in ['"', "NOT", "co*) OR (", "--"]:
+            response = self.client.get(self.url, {"q": q})
+            self.assertEqual(response.status_code, status.HTTP_200_OK, q)
+
+    def test_index_follows_bulk_changes(self):
+        models.Product.objects.filter(name="Coke").update(name="Lemonade")
+        models.Product.objects.filter(name="Coke Zero").delete()
+        make_products(2)
+
+        self.assertEqual(
+            self.names(self.client.get(self.url, {"q": "lemon"})), ["Lemonade"]
+        )
+        self.assertEqual(
+            self.names(self.client.get(self.url, {"q": "coke"})),
+            ["Chocolate Coke Float"],
+        )
+        self.assertEqual(
+            len(self.names(self.client.get(self.url, {"q": "product"}))), 2
+        )
+
+    def test_repair_puts_dropped_triggers_back(self):
+        with connection.cursor() as cursor:
+            for name in search.FTS_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER {name}")
+        models.Product.objects.create(name="Pie", type="food", price=1)
+
+        search.repair_index(connection)
+        models.Product.objects.create(name="Pineapple", type="food", price=1)
+
+        self.assertEqual(
+            self.names(self.client.get(self.url, {"q": "pi"})), ["Pie", "Pineapple"]
+        )
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.staff = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+            is_superuser=True,
+        )
+        self.student = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.products = make_products(2, price="2.50")
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        self.url = reverse("order-export")
+
+        # one order a day from the 1st to the 3rd of march
+        for day, order_status in [(1, "Delivered"), (2, "Pending"), (3, "Delivered")]:
+            order = models.Order.objects.create(
+                user=self.student, status=order_status, total_price=7.50
+            )
+            models.Order.objects.filter(id=order.id).update(
+                order_date=timezone.make_aware(datetime.datetime(2026, 3, day, 12))
+            )
+            models.OrderItem.objects.create(
+                order=order, product=self.products[0], price="2.50", quantity=1
+            )
+            models.OrderItem.objects.create(
+                order=order, product=self.products[1], price="2.50", quantity=2
+            )
+
+    def export(self, **params):
+        response = self.client.get(self.url, params)
+        return response, b"".join(response.streaming_content).decode()
+
+    def test_csv_has_a_row_per_item(self):
+        response, body = self.export()
+        rows = list(csv.DictReader(io.StringIO(body)))
+
+        self.assertEqual(response["Content-Type"], "text/csv")
+        self.assertIn('filename="orders.csv"', response["Content-Disposition"])
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[1]["product_name"], "Product 1")
+        self.assertEqual(rows[1]["user_email"], "student@example.com")
+        self.assertEqual(rows[1]["line_total"], "5.00")
+
+    def test_csv_formulas_come_out_as_text(self):
+        models.Product.objects.filter(id=self.products[0].id).update(
+            name='=HYPERLINK("http://evil.example","Product 0")'
+        )
+
+        _, body = self.export()
+        rows = list(csv.DictReader(io.StringIO(body)))
+
+        self.assertEqual(rows[0]["product_name"][:2], "'=")
+        self.assertEqual(rows[0]["price"], "2.50")
+
+    def test_jsonl_filtered_by_date_and_status(self):
+        response, body = self.export(
+            output="jsonl",
+            date_from="2026-03-02",
+            date_to="2026-03-03",
+            status="Delivered",
+        )
+        rows = [json.loads(line) for line in body.splitlines()]
+
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        self.assertEqual({row["status"] for row in rows}, {"Delivered"})
+        self.assertEqual(len(rows), 2)
+        self.assertTrue(rows[0]["order_date"].startswith("2026-03-03"))
+
+    def test_one_query_however_many_rows(self):
+        with self.assertNumQueries(1):
+            self.export()
+
+    def test_bad_range_rejected(self):
+        response = self.client.get(
+            self.url, {"date_from": "2026-03-03", "date_to": "2026-03-01"}
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_staff_only(self):
+        self.client.force_authenticate(self.student)
+
+        self.assertEqual(
+            self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN
+        )
+
+    def test_command_matches_endpoint(self):
+        out, err = io.StringIO(), io.StringIO()
+        call_command("export_orders", "--status", "Pending", stdout=out, stderr=err)
+
+        self.assertEqual(out.getvalue(), self.export(status="Pending")[1])
+        self.assertIn("2 order items exported", err.getvalue())
+
+    def test_admin_item_list_does_not_query_per_row(self):
+        self.client.force_login(self.staff)
+        url = reverse("admin:myapp_orderitem_changelist")
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url)
+        models.OrderItem.objects.bulk_create(
+            models.OrderItem(
+                order_id=models.Order.objects.first().id,
+                product=self.products[0],
+                price="2.50",
+            )
+            for _ in range(10)
+        )
+
+        with self.assertNumQueries(len(queries)):
+            self.client.get(url)
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.staff = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        self.coke, self.pie = models.Product.objects.bulk_create(
+            [
+                models.Product(name="Coke", type="drinks", price="2.00"),
+                models.Product(name="Pie", type="food", price="5.00"),
+            ]
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def order(self, day, *lines):
+        order = models.Order.objects.create(user=self.staff)
+        models.Order.objects.filter(id=order.id).update(
+            order_date=timezone.make_aware(datetime.datetime(*day, 12))
+        )
+        models.OrderItem.objects.bulk_create(
+            models.OrderItem(
+                order=order, product=product, price=product.price, quantity=quantity
+            )
+            for product, quantity in lines
+        )
+
+    def summary(self, date_from, date_to):
+        return self.client.get(
+            reverse("sales-summary"), {"date_from": date_from, "date_to": date_to}
+        ).data
+
+    def test_orders_are_counted_once_past_the_watermark(self):
+        self.order((2026, 1, 31), (self.coke, 2), (self.pie, 1))
+        self.assertEqual(rollups.catch_up(), 1)
+        self.order((2026, 1, 31), (self.coke, 1))
+
+        self.assertEqual(rollups.catch_up(batch_size=1), 1)
+        self.assertEqual(rollups.catch_up(), 0)
+        self.assertEqual(
+            models.ProductSalesRollup.objects.get(
+                period="day", start="2026-01-31", product=self.coke
+            ).units,
+            3,
+        )
+        self.assertEqual(
+            models.TypeSalesRollup.objects.get(
+                period="month", start="2026-01-01", type="drinks"
+            ).revenue,
+            Decimal("6.00"),
+        )
+
+    def test_ranges_add_up_from_days_and_months(self):
+        self.order((2026, 1, 30), (self.pie, 1))
+        self.order((2026, 1, 31), (self.coke, 1))
+        self.order((2026, 2, 15), (self.coke, 2))
+        self.order((2026, 3, 1), (self.pie, 2))
+        self.order((2026, 3, 2), (self.coke, 5))
+        rollups.catch_up()
+
+        data = self.summary("2026-01-31", "2026-03-01")
+        self.assertEqual(data["units"], 5)
+        self.assertEqual(data["revenue"], Decimal("16.00"))
+        self.assertEqual(
+            [(row["type"], row["units"]) for row in data["by_type"]],
+            [("food", 2), ("drinks", 3)],
+        )
+        self.assertEqual(self.summary("2026-02-01", "2026-02-28")["units"], 2)
+        self.assertEqual(self.summary("2025-01-01", "2027-12-31")["units"], 11)
+
+    def test_top_sellers(self):
+        self.order((2026, 2, 1), (self.coke, 5), (self.pie, 1))
+        self.order((2026, 2, 2), (self.pie, 2))
+        rollups.catch_up()
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                reverse("top-sellers"),
+                {"date_from": "2026-02-01", "date_to": "2026-02-28", "limit": 1},
+            )
+
+        self.assertEqual(
+            response.data["results"],
+            [
+                {
+                    "product_id": self.coke.id,
+                    "name": "Coke",
+                    "type": "drinks",
+                    "units": 5,
+                    "revenue": Decimal("10.00"),
+                }
+            ],
+        )
+
+    def test_new_orders_wait_for_the_command(self):
+        models.Account.objects.create(user=self.staff, balance=100)
+        models.Product.objects.update(quantity=10)
+
+        # placing the order doesnt touch the rollups or the watermark lock
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("checkout"),
+                {"items": [{"product_id": self.pie.id, "quantity": 3}]},
+                format="json",
+            )
+        today = timezone.localdate()
+        self.assertEqual(self.summary(today, today)["revenue"], Decimal("0"))
+
+        call_command("rollup_sales", stdout=io.StringIO())
+        self.assertEqual(self.summary(today, today)["revenue"], Decimal("15.00"))
+
+    def test_rebuild_command(self):
+        self.order((2026, 2, 1), (self.coke, 5))
+        rollups.catch_up()
+        models.ProductSalesRollup.objects.update(units=999)
+
+        out = io.StringIO()
+        call_command("rollup_sales", "--rebuild", stdout=out)
+
+        self.assertIn("1 orders added", out.getvalue())
+        self.assertEqual(
+            set(models.ProductSalesRollup.objects.values_list("units", flat=True)), {5}
+        )
+
+    def test_staff_only(self):
+        self.client.force_authenticate(None)
+
+        self.assertEqual(
+            self.client.get(reverse("sales-summary")).status_code,
+            status.HTTP_401_UNAUTHORIZED,
+        )
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.student = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        self.other = models.User.objects.create_user(
+            email="other@example.com", username="other", password="pass12345"
+        )
+        self.toastie, self.juice = make_products(2, quantity=5)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def reserve(self, *lines):
+        return self.client.post(
+            reverse("stock-reservations"),
+            {
+                "items": [
+                    {"product_id": product.id, "quantity": quantity}
+                    for product, quantity in lines
+                ]
+            },
+            format="json",
+        )
+
+    def order(self, *lines, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.student)
+        return client.post(
+            reverse("order-list-create"),
+            {
+                "items": [
+                    {"product_id": product.id, "quantity": quantity}
+                    for product, quantity in lines
+                ]
+            },
+            format="json",
+        )
+
+    def stock(self, product):
+        product.refresh_from_db()
+        return product.quantity, product.reserved
+
+    def expire_holds(self):
+        models.StockReservation.objects.update(
+            expires_at=timezone.now() - datetime.timedelta(seconds=1)
+        )
+
+    def test_reserving_sets_stock_aside(self):
+        response = self.reserve((self.toastie, 3))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]["quantity"], 3)
+        self.assertEqual(self.stock(self.toastie), (2, 3))
+
+        # the amount is set, not added to, and 0 lets it go
+        self.reserve((self.toastie, 1))
+        self.assertEqual(self.stock(self.toastie), (4, 1))
+        self.reserve((self.toastie, 0))
+        self.assertEqual(self.stock(self.toastie), (5, 0))
+        self.assertFalse(models.StockReservation.objects.exists())
+
+    def test_cant_reserve_more_than_is_left(self):
+        self.reserve((self.juice, 1))
+        response = self.reserve((self.toastie, 6), (self.juice, 2))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["items"], ["Not enough stock for Product 0."])
+        self.assertEqual(self.stock(self.toastie), (5, 0))
+        self.assertEqual(self.stock(self.juice), (4, 1))
+
+    def test_unknown_products_rejected(self):
+        response = self.reserve((models.Product(id=9999), 1))
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            response.data["items"], ["Product with ID 9999 does not exist."]
+        )
+
+    def test_order_uses_up_the_reservation(self):
+        self.reserve((self.toastie, 3), (self.juice, 2))
+
+        # 2 of the 3 toasties held, the 3rd goes back. the juice wasnt held
+        response = self.order((self.toastie, 2), (self.juice, 1))
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(self.toastie), (3, 0))
+        self.assertEqual(self.stock(self.juice), (4, 0))
+        self.assertFalse(models.StockReservation.objects.exists())
+
+    def test_reserved_stock_cant_be_sold_to_someone_else(self):
+        self.reserve((self.toastie, 5))
+
+        response = self.order((self.toastie, 1), user=self.other)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data["items"], ["Not enough stock for Product 0."])
+
+        # but the one holding it can
+        self.assertEqual(self.order((self.toastie, 5)).status_code, 201)
+        self.assertEqual(self.stock(self.toastie), (0, 0))
+
+    def test_checkout_uses_the_reservation(self):
+        models.Account.objects.create(user=self.student, balance=100)
+        self.reserve((self.toastie, 5))
+
+        response = self.client.post(
+            reverse("checkout"),
+            {"items": [{"product_id": self.toastie.id, "quantity": 5}]},
+            format="json",
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(self.toastie), (0, 0))
+
+    def test_expired_holds_are_swept_back(self):
+        self.reserve((self.toastie, 2), (self.juice, 1))
+        self.expire_holds()
+
+        out = io.StringIO()
+        call_command("release_reservations", "--batch", "1", stdout=out)
+
+        self.assertIn("2 expired reservations released", out.getvalue())
+        self.assertEqual(self.stock(self.toastie), (5, 0))
+        self.assertEqual(self.stock(self.juice), (5, 0))
+        self.assertEqual(reservations.release_expired(), 0)
+
+    def test_running_short_sweeps_expired_holds_first(self):
+        self.reserve((self.toastie, 5))
+        self.expire_holds()
+
+        response = self.order((self.toastie, 4), user=self.other)
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.stock(self.toastie), (1, 0))
+
+    def test_running_short_leaves_other_expired_holds_to_the_command(self):
+        self.reserve((self.toastie, 5), (self.juice, 2))
+        self.expire_holds()
+
+        self.order((self.toastie, 4), user=self.other)
+
+        self.assertEqual(self.stock(self.juice), (3, 2))
+        call_command("release_reservations", stdout=io.StringIO())
+        self.assertEqual(self.stock(self.juice), (5, 0))
+
+    def test_product_list_shows_available_and_reserved(self):
+        self.reserve((self.toastie, 2))
+        cache.clear()
+
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse("product-list"), {"fields": "id,available,reserved"}
+            )
+
+        self.assertEqual(
+            response.data["results"][0],
+            {"id": self.toastie.id, "available": 3, "reserved": 2},
+        )
+
+    def test_saving_a_product_keeps_stock_moved_since_it_loaded(self):
+        product = models.Product.objects.get(id=self.toastie.id)
+        self.reserve((self.toastie, 2))
+
+        product.price = Decimal("3.00")
+        product.save()
+
+        self.assertEqual(self.stock(self.toastie), (3, 2))
+        self.assertEqual(self.toastie.price, Decimal("3.00"))
+
+    def admin_edit(self, opened_with, quantity):
+        staff = models.User.objects.create_superuser(
+            email="staff@example.com", username="staff", password="pass12345"
+        )
+        client = Client()
+        client.force_login(staff)
+        return client.post(
+            reverse("admin:myapp_product_change", args=[self.toastie.id]),
+            {
+                "name": self.toastie.name,
+                "type": self.toastie.type,
+                "price": "3.00",
+                "quantity": quantity,
+                "initial-quantity": opened_with,
+            },
+        )
+
+    def test_admin_edit_keeps_stock_sold_while_the_form_was_open(self):
+        self.reserve((self.toastie, 2))
+
+        response = self.admin_edit(opened_with=5, quantity=5)
+
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(self.stock(self.toastie), (3, 2))
+        self.assertEqual(self.toastie.price, Decimal("3.00"))
+
+    def test_admin_restock_adds_to_what_is_left(self):
+        self.reserve((self.toastie, 2))
+
+        self.admin_edit(opened_with=5, quantity=15)
+
+        self.assertEqual(self.stock(self.toastie), (13, 2))
+
+
+class BrowserMiddlewareScopeTests(TestCase):
+    def setUp(self):
+        self.staff = models.User.objects.create_user(
+            email="staff@example.com",
+            username="staff",
+            password="pass12345",
+            is_staff=True,
+        )
+        self.client = Client(enforce_csrf_checks=True)
+        self.client.force_login(self.staff)
+
+    def sessions_loaded(self, path):
+        process_request = SessionMiddleware.process_request
+        with mock.patch.object(
+            SessionMiddleware,
+            "process_request",
+            autospec=True,
+            side_effect=process_request,
+        ) as patched:
+            response = self.client.get(path)
+        return response, patched.called
+
+    def test_api_skips_sessions_and_csrf(self):
+        response, sessions_loaded = self.sessions_loaded(reverse("product-list"))
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(sessions_loaded)
+        self.assertNotIn("csrftoken", response.cookies)
+
+    def test_admin_keeps_sessions_and_csrf(self):
+        response, sessions_loaded = self.sessions_loaded("/admin/")
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(sessions_loaded)
+        self.assertEqual(
+            self.client.post("/admin/logout/").status_code,
+            status.HTTP_403_FORBIDDEN,
+        )
+
+    def test_live_stream_keeps_sessions(self):
+        # OrderQueueTests logs the counter screen in with a session cookie
+        factory = RequestFactory()
+
+        self.assertTrue(browserless(factory.get(reverse("order-status-update"))))
+        self.assertFalse(browserless(factory.get(reverse("order-stream"))))
+
+
+class BatchRequestTests(TestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        models.Account.objects.create(user=self.user, balance=20)
+        self.client = APIClient()
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Token {Token.objects.create(user=self.user).key}"
+        )
+        make_products(2)
+
+    def batch(self, *calls, atomic=False):
+        return self.client.post(
+            reverse("batch"),
+            {
+                "requests": [
+                    dict(zip(["method", "path", "body"], call)) for call in calls
+                ],
+                "atomic": atomic,
+            },
+            format="json",
+        )
+
+    def balance(self):
+        return models.Account.objects.get_balance(self.user)
+
+    def test_app_launch_in_one_round_trip(self):
+        response = self.batch(
+            ("GET", reverse("accounts")),
+            ("GET", reverse("product-list") + "?fields=id,name"),
+            ("GET", reverse("order-list-create")),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        accounts, products, orders = response.json()["responses"]
+        self.assertEqual(
+            [accounts["status"], products["status"], orders["status"]], [200] * 3
+        )
+        self.assertEqual(accounts["body"], self.client.get(reverse("accounts")).json())
+        self.assertEqual(len(products["body"]["results"]), 2)
+        self.assertEqual(set(products["body"]["results"][0]), {"id", "name"})
+        self.assertIn("ETag", products["headers"])
+        self.assertEqual(orders["body"]["results"], [])
+
+    def test_each_call_checks_its_own_permissions(self):
+        self.client.credentials()
+
+        response = self.batch(
+            ("GET", reverse("product-list")), ("GET", reverse("accounts"))
+        )
+
+        self.assertEqual(
+            [result["status"] for result in response.json()["responses"]], [200, 401]
+        )
+
+    def test_calls_see_the_writes_before_them(self):
+        response = self.batch(
+            ("POST", reverse("account-deposit"), {"depositAmount": "5.00"}),
+            ("GET", reverse("accounts")),
+        )
+
+        deposit, accounts = response.json()["responses"]
+        self.assertEqual(deposit["status"], 200)
+        self.assertEqual(accounts["body"][0]["balance"], "25.00")
+
+    def test_not_modified_pages_after_a_write(self):
+        etag = self.client.get(reverse("product-list"))["ETag"]
+
+        response = self.client.post(
+            reverse("batch"),
+            {
+                "requests": [
+                    {
+                        "method": "POST",
+                        "path": reverse("account-deposit"),
+                        "body": {"depositAmount": "5.00"},
+                    },
+                    {
+                        "method": "GET",
+                        "path": reverse("product-list"),
+                        "headers": {"If-None-Match": etag},
+                    },
+                ]
+            },
+            format="json",
+        )
+
+        deposit, products = response.json()["responses"]
+        self.assertEqual(deposit["status"], 200)
+        self.assertEqual(products["status"], 304)
+        self.assertIsNone(products["body"])
+
+    def test_a_failing_call_doesnt_hide_the_others(self):
+        with (
+            mock.patch("myapp.views.AccountViewSet.list", side_effect=RuntimeError),
+            self.assertLogs("myapp.batch", "ERROR"),
+        ):
+            response = self.batch(
+                ("POST", reverse("account-deposit"), {"depositAmount": "5.00"}),
+                ("GET", reverse("accounts")),
+            )
+
+        self.assertEqual(
+            [result["status"] for result in response.json()["responses"]], [200, 500]
+        )
+        self.assertEqual(self.balance(), Decimal("25.00"))
+
+    def test_atomic_batch_rolls_back_on_failure(self):
+        response = self.batch(
+            ("POST", reverse("account-deposit"), {"depositAmount": "5.00"}),
+            ("POST", reverse("account-widthdrawel"), {"cart_Total": "500.00"}),
+            ("GET", reverse("accounts")),
+            atomic=True,
+        )
+
+        data = response.json()
+        self.assertTrue(data["rolled_back"])
+        self.assertEqual(
+            [result["status"] for result in data["responses"]], [200, 400, 424]
+        )
+        self.assertEqual(self.balance(), Decimal("20.00"))
+
+    def test_atomic_batch_commits(self):
+        response = self.batch(
+            ("POST", reverse("account-deposit"), {"depositAmount": "5.00"}),
+            ("POST", reverse("account-widthdrawel"), {"cart_Total": "10.00"}),
+            atomic=True,
+        )
+
+        self.assertFalse(response.json()["rolled_back"])
+        self.assertEqual(self.balance(), Decimal("15.00"))
+
+    def test_only_plain_api_routes(self):
+        response = self.batch(
+            ("GET", "/admin/"),
+            ("GET", "/api/nothing-here/"),
+            ("GET", reverse("order-stream")),
+            ("POST", reverse("batch")),
+            ("POST", reverse("login"), {"email": "student@example.com"}),
+        )
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(
+            [errors["path"][0] for errors in response.json()["requests"].values()],
+            [
+                "Only /api/ routes can be batched.",
+                "No route for /api/nothing-here/.",
+                "/api/orders/live/ can't be batched.",
+                "/api/batch/ can't be batched.",
+                "/api/login/ can't be batched.",
+            ],
+        )
+
+    def test_calls_show_up_in_metrics(self):
+        registry.reset()
+        self.addCleanup(registry.reset)
+
+        self.batch(("GET", reverse("accounts")), ("GET", reverse("accounts")))
+
+        body = registry.render()
+        self.assertIn(
+            'tuckshop_request_duration_seconds_count{route="accounts"} 2', body
+        )
+        self.assertIn('tuckshop_db_queries_total{route="accounts"} 2', body)
+        self.assertIn('tuckshop_request_duration_seconds_count{route="batch"} 1', body)
+
+
+class ConcurrentBatchReadTests(TransactionTestCase):
+    def setUp(self):
+        self.user = models.User.objects.create_user(
+            email="student@example.com", username="student", password="pass12345"
+        )
+        models.Account.objects.create(user=self.user, balance=20)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        make_products(3)
+
+    @override_settings(BATCH_READ_WORKERS=4)
+    def test_reads_run_side_by_side_and_come_back_in_order(self):
+        calls = [
+            {
+                "method": "GET",
+                "path": f"{reverse('product-list')}?fields=id&page_size={n}",
+            }
+            for n in range(1, 4)
+        ] + [{"method": "GET", "path": reverse("accounts")}]
+
+        with mock.patch(
+            "myapp.batch.ThreadPoolExecutor", wraps=ThreadPoolExecutor
+        ) as pool:
+            response = self.client.post(
+                reverse("batch"), {"requests": calls}, format="json"
+            )
+
+        pool.assert_called_once_with(max_workers=4)
+        results = response.json()["responses"]
+        self.assertEqual([result["status"] for result in results], [200] * 4)
+        self.assertEqual(
+            [len(result["body"]["results"]) for result in results[:3]], [1, 2, 3]
+        )
+        self.assertEqual(results[3]["body"][0]["balance"], "20.00")
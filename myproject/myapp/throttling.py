@@ -0,0 +1,91 @@
+# myapp/throttling.py
+import abc
+import contextlib
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.throttling import BaseThrottle
+
+# a lock left behind by a crashed worker runs out after this many seconds
+BUCKET_LOCK_TIMEOUT = 1
+
+
+@contextlib.contextmanager
+def bucket_lock(key):
+    # cache.add only stores the key if it isnt there yet, and that check is
+    # atomic on every shared backend, so one caller at a time gets past here
+    lock_key = f"{key}:lock"
+    while not cache.add(lock_key, 1, BUCKET_LOCK_TIMEOUT):
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        cache.delete(lock_key)
+
+
+def take_token(key, capacity, per_seconds):
+    # token bucket kept in the cache, holds up to capacity tokens and refills
+    # all of them over per_seconds. the read and the write happen under a lock
+    # so two attempts at the same time cant spend the same token. returns
+    # (allowed, seconds to wait)
+    with bucket_lock(key):
+        now = time.time()
+        rate = capacity / per_seconds
+        tokens, updated_at = cache.get(key, (capacity, now))
+        tokens = min(capacity, tokens + (now - updated_at) * rate)
+
+        if tokens < 1:
+            cache.set(key, (tokens, now), per_seconds)
+            return False, (1 - tokens) / rate
+
+        cache.set(key, (tokens - 1, now), per_seconds)
+        return True, 0
+
+
+class LoginBucketThrottle(BaseThrottle, abc.ABC):
+    # runs before LoginSerializer so a throttled attempt never gets as far as
+    # hashing a password. subclasses pick the scope in LOGIN_RATE_LIMITS and
+    # what the bucket is keyed on
+    scope = None
+
+    @abc.abstractmethod
+    def get_bucket_key(self, request):
+        # None skips the bucket for this request
+        pass
+
+    def allow_request(self, request, view):
+        self.wait_seconds = 0
+
+        key = self.get_bucket_key(request)
+        if key is None:
+            return True
+
+        limits = settings.LOGIN_RATE_LIMITS[self.scope]
+        allowed, self.wait_seconds = take_token(
+            f"login:{self.scope}:{key}", limits["capacity"], limits["per_seconds"]
+        )
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class LoginIPThrottle(LoginBucketThrottle):
+    scope = "ip"
+
+    def get_bucket_key(self, request):
+        # X-Forwarded-For is only trusted as far as NUM_PROXIES says
+        return self.get_ident(request)
+
+
+class LoginEmailThrottle(LoginBucketThrottle):
+    scope = "email"
+
+    def get_bucket_key(self, request):
+        email = request.data.get("email") if hasattr(request.data, "get") else None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        # hashed so odd characters in the email cant break the cache key
+        return hashlib.sha256(email.strip().lower().encode()).hexdigest()
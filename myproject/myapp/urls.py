@@ -41,5 +41,19 @@ urlpatterns = [
         name="account-widthdrawel",
     ),
     path("orders/", OrdersViewSet.as_view(), name="order-list-create"),
+    path("orders/live/", views.order_stream, name="order-stream"),
+    path("orders/export/", views.OrderExportView.as_view(), name="order-export"),
+    path("orders/status/", views.OrderStatusView.as_view(), name="order-status-update"),
+    path("checkout/", views.CheckoutView.as_view(), name="checkout"),
+    path(
+        "cart/reservations/",
+        views.StockReservationView.as_view(),
+        name="stock-reservations",
+    ),
+    path("analytics/sales/", views.SalesSummaryView.as_view(), name="sales-summary"),
+    path("analytics/top-sellers/", views.TopSellersView.as_view(), name="top-sellers"),
+    path("batch/", views.BatchView.as_view(), name="batch"),
+    path("_metrics", views.MetricsView.as_view(), name="metrics"),
+    path("students/bulk/", views.BulkStudentView.as_view(), name="student-bulk-create"),
 ]
 # just some paths
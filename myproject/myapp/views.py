@@ -1,9 +1,15 @@
 # myapp/views.py
 from django.contrib.auth import authenticate, login
 import json
-from django.http import JsonResponse, HttpResponse
+from decimal import Decimal
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.db import connection, transaction
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from rest_framework import generics, viewsets, status
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.exceptions import AuthenticationFailed, ValidationError
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.authtoken.models import Token
@@ -20,6 +26,58 @@ from myapp import models
 from django.shortcuts import render
 from django.http import HttpResponse
 from django.contrib.auth import get_user_model
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from myapp import (
+    batch,
+    catalogue,
+    exports,
+    order_events,
+    provisioning,
+    rollups,
+    search,
+)
+from myapp.authentication import CachedTokenAuthentication
+from myapp.idempotency import idempotent
+from myapp.parsers import CSVTextParser
+from myapp.metrics import registry
+from myapp.throttling import LoginEmailThrottle, LoginIPThrottle
+from myapp.pagination import (
+    OrderCursorPagination,
+    PostCursorPagination,
+    ProductCursorPagination,
+    ProductSearchCursorPagination,
+    ProfileCursorPagination,
+)
+
+
+class CachedListMixin:
+    # caches each serialized page of a public list under the namespace's
+    # version, and answers 304 when the client already has that version
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        version = catalogue.get_version(self.cache_namespace)
+        etag = f'"{version}"'
+        last_modified = catalogue.last_modified(version)
+
+        # phones that already have this version get a 304 without a db hit
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified
+        )
+        if not_modified is not None:
+            return not_modified
+
+        url = request.build_absolute_uri()
+        data = catalogue.get_page(self.cache_namespace, version, url)
+        if data is None:
+            data = super().list(request, *args, **kwargs).data
+            catalogue.set_page(self.cache_namespace, version, url, data)
+
+        response = Response(data)
+        response["ETag"] = etag
+        response["Last-Modified"] = http_date(last_modified)
+        return response
 
 
 class RegisterView(generics.CreateAPIView):
@@ -35,6 +93,7 @@ class RegisterView(generics.CreateAPIView):
 
 class LoginView(generics.GenericAPIView):
     serializer_class = LoginSerializer
+    throttle_classes = [LoginIPThrottle, LoginEmailThrottle]
 
     def post(
         self, request, *args, **kwargs
@@ -62,22 +121,27 @@ class LoginView(generics.GenericAPIView):
         )
 
 
-class UserProfileListCreate(generics.ListCreateAPIView):
-    queryset = UserProfile.objects.all()
+class UserProfileListCreate(CachedListMixin, generics.ListCreateAPIView):
+    queryset = UserProfile.objects.select_related("user")
     serializer_class = UserProfileSerializer
     permission_classes = [AllowAny]
+    pagination_class = ProfileCursorPagination
+    cache_namespace = "profiles"
 
 
 class UserProfileDetail(generics.RetrieveUpdateDestroyAPIView):
-    queryset = UserProfile.objects.all()
+    queryset = UserProfile.objects.select_related("user")
     serializer_class = UserProfileSerializer
     permission_classes = [AllowAny]
 
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all()
+class PostViewSet(CachedListMixin, viewsets.ModelViewSet):
+    # author prints as author.user.username, so both get joined in
+    queryset = Post.objects.select_related("author__user")
     serializer_class = PostSerializer
     permission_classes = [AllowAny]
+    pagination_class = PostCursorPagination
+    cache_namespace = "posts"
 
 
 class ProductViewSet(viewsets.ModelViewSet):
@@ -88,10 +152,50 @@ class ProductViewSet(viewsets.ModelViewSet):
         return Response(request, "your_template.html", context)
 
 
-class ProductsListView(generics.ListAPIView):
+class ProductsListView(CachedListMixin, generics.ListAPIView):
     queryset = models.Product.objects.all()
     serializer_class = serializers.ProductSerializer
     permission_classes = [AllowAny]
+    pagination_class = ProductCursorPagination
+    cache_namespace = "catalogue"
+
+    @property
+    def paginator(self):
+        # searches page through the ranked results instead of by id
+        if not hasattr(self, "_paginator"):
+            if "q" in self.request.query_params:
+                self._paginator = ProductSearchCursorPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+
+        product_type = self.request.query_params.get("type")
+        if product_type is not None:
+            if product_type not in dict(models.Product.TYPE_CHOICES):
+                raise ValidationError({"type": [f"Unknown type {product_type!r}."]})
+            queryset = queryset.filter(type=product_type)
+
+        q = self.request.query_params.get("q")
+        if q is not None:
+            queryset = search.search(queryset, q, connection.vendor)
+
+        # only load the columns that ?fields= asked for
+        wanted = serializers.requested_fields(self.request)
+        if "srcset" in wanted:
+            wanted.add("image_variants")
+        if "available" in wanted:
+            wanted.add("quantity")
+        columns = [
+            field.name
+            for field in models.Product._meta.concrete_fields
+            if field.name in wanted
+        ]
+        if columns:
+            queryset = queryset.only("id", *columns)
+        return queryset
 
 
 class AccountViewSet(generics.ListCreateAPIView):
@@ -110,6 +214,7 @@ class DepositView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.DepositSerializer
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
@@ -117,19 +222,19 @@ class DepositView(generics.UpdateAPIView):
         deposit_amount = serializer.validated_data["depositAmount"]
 
         try:
-            account = models.Account.objects.get(user=self.request.user)
-            account.balance += deposit_amount
-            account.save()
+            new_balance = models.Account.objects.deposit(
+                self.request.user, deposit_amount
+            )
+            if new_balance is None:
+                return Response(
+                    {"detail": "Account not found for user."},
+                    status=status.HTTP_404_NOT_FOUND,
+                )
 
             return Response(
-                {"detail": "Deposit successful", "new_balance": account.balance},
+                {"detail": "Deposit successful", "new_balance": new_balance},
                 status=status.HTTP_200_OK,
             )
-        except models.Account.DoesNotExist:
-            return Response(
-                {"detail": "Account not found for user."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
         except Exception as e:
             print(f"Database error during deposit: {e}")
             return Response(
@@ -142,39 +247,35 @@ class WithdrawelView(generics.UpdateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = serializers.WithdrawelSerializer
 
+    @idempotent
     def post(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        cart_Total = serializer.validated_data["cart_Total"]
+        withdrawal_amount = serializer.validated_data["cart_Total"]
 
         try:
-            account = models.Account.objects.get(user=self.request.user)
-
-            from decimal import Decimal
-
-            withdrawal_amount = Decimal(str(cart_Total))
-
-            if account.balance < withdrawal_amount:
+            new_balance = models.Account.objects.withdraw(
+                self.request.user, withdrawal_amount
+            )
+            if new_balance is None:
+                # only the failure path needs to know why it failed
+                if not models.Account.objects.filter(user=self.request.user).exists():
+                    return Response(
+                        {"detail": "Account not found for user."},
+                        status=status.HTTP_404_NOT_FOUND,
+                    )
                 return Response(
                     {"detail": "Insufficient balance."},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            account.balance -= withdrawal_amount
-            account.save()
-
             return Response(
                 {
                     "detail": "withdrawel successful",
-                    "new_balance": float(account.balance),
+                    "new_balance": float(new_balance),
                 },
                 status=status.HTTP_200_OK,
             )
-        except models.Account.DoesNotExist:
-            return Response(
-                {"detail": "Account not found for user."},
-                status=status.HTTP_404_NOT_FOUND,
-            )
         except Exception as e:
             import traceback
 
@@ -189,8 +290,281 @@ class WithdrawelView(generics.UpdateAPIView):
 class OrdersViewSet(generics.ListCreateAPIView):
     serializer_class = serializers.OrdersSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    @idempotent
+    def post(self, request, *args, **kwargs):
+        return super().post(request, *args, **kwargs)
 
     def get_queryset(self):
-        return models.Order.objects.filter(user=self.request.user).order_by(
-            "-created_at"
+        # newest first for one user is covered by the (user, -order_date) index
+        return (
+            models.Order.objects.filter(user=self.request.user)
+            .select_related("user")
+            .prefetch_related(serializers.order_items_prefetch())
+            .order_by("-order_date")
+        )
+
+
+class CheckoutView(generics.CreateAPIView):
+    serializer_class = serializers.CheckoutSerializer
+    permission_classes = [IsAuthenticated]
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+
+        return Response(
+            {
+                "detail": "Checkout successful",
+                "new_balance": float(serializer.new_balance),
+                "order": serializer.data,
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class StockReservationView(APIView):
+    # GET lists what the user's cart is holding, POST sets it. see
+    # myapp/reservations.py
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        return Response(self.held(request.user))
+
+    def post(self, request, *args, **kwargs):
+        serializer = serializers.CartReservationSerializer(
+            data=request.data, context={"request": request}
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        return Response(self.held(request.user))
+
+    def held(self, user):
+        reservations = (
+            models.StockReservation.objects.filter(user=user)
+            .select_related("product")
+            .order_by("product_id")
+        )
+        return serializers.StockReservationSerializer(reservations, many=True).data
+
+
+class OrderStatusView(APIView):
+    # staff move a batch of orders along STATUS_CHOICES with one UPDATE. orders
+    # only go forwards, any already at or past the new status are left alone
+    # and arent announced
+    permission_classes = [IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        serializer = serializers.OrderStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        new_status = serializer.validated_data["status"]
+
+        statuses = [choice for choice, _ in models.Order.STATUS_CHOICES]
+        earlier = statuses[: statuses.index(new_status)]
+        with transaction.atomic(savepoint=False):
+            # the rows that will move are locked first, so the ones announced
+            # are exactly the ones this update moved
+            moving = list(
+                models.Order.objects.select_for_update()
+                .filter(id__in=ids, status__in=earlier)
+                .values_list("id", flat=True)
+            )
+            updated = models.Order.objects.filter(id__in=moving).update(
+                status=new_status
+            )
+
+        if updated:
+            moved = (
+                models.Order.objects.filter(id__in=moving)
+                .select_related("user")
+                .prefetch_related(serializers.order_items_prefetch())
+            )
+            transaction.on_commit(
+                lambda: serializers.announce_orders("order_updated", moved)
+            )
+
+        return Response({"updated": updated, "status": new_status})
+
+
+class OrderExportView(APIView):
+    # every order item with its order and product, as csv or json lines, for
+    # finance. streamed as its read so it never holds the whole term in memory
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        serializer = serializers.OrderExportSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+
+        rows = exports.export_rows(
+            date_from=options.get("date_from"),
+            date_to=options.get("date_to"),
+            statuses=options.get("status"),
+        )
+        write_lines, content_type = exports.FORMATS[options["output"]]
+        response = StreamingHttpResponse(write_lines(rows), content_type=content_type)
+        response["Content-Disposition"] = (
+            f'attachment; filename="{exports.filename(options)}"'
+        )
+        return response
+
+
+class SalesSummaryView(APIView):
+    # revenue and units for a date range, in total and per product type. only
+    # reads the rollups (myapp/rollups.py), never the orders
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        serializer = serializers.SalesRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        date_from = serializer.validated_data["date_from"]
+        date_to = serializer.validated_data["date_to"]
+
+        by_type = list(rollups.sales_by_type(date_from, date_to))
+        return Response(
+            {
+                "date_from": date_from,
+                "date_to": date_to,
+                "units": sum(row["units"] for row in by_type),
+                "revenue": sum((row["revenue"] for row in by_type), Decimal("0")),
+                "by_type": by_type,
+            }
+        )
+
+
+class TopSellersView(APIView):
+    # best selling products by units for a date range, from the rollups
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        serializer = serializers.SalesRangeSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        options = serializer.validated_data
+
+        return Response(
+            {
+                "date_from": options["date_from"],
+                "date_to": options["date_to"],
+                "results": rollups.top_sellers(
+                    options["date_from"], options["date_to"], options["limit"]
+                ),
+            }
+        )
+
+
+# what the counter still has to deal with
+OPEN_ORDER_STATUSES = ["Pending", "Processing"]
+OPEN_ORDER_LIMIT = 200
+
+
+def open_orders_snapshot():
+    orders = (
+        models.Order.objects.filter(status__in=OPEN_ORDER_STATUSES)
+        .select_related("user")
+        .prefetch_related(serializers.order_items_prefetch())
+        .order_by("order_date")[:OPEN_ORDER_LIMIT]
+    )
+    return order_events.snapshot_event(
+        serializers.OrdersSerializer(orders, many=True).data
+    )
+
+
+async def stream_user(request):
+    # counter screens are logged into the admin so they send the session
+    # cookie (EventSource cant set headers), anything else can send its token
+    header = request.headers.get("Authorization", "").split()
+    if len(header) == 2 and header[0] == "Token":
+        authentication = CachedTokenAuthentication()
+        try:
+            user, _ = await sync_to_async(authentication.authenticate_credentials)(
+                header[1]
+            )
+        except AuthenticationFailed:
+            return None
+        return user
+    return await request.auser()
+
+
+async def order_stream(request):
+    # the live order queue as server sent events, see myapp/order_events.py.
+    # only works under myproject/asgi.py. under wsgi django reads an async
+    # stream to the end before sending any of it, and this one never ends, so
+    # it would hang the worker without the screen ever getting an event
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse(
+            {"detail": "The live order stream needs the ASGI server."},
+            status=status.HTTP_501_NOT_IMPLEMENTED,
+        )
+
+    user = await stream_user(request)
+    if user is None or not user.is_staff:
+        return JsonResponse(
+            {"detail": "You do not have permission to perform this action."},
+            status=status.HTTP_403_FORBIDDEN,
+        )
+
+    response = StreamingHttpResponse(
+        order_events.stream(sync_to_async(open_orders_snapshot)),
+        content_type="text/event-stream",
+    )
+    response["Cache-Control"] = "no-cache"
+    # stops nginx buffering the stream
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+class BatchView(APIView):
+    # several api calls in one round trip, see myapp/batch.py. each one checks
+    # its own permissions, so the batch itself is open
+    permission_classes = [AllowAny]
+
+    def post(self, request, *args, **kwargs):
+        serializer = serializers.BatchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        results, rolled_back = batch.run(
+            request,
+            serializer.validated_data["requests"],
+            atomic=serializer.validated_data["atomic"],
+        )
+        return Response({"rolled_back": rolled_back, "responses": results})
+
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(registry.render(), content_type="text/plain; version=0.0.4")
+
+
+class BulkStudentView(APIView):
+    # staff upload a csv of email,username,password (as the body or as a
+    # "file" upload) and get one json line back per row as it gets saved
+    permission_classes = [IsAdminUser]
+    parser_classes = [CSVTextParser, MultiPartParser]
+
+    def post(self, request, *args, **kwargs):
+        if isinstance(request.data, str):
+            text = request.data
+        elif "file" in request.data:
+            text = request.data["file"].read().decode("utf-8-sig")
+        else:
+            return Response(
+                {"detail": "Send the CSV as the request body or as a file upload."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            rows = provisioning.read_csv(text)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        results = provisioning.provision(rows, pool=provisioning.shared_pool())
+        return StreamingHttpResponse(
+            (json.dumps(result) + "\n" for result in results),
+            content_type="application/x-ndjson",
         )
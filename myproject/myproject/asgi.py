@@ -11,6 +11,26 @@ import os
 
 from django.core.asgi import get_asgi_application
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'myproject.settings')
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myproject.settings")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# imported after django is set up
+from myapp.order_events import broker  # noqa: E402
+
+
+async def application(scope, receive, send):
+    # django doesn't answer lifespan messages itself. on shutdown the live
+    # order streams (api/orders/live/) are ended so the server can stop
+    # instead of waiting on screens that never disconnect
+    if scope["type"] != "lifespan":
+        return await django_application(scope, receive, send)
+
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            broker.close()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
@@ -54,15 +54,22 @@ AUTHENTICATION_BACKENDS = [
     "django.contrib.auth.backends.ModelBackend",
 ]
 MIDDLEWARE = [
+    "myapp.middleware.PerformanceMiddleware",  # first so it times everything
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    # these four skip SESSIONLESS_PATHS, see myapp/middleware.py
+    "myapp.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.common.CommonMiddleware",
-    "django.middleware.csrf.CsrfViewMiddleware",
-    "django.contrib.auth.middleware.AuthenticationMiddleware",
-    "django.contrib.messages.middleware.MessageMiddleware",
+    "myapp.middleware.CsrfViewMiddleware",
+    "myapp.middleware.AuthenticationMiddleware",
+    "myapp.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
+# the api only takes tokens, so it doesnt need sessions, csrf or messages
+SESSIONLESS_PATHS = ["/api/"]
+# apart from the live order stream, counter screens send the admin session
+# cookie to it
+SESSION_PATHS = ["/api/orders/live/"]
 
 CORS_ALLOW_ALL_ORIGINS = True  # Set to True for now, as you are testing
 CORS_ALLOWED_HEADERS = [
@@ -101,19 +108,92 @@ TEMPLATES = [
 ]
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework.authentication.TokenAuthentication",
+        "myapp.authentication.CachedTokenAuthentication",
     ),
+    # reverse proxies in front of the app. throttles take the client ip from
+    # X-Forwarded-For only this many hops deep, with 0 the header is ignored
+    # and REMOTE_ADDR is used, so a client cant pick its own ip
+    "NUM_PROXIES": int(os.environ.get("NUM_PROXIES", 0)),
 }
+# tokens are cached in each process for up to this many seconds
+TOKEN_CACHE_MAX_SIZE = 1024
+TOKEN_CACHE_TTL = 300
 WSGI_APPLICATION = "myproject.wsgi.application"
 AUTH_USER_MODEL = "myapp.User"
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
+# DB_ENGINE=postgres for the deployed server, anything else is local sqlite
+DB_ENGINE = os.environ.get("DB_ENGINE", "sqlite")
+
+if DB_ENGINE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.environ.get("DB_NAME", "eunoiatuck"),
+            "USER": os.environ.get("DB_USER", "eunoiatuck"),
+            "PASSWORD": os.environ.get("DB_PASSWORD", ""),
+            "HOST": os.environ.get("DB_HOST", "localhost"),
+            "PORT": os.environ.get("DB_PORT", "5432"),
+            # keep connections open between requests and check theyre still
+            # alive before reusing them
+            "CONN_MAX_AGE": int(os.environ.get("DB_CONN_MAX_AGE", 600)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
+    }
+    if os.environ.get("DB_POOL"):
+        # psycopg's pool does the reusing itself, django needs CONN_MAX_AGE=0
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.environ.get("DB_POOL_MIN", 2)),
+            "max_size": int(os.environ.get("DB_POOL_MAX", 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ.get("DB_NAME", BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {
+                # take the write lock at the start of a transaction, a wallet
+                # change is several statements and a deferred transaction can
+                # fail outright if another writer gets in between
+                "transaction_mode": "IMMEDIATE",
+            },
+            # a file rather than the shared in-memory database, so tests with
+            # concurrent writers wait on the lock like the real thing does
+            "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
+        }
+    }
+
+# applied to every new sqlite connection by myapp.signals. busy_timeout makes
+# writers wait for the lock instead of failing straight away with "database is
+# locked". WAL lets reads carry on during a write, but it changes the database
+# file for good and leaves -wal/-shm files next to it, so it is only switched
+# on with SQLITE_JOURNAL_MODE=WAL for a database that isnt checked in
+SQLITE_JOURNAL_MODE = os.environ.get("SQLITE_JOURNAL_MODE", "DELETE").upper()
+SQLITE_PRAGMAS = {
+    "journal_mode": SQLITE_JOURNAL_MODE,
+    # NORMAL only stays safe through a power cut in WAL mode
+    "synchronous": "NORMAL" if SQLITE_JOURNAL_MODE == "WAL" else "FULL",
+    "busy_timeout": 5000,
+    "mmap_size": 128 * 1024 * 1024,
+    "cache_size": -16000,
+    "temp_store": "MEMORY",
+}
+
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+# local memory is per process, if this ever runs with more than one worker
+# process it needs a shared backend (file or redis) so they all see the same
+# catalogue version
+CACHES = {
     "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "eunoiatuck",
     }
 }
 
@@ -137,6 +217,47 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+PASSWORD_HASHERS = [
+    "myapp.hashers.TunedPBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+# cost of each password hash, lower means cheaper logins but weaker hashes
+PASSWORD_HASH_ITERATIONS = int(os.environ.get("PASSWORD_HASH_ITERATIONS", 1_000_000))
+
+# processes used to hash passwords when provisioning students in bulk
+PROVISIONING_HASH_WORKERS = int(
+    os.environ.get("PROVISIONING_HASH_WORKERS", os.cpu_count() or 1)
+)
+
+# how old an order has to be before the sales rollups count it. sqlite
+# commits orders one at a time in id order so it can be 0, on postgres a
+# lower id can still be in flight when a higher one has committed
+SALES_ROLLUP_SETTLE_SECONDS = int(
+    os.environ.get("SALES_ROLLUP_SETTLE_SECONDS", 30 if DB_ENGINE == "postgres" else 0)
+)
+
+# how long a response kept for an Idempotency-Key header gets replayed for
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+
+# how long stock held for a cart stays off the shelf without an order
+STOCK_RESERVATION_TTL = 10 * 60
+
+# threads a /api/batch/ request runs its GETs on side by side. sqlite queries
+# run in process and hold the GIL, so there threads only add connection setup
+BATCH_READ_WORKERS = int(
+    os.environ.get("BATCH_READ_WORKERS", 4 if DB_ENGINE == "postgres" else 1)
+)
+
+# token buckets for /api/login/, capacity attempts that refill over per_seconds
+LOGIN_RATE_LIMITS = {
+    "email": {"capacity": 5, "per_seconds": 300},
+    "ip": {"capacity": 30, "per_seconds": 60},
+}
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
 
@@ -162,3 +283,7 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 MEDIA_URL = "/api/product_images/"
 
 MEDIA_ROOT = os.path.join(BASE_DIR, "media")
+
+# widths of the webp copies made of each product image
+PRODUCT_IMAGE_WIDTHS = [160, 320, 640]
+PRODUCT_IMAGE_QUALITY = 80